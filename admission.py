@@ -0,0 +1,357 @@
+import os
+import math
+import time
+import heapq
+import logging
+import threading
+from contextlib import contextmanager
+
+from profiler import stage
+
+logger = logging.getLogger(__name__)
+
+CLIENT_HEADER = "X-Client-Id"
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get("ADMISSION_MAX_CONCURRENCY", "16"))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "64"))
+# Requests per second and burst size; a rate of 0 disables that limit
+RATE_LIMIT_GLOBAL = float(os.environ.get("RATE_LIMIT_GLOBAL", "0"))
+RATE_LIMIT_GLOBAL_BURST = float(os.environ.get("RATE_LIMIT_GLOBAL_BURST", "40"))
+RATE_LIMIT_PER_CLIENT = float(os.environ.get("RATE_LIMIT_PER_CLIENT", "0"))
+RATE_LIMIT_PER_CLIENT_BURST = float(os.environ.get("RATE_LIMIT_PER_CLIENT_BURST", "10"))
+# Clients are told apart by their address. Only behind a proxy that sets the
+# X-Client-Id header itself (and drops it from incoming requests) may the
+# header be trusted instead; otherwise callers could rotate it to dodge limits
+ADMISSION_TRUST_CLIENT_HEADER = os.environ.get("ADMISSION_TRUST_CLIENT_HEADER", "0").lower() in ("1", "true", "yes")
+
+# Lower priority values are served first; timeouts bound the time spent queued
+LANE_PRIORITIES = {"chat": 0, "image": 1, "batch": 2}
+LANE_TIMEOUTS = {"chat": 5.0, "image": 10.0, "batch": 30.0}
+
+MAX_IDLE_CLIENTS = 10000
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status, message, retry_after):
+        """
+        Raised when a request cannot be admitted.
+
+        Args:
+            status (int): 429 when a rate limit was hit, 503 when saturated
+            message (str): Error message for the client
+            retry_after (float): Suggested wait in seconds
+        """
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        """
+        Token bucket refilled at rate tokens per second up to burst tokens.
+
+        Not thread-safe on its own; AdmissionController holds its lock.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost=1, now=None):
+        """
+        Take cost tokens if available.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise the seconds until
+            enough tokens will be available
+        """
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        if cost > self.burst:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class _Waiter:
+    __slots__ = ("lane", "deadline", "event", "granted", "cancelled")
+
+    def __init__(self, lane, deadline):
+        self.lane = lane
+        self.deadline = deadline
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency=ADMISSION_MAX_CONCURRENCY, queue_size=ADMISSION_QUEUE_SIZE,
+                 global_rate=RATE_LIMIT_GLOBAL, global_burst=RATE_LIMIT_GLOBAL_BURST,
+                 client_rate=RATE_LIMIT_PER_CLIENT, client_burst=RATE_LIMIT_PER_CLIENT_BURST,
+                 lane_timeouts=None):
+        """
+        Rate limits and a priority queue in front of the upstream model.
+
+        Requests first pay into a global and a per-client token bucket and
+        are rejected with 429 when either is empty. Admitted requests then
+        need one of max_concurrency slots; when all are taken they wait in a
+        bounded queue ordered by lane priority (interactive chat before
+        image analysis before batch), then arrival. A full queue, or a wait
+        that outlasts the lane's timeout, is rejected with 503. Both
+        rejections carry a Retry-After estimate.
+
+        Args:
+            max_concurrency (int): Requests allowed to call upstream at once
+            queue_size (int): Most requests waiting for a slot
+            global_rate (float): Requests per second across all clients (0 = unlimited)
+            global_burst (float): Global bucket size
+            client_rate (float): Requests per second per client (0 = unlimited)
+            client_burst (float): Per-client bucket size
+            lane_timeouts (dict, optional): Longest queue wait per lane in seconds
+        """
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.lane_timeouts = dict(LANE_TIMEOUTS, **(lane_timeouts or {}))
+
+        self._global_bucket = TokenBucket(global_rate, global_burst) if global_rate > 0 else None
+        self._client_buckets = {}
+        self._lock = threading.Lock()
+        self._queue = []
+        self._sequence = 0
+        self._waiting = 0
+        self._in_flight = 0
+        # Smoothed time a slot is held, for Retry-After estimates
+        self._hold_seconds = 1.0
+        self._counters = {"admitted": 0, "queued": 0, "rate_limited": 0, "queue_full": 0, "queue_timeout": 0}
+
+    def charge(self, client_id, cost=1):
+        """
+        Take cost tokens from the global and the client's bucket.
+
+        Raises:
+            AdmissionRejected: 429 if either bucket is short
+        """
+        with self._lock:
+            now = time.monotonic()
+            buckets = []
+            if self._global_bucket is not None:
+                buckets.append(self._global_bucket)
+            if self.client_rate > 0:
+                bucket = self._client_buckets.get(client_id)
+                if bucket is None:
+                    self._prune_clients(now)
+                    bucket = TokenBucket(self.client_rate, self.client_burst)
+                    self._client_buckets[client_id] = bucket
+                buckets.append(bucket)
+
+            waits = [bucket.take(cost, now) for bucket in buckets]
+            wait = max(waits, default=0.0)
+            if wait > 0:
+                # Refund the buckets that did have room so a rejection is free
+                for bucket, bucket_wait in zip(buckets, waits):
+                    if bucket_wait == 0:
+                        bucket.tokens += cost
+                self._counters["rate_limited"] += 1
+                retry_after = wait if wait != math.inf else 60.0
+                raise AdmissionRejected(429, "Too many requests", retry_after)
+
+    def max_cost(self):
+        """
+        The largest cost charge() can ever accept: the smallest burst of
+        the enabled buckets, or None when no rate limit is on.
+        """
+        bursts = []
+        if self._global_bucket is not None:
+            bursts.append(self._global_bucket.burst)
+        if self.client_rate > 0:
+            bursts.append(self.client_burst)
+        return int(min(bursts)) if bursts else None
+
+    def charge_batch(self, client_id, count):
+        """
+        Charge a request that paid one token on admission for count units
+        of work, such as the messages of a batch.
+
+        If the rest cannot be charged, the admission token is refunded too,
+        so a rejected batch costs nothing.
+
+        Raises:
+            ValueError: If count exceeds max_cost(), so the request could
+                never be admitted however long the client waits
+            AdmissionRejected: 429 if the buckets are short right now
+        """
+        limit = self.max_cost()
+        if limit is not None and count > limit:
+            self.refund(client_id)
+            raise ValueError(f"Too many items for the rate limit (max {limit} per request)")
+        try:
+            self.charge(client_id, count - 1)
+        except AdmissionRejected:
+            self.refund(client_id)
+            raise
+
+    def refund(self, client_id, cost=1):
+        """Return tokens taken by charge() for work that will not run."""
+        with self._lock:
+            buckets = [self._global_bucket, self._client_buckets.get(client_id) if self.client_rate > 0 else None]
+            for bucket in buckets:
+                if bucket is not None:
+                    bucket.tokens = min(bucket.burst, bucket.tokens + cost)
+
+    def acquire(self, lane, timeout=None):
+        """
+        Wait for an upstream slot.
+
+        Args:
+            lane (str): "chat", "image" or "batch"
+            timeout (float, optional): Longest wait; defaults to the lane timeout
+
+        Returns:
+            float: Monotonic time the slot was granted, to pass to release()
+
+        Raises:
+            AdmissionRejected: 503 if the queue is full or the wait timed out
+        """
+        timeout = self.lane_timeouts.get(lane, 10.0) if timeout is None else timeout
+        with self._lock:
+            if self._in_flight < self.max_concurrency and not self._waiting:
+                self._in_flight += 1
+                self._counters["admitted"] += 1
+                return time.monotonic()
+
+            if self._waiting >= self.queue_size:
+                self._counters["queue_full"] += 1
+                raise AdmissionRejected(503, "Server is busy, please retry", self._retry_estimate())
+
+            waiter = _Waiter(lane, time.monotonic() + timeout)
+            self._sequence += 1
+            heapq.heappush(self._queue, (LANE_PRIORITIES.get(lane, len(LANE_PRIORITIES)), self._sequence, waiter))
+            self._waiting += 1
+            self._counters["queued"] += 1
+
+        waiter.event.wait(timeout)
+
+        with self._lock:
+            if waiter.granted:
+                self._counters["admitted"] += 1
+                return time.monotonic()
+            if not waiter.cancelled:
+                waiter.cancelled = True
+                self._waiting -= 1
+            self._counters["queue_timeout"] += 1
+            raise AdmissionRejected(503, "Server is busy, please retry", self._retry_estimate())
+
+    def release(self, acquired_at):
+        """Return a slot, handing it to the highest priority live waiter."""
+        with self._lock:
+            held = time.monotonic() - acquired_at
+            self._hold_seconds += 0.1 * (held - self._hold_seconds)
+
+            now = time.monotonic()
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                if waiter.deadline <= now:
+                    # Its thread is about to time out; skip it rather than hand it a slot it will drop
+                    waiter.cancelled = True
+                    self._waiting -= 1
+                    continue
+                waiter.granted = True
+                self._waiting -= 1
+                waiter.event.set()
+                return
+            self._in_flight -= 1
+
+    @contextmanager
+    def slot(self, lane, timeout=None):
+        """Hold an upstream slot for the duration of the block."""
+        with stage("admission_wait"):
+            acquired_at = self.acquire(lane, timeout)
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+
+    def stats(self):
+        with self._lock:
+            waiting = {}
+            for _, _, waiter in self._queue:
+                if not waiter.cancelled and not waiter.granted:
+                    waiting[waiter.lane] = waiting.get(waiter.lane, 0) + 1
+            return {
+                "max_concurrency": self.max_concurrency,
+                "queue_size": self.queue_size,
+                "in_flight": self._in_flight,
+                "waiting": waiting,
+                "mean_hold_ms": round(self._hold_seconds * 1000, 1),
+                "tracked_clients": len(self._client_buckets),
+                **self._counters,
+            }
+
+    def _retry_estimate(self):
+        return self._hold_seconds * (self._waiting + 1) / max(self.max_concurrency, 1)
+
+    def _prune_clients(self, now):
+        # A full bucket behaves exactly like a new one, so idle clients can be forgotten
+        if len(self._client_buckets) < MAX_IDLE_CLIENTS:
+            return
+        for client_id in [c for c, bucket in self._client_buckets.items() if bucket.is_full(now)]:
+            del self._client_buckets[client_id]
+
+    def init_app(self, app, lanes, rate_limited=()):
+        """
+        Register the admission hooks on a Flask app.
+
+        Args:
+            app (Flask): The application
+            lanes (dict): Endpoint name -> lane; these requests are rate
+                limited and hold an upstream slot for their whole duration
+            rate_limited (tuple): Endpoints that are only rate limited here
+                and take slots themselves (e.g. one per batch item)
+        """
+        from flask import request, g, jsonify
+
+        @app.errorhandler(AdmissionRejected)
+        def _rejected(error):
+            logger.warning("Rejected %s %s with %s: %s", request.method, request.path, error.status, error.message)
+            response = jsonify({"error": error.message})
+            response.status_code = error.status
+            response.headers["Retry-After"] = error.retry_after_header()
+            return response
+
+        @app.before_request
+        def _admit_request():
+            lane = lanes.get(request.endpoint)
+            if lane is None and request.endpoint not in rate_limited:
+                return
+            self.charge(client_id())
+            if lane is not None:
+                with stage("admission_wait"):
+                    g.admission_slot = self.acquire(lane)
+
+        @app.teardown_request
+        def _release_request(exc=None):
+            acquired_at = g.pop("admission_slot", None)
+            if acquired_at is not None:
+                self.release(acquired_at)
+
+
+def client_id():
+    """Identify the caller of the current request for per-client limits."""
+    from flask import request
+    if ADMISSION_TRUST_CLIENT_HEADER and request.headers.get(CLIENT_HEADER):
+        return request.headers[CLIENT_HEADER]
+    return request.remote_addr or "unknown"
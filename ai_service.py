@@ -1,22 +1,12 @@
-import os
+import time
 import logging
-from azure.ai.inference import ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage, AssistantMessage
-from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
-
-load_dotenv()
+from azure_clients import get_settings
+from profiler import stage
+from upstream import complete
+from routing import router
 
 logger = logging.getLogger(__name__)
 
-token = os.environ.get("AZURE_API_KEY", "you_key_here")
-endpoint = os.environ.get("AZURE_ENDPOINT", "https://models.inference.ai.azure.com")
-model_name = os.environ.get("AZURE_MODEL_NAME", "gpt-4o")
-
-client = ChatCompletionsClient(
-    endpoint=endpoint,
-    credential=AzureKeyCredential(token),
-)
 
 def get_ai_response(user_input, context=None):
     """
@@ -30,6 +20,12 @@ def get_ai_response(user_input, context=None):
         str: The AI's response
     """
     try:
+        from azure.ai.inference.models import SystemMessage, UserMessage, AssistantMessage
+
+        settings = get_settings()
+        token = settings["token"]
+        model_name = settings["chat_model_name"]
+
         messages = [
             SystemMessage(
                 "You are a healthcare assistant providing brief, accurate medical information. "
@@ -45,27 +41,32 @@ def get_ai_response(user_input, context=None):
         messages.append(UserMessage(user_input))
 
         logger.info("Sending request to Azure AI")
-        logger.info(f"Using token: {token[:5]}...{token[-4:]} (partial for security)")
-        logger.info(f"Using model: {model_name}")
+        logger.info("Using token: %s...%s (partial for security)", token[:5], token[-4:])
+        logger.info("Using model: %s", model_name)
 
         # Get response from Azure
-        response = client.complete(
-            messages=messages,
-            temperature=0.7,
-            top_p=0.95,
-            max_tokens=150,
-            model=model_name
-        )
+        route = router.choose(user_input)
+        with stage("upstream"):
+            start = time.perf_counter()
+            response = complete(
+                "chat",
+                messages=messages,
+                temperature=0.7,
+                top_p=0.95,
+                max_tokens=150,
+                model=route.model
+            )
+            router.record(route, time.perf_counter() - start)
 
         answer = response.choices[0].message.content
-        logger.info(f"Received response from Azure AI: {answer[:50]}...")
+        logger.info("Received response from Azure AI: %s...", answer[:50])
 
         return answer
 
     except Exception as e:
-        logger.error(f"Error type: {type(e).__name__}")
-        logger.error(f"Error message: {str(e)}")
-        logger.error(f"Error details: {repr(e)}")
+        logger.error("Error type: %s", type(e).__name__)
+        logger.error("Error message: %s", e)
+        logger.error("Error details: %r", e)
 
         if "quota" in str(e).lower() or "exceeded" in str(e).lower():
             return "I'm unable to respond due to API quota limitations. The account has reached its usage limit."
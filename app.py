@@ -1,33 +1,58 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, send_file, stream_with_context
 import logging
 import os
-import base64
+import json
 from werkzeug.utils import secure_filename
 import uuid
 from dotenv import load_dotenv
 
 load_dotenv()
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+from log_pipeline import configure_logging
+
+configure_logging()
 logger = logging.getLogger(__name__)
 
 from knowledge_base import AzureKnowledgeBase, get_ai_response_with_knowledge_azure
 from ai_service import get_ai_response
-from image_service import get_ai_response_for_image
+from image_service import (MAX_IMAGES_PER_REQUEST, analyze_each, cached_analysis, encode_images,
+                           get_ai_response_for_image, get_ai_response_for_images)
+from image_cache import analysis_cache
+from batch_chat import (BATCH_MAX_CONCURRENCY, CATEGORY_ERROR, CONVERSATION_ERROR, last_assistant_message, parse_batch,
+                        run_batch, valid_category)
+from profiler import RequestProfiler, annotate, stage
+from request_capture import RequestCapture
+from admission import AdmissionController, AdmissionRejected, client_id
+from upstream import upstream
+from routing import router
+from assets import AssetPipeline
+from image_previews import PreviewGenerator
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 app.secret_key = os.urandom(24)
 
 UPLOAD_FOLDER = 'uploads'
+DEFAULT_CATEGORIES = [c.strip() for c in os.environ.get("KB_CATEGORIES", "").split(",") if c.strip()] or None
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+previews = PreviewGenerator(UPLOAD_FOLDER)
+
+request_profiler = RequestProfiler()
+request_profiler.init_app(app)
+
+request_capture = RequestCapture()
+request_capture.init_app(app)
+
+admission = AdmissionController()
+admission.init_app(app, lanes={"chat": "chat", "analyze_image": "image"}, rate_limited=("chat_batch", "analyze_images"))
+
+assets = AssetPipeline(app)
+previews.init_app(app)
+
 knowledge_base = AzureKnowledgeBase(data_path="knowledge/medical_conditions")
 
 
@@ -36,6 +61,20 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def resolve_categories(category, user_input):
+    """
+    Turn the optional category filter of a chat request into a category list.
+
+    "auto" asks the knowledge base to infer the categories from the question;
+    without a filter the deployment default (KB_CATEGORIES) applies.
+    """
+    if category == "auto":
+        return knowledge_base.infer_categories(user_input) or DEFAULT_CATEGORIES
+    if category:
+        return [category] if isinstance(category, str) else category
+    return DEFAULT_CATEGORIES
+
+
 @app.route("/")
 def index():
     """Serve the main chat interface page"""
@@ -51,7 +90,8 @@ def about():
 @app.route("/admin")
 def admin():
     """Admin interface for managing the knowledge base"""
-    documents = knowledge_base.documents
+    # A copy, so a delete moving documents around cannot change the list mid-render
+    documents = list(knowledge_base.documents)
     return render_template('admin.html', documents=documents)
 
 
@@ -67,22 +107,157 @@ def add_document():
 
     success = knowledge_base.add_document(title, content, category)
     if success:
-        logger.info(f"Added new document: {title}")
+        logger.info("Added new document: %s", title)
         return redirect(url_for('admin'))
     else:
         return jsonify({"error": "Failed to add document"}), 500
 
 
+@app.route("/admin/documents/<doc_id>", methods=["GET", "PUT", "DELETE"])
+def manage_document(doc_id):
+    """Show, edit or delete one knowledge base document by its id"""
+    if request.method == "DELETE":
+        try:
+            deleted = knowledge_base.delete_document(doc_id)
+        except Exception as e:
+            logger.error("Error deleting document %s: %s", doc_id, e)
+            return jsonify({"error": "Failed to delete document"}), 500
+        if not deleted:
+            return jsonify({"error": "Document not found"}), 404
+        return jsonify({"deleted": doc_id})
+
+    if request.method == "PUT":
+        data = request.get_json(silent=True) or request.form
+        fields = {field: data.get(field) for field in ("title", "content", "category")}
+        if any(value is not None and not isinstance(value, str) for value in fields.values()):
+            return jsonify({"error": "Title, content and category must be strings"}), 400
+        if fields["title"] is not None and not fields["title"].strip() \
+                or fields["content"] is not None and not fields["content"].strip():
+            return jsonify({"error": "Title and content cannot be empty"}), 400
+        try:
+            doc = knowledge_base.update_document(doc_id, **fields)
+        except Exception as e:
+            logger.error("Error updating document %s: %s", doc_id, e)
+            return jsonify({"error": "Failed to update document"}), 500
+    else:
+        doc = knowledge_base.get_document(doc_id)
+
+    if doc is None:
+        return jsonify({"error": "Document not found"}), 404
+    return jsonify(doc.to_dict())
+
+
+@app.route("/admin/import", methods=["POST"])
+def import_documents():
+    """Add a JSON list of documents to the knowledge base in one request"""
+    data = request.get_json(silent=True)
+    documents = data.get("documents") if isinstance(data, dict) else data
+    if not isinstance(documents, list) or not documents:
+        return jsonify({"error": "No documents provided"}), 400
+    return jsonify(knowledge_base.add_documents(documents))
+
+
+@app.route("/admin/duplicates")
+def list_duplicates():
+    """List near-duplicate documents grouped by the copy shown in search results"""
+    return jsonify({"mode": knowledge_base.dedup_mode, "clusters": knowledge_base.duplicates()})
+
+
+@app.route("/admin/profiling", methods=["GET", "POST"])
+def profiling_settings():
+    """Show or update the request profiling toggle"""
+    if request.method == "POST":
+        data = request.json or {}
+        try:
+            request_profiler.configure(
+                enabled=data.get("enabled"),
+                sample_rate=data.get("sample_rate"),
+                slow_threshold_ms=data.get("slow_threshold_ms")
+            )
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid profiling settings"}), 400
+        logger.info("Profiling settings updated: %s", request_profiler.settings())
+
+    return jsonify(request_profiler.settings())
+
+
+@app.route("/admin/capture", methods=["GET", "POST"])
+def capture_settings():
+    """Show or update the anonymized request capture toggle"""
+    if request.method == "POST":
+        data = request.json or {}
+        try:
+            request_capture.configure(enabled=data.get("enabled"), sample_rate=data.get("sample_rate"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid capture settings"}), 400
+        logger.info("Request capture settings updated: %s", request_capture.settings())
+
+    return jsonify(request_capture.settings())
+
+
+@app.route("/admin/image-cache")
+def image_cache_stats():
+    """Hit rate and size of the image analysis cache"""
+    return jsonify(analysis_cache.stats())
+
+
+@app.route("/admin/admission")
+def admission_stats():
+    """Show upstream slots in use, queued requests per lane and rejection counts"""
+    return jsonify(admission.stats())
+
+
+@app.route("/admin/upstream")
+def upstream_stats():
+    """Show observed upstream latencies, current deadlines and hedging counters"""
+    return jsonify(upstream.stats())
+
+
+@app.route("/admin/routing")
+def routing_stats():
+    """Show how many questions took the fast and full model routes, and their latency"""
+    return jsonify(router.stats())
+
+
+@app.route("/admin/profiles")
+def list_profiles():
+    """List captured slow or explicitly profiled requests"""
+    return jsonify({"profiles": request_profiler.store.list()})
+
+
+@app.route("/admin/profiles/<capture_id>")
+def get_profile(capture_id):
+    """Return the stage timings and top functions of a captured request"""
+    summary = request_profiler.store.get(capture_id)
+    if summary is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(summary)
+
+
+@app.route("/admin/profiles/<capture_id>/download")
+def download_profile(capture_id):
+    """Download the raw cProfile dump of a captured request"""
+    path = request_profiler.store.path_for(capture_id, "prof")
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(os.path.abspath(path), as_attachment=True,
+                     download_name=f"{capture_id}.prof",
+                     mimetype="application/octet-stream")
+
+
 @app.route("/chat", methods=["POST"])
 def chat():
     """Handle chat requests from the frontend"""
-    data = request.json
+    with stage("parse_request"):
+        data = request.json
     if not data or "message" not in data:
         logger.warning("Received request with no message")
         return jsonify({"error": "No message provided"}), 400
 
     user_input = data["message"]
     conversation_history = data.get("conversation", [])
+    if not valid_category(data.get("category")):
+        return jsonify({"error": CATEGORY_ERROR}), 400
 
     context = None
     if conversation_history:
@@ -91,22 +266,77 @@ def chat():
                 context = message.get("content")
                 break
 
-    logger.info(f"Received message: {user_input[:30]}...")
+    logger.info("Received message: %s...", user_input[:30])
 
     try:
         if knowledge_base.documents:
-            response = get_ai_response_with_knowledge_azure(user_input, knowledge_base, context)
+            categories = resolve_categories(data.get("category"), user_input)
+            response = get_ai_response_with_knowledge_azure(user_input, knowledge_base, context, categories)
             logger.info("Successfully processed message with knowledge base")
         else:
             response = get_ai_response(user_input, context)
             logger.info("Successfully processed message without knowledge base")
 
-        return jsonify({"response": response})
+        with stage("serialize_response"):
+            return jsonify({"response": response})
     except Exception as e:
-        logger.error(f"Error processing request: {str(e)}")
+        logger.error("Error processing request: %s", e)
         return jsonify({"error": "Failed to process your request"}), 500
 
 
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """
+    Answer a list of questions in one request.
+
+    Results are returned in request order, or streamed as newline-delimited
+    JSON in completion order when "stream" is true. A failed question gets
+    an "error" entry instead of failing the whole batch.
+    """
+    with stage("parse_request"):
+        data = request.json
+    try:
+        items = parse_batch(data)
+    except ValueError as e:
+        logger.warning("Rejected batch request: %s", e)
+        return jsonify({"error": str(e)}), 400
+
+    concurrency = data.get("concurrency", BATCH_MAX_CONCURRENCY)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        return jsonify({"error": "concurrency must be a positive integer"}), 400
+    concurrency = min(concurrency, BATCH_MAX_CONCURRENCY)
+
+    try:
+        admission.charge_batch(client_id(), len(items))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    logger.info("Received batch of %s messages", len(items))
+    results = run_batch(items, knowledge_base, concurrency, resolve_categories, admission)
+
+    if data.get("stream"):
+        def generate():
+            for result in results:
+                yield json.dumps(result) + "\n"
+
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    ordered = sorted(results, key=lambda result: result["index"])
+    with stage("serialize_response"):
+        return jsonify({"results": ordered})
+
+
+@app.route("/suggest")
+def suggest():
+    """Autocomplete conditions and terms for the chat input"""
+    prefix = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", 8, type=int), 20))
+
+    response = jsonify({"suggestions": knowledge_base.suggest(prefix, limit)})
+    response.headers["Cache-Control"] = "public, max-age=60"
+    return response
+
+
 @app.route('/upload-image', methods=['POST'])
 def upload_image():
     """Handle image uploads"""
@@ -123,11 +353,16 @@ def upload_image():
         unique_filename = f"{uuid.uuid4()}_{filename}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
 
-        file.save(filepath)
+        with stage("save_upload"):
+            file.save(filepath)
 
-        logger.info(f"Image uploaded: {unique_filename}")
+        logger.info("Image uploaded: %s", unique_filename)
 
-        return jsonify({"filename": unique_filename, "success": True})
+        result = {"filename": unique_filename, "success": True}
+        if previews.submit(unique_filename) is not None:
+            result["previews"] = {size: url_for("image_preview", filename=unique_filename, size=size)
+                                  for size in previews.sizes}
+        return jsonify(result)
 
     return jsonify({"error": "Invalid file type"}), 400
 
@@ -135,7 +370,8 @@ def upload_image():
 @app.route('/analyze-image', methods=['POST'])
 def analyze_image():
     """Analyze an uploaded image using the healthcare AI"""
-    data = request.json
+    with stage("parse_request"):
+        data = request.json
 
     if not data or "filename" not in data:
         return jsonify({"error": "No image specified"}), 400
@@ -143,34 +379,102 @@ def analyze_image():
     filename = data["filename"]
     question = data.get("question", "What can you tell me about this medical image?")
     conversation_history = data.get("conversation", [])
+    if not isinstance(conversation_history, list):
+        return jsonify({"error": CONVERSATION_ERROR}), 400
 
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
     if not os.path.exists(filepath):
         return jsonify({"error": "Image not found"}), 404
 
-    logger.info(f"Analyzing image: {filename}")
+    logger.info("Analyzing image: %s", filename)
+    client = client_id()
 
     try:
-        with open(filepath, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
+        hashes, cached = cached_analysis([filepath], question, client)
+        if cached is not None:
+            return jsonify({"response": cached, "cached": True})
 
-        context = None
-        if conversation_history:
-            for message in reversed(conversation_history):
-                if message.get("role") == "assistant":
-                    context = message.get("content")
-                    break
+        with stage("image_encode"):
+            encoded_image = encode_images([filepath])[0]
 
-        response = get_ai_response_for_image(encoded_image, question, context)
+        context = last_assistant_message(conversation_history)
+        response = get_ai_response_for_image(encoded_image, question, context, hashes, client)
 
         return jsonify({"response": response})
 
     except Exception as e:
-        logger.error(f"Error analyzing image: {str(e)}")
+        logger.error("Error analyzing image: %s", e)
         return jsonify({"error": "Failed to analyze the image"}), 500
 
 
+@app.route('/analyze-images', methods=['POST'])
+def analyze_images():
+    """
+    Analyze a series of uploaded images in one request.
+
+    The images are decoded, resized and encoded in parallel. With "mode":
+    "combined" (default) they are sent to the model together in one message
+    and answered once; with "each" every image gets its own concurrent
+    model call and answer.
+    """
+    with stage("parse_request"):
+        data = request.json
+
+    filenames = data.get("filenames") if data else None
+    if not isinstance(filenames, list) or not filenames or not all(isinstance(name, str) for name in filenames):
+        return jsonify({"error": "filenames must be a non-empty list of uploaded file names"}), 400
+    if len(filenames) > MAX_IMAGES_PER_REQUEST:
+        return jsonify({"error": f"At most {MAX_IMAGES_PER_REQUEST} images per request"}), 400
+    mode = data.get("mode", "combined")
+    if mode not in ("combined", "each"):
+        return jsonify({"error": 'mode must be "combined" or "each"'}), 400
+    conversation = data.get("conversation", [])
+    if not isinstance(conversation, list):
+        return jsonify({"error": CONVERSATION_ERROR}), 400
+
+    paths = [os.path.join(app.config['UPLOAD_FOLDER'], name) for name in filenames]
+    missing = [name for name, path in zip(filenames, paths)
+               if secure_filename(name) != name or not os.path.exists(path)]
+    if missing:
+        return jsonify({"error": "Image not found", "missing": missing}), 404
+
+    question = data.get("question", "What can you tell me about these medical images?")
+    context = last_assistant_message(conversation)
+    logger.info("Analyzing %s images (%s)", len(filenames), mode)
+    client = client_id()
+
+    if mode == "each":
+        try:
+            admission.charge_batch(client, len(filenames))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    try:
+        if mode == "each":
+            results = analyze_each(paths, question, context, admission, client=client)
+            annotate(image_cache_hits=sum(1 for result in results if result.get("cached")))
+            for result in results:
+                result["filename"] = filenames[result["index"]]
+            return jsonify({"results": results})
+
+        hashes, cached = cached_analysis(paths, question, client)
+        if cached is not None:
+            return jsonify({"response": cached, "cached": True})
+
+        with stage("image_encode"):
+            encoded_images = encode_images(paths)
+        with admission.slot("image"):
+            response = get_ai_response_for_images(encoded_images, question, context, hashes, client)
+        return jsonify({"response": response})
+
+    except AdmissionRejected:
+        raise
+    except Exception as e:
+        logger.error("Error analyzing images: %s", e)
+        return jsonify({"error": "Failed to analyze the images"}), 500
+
+
 @app.route("/status")
 def status():
     """Return the status of the application including model in use"""
@@ -188,9 +492,9 @@ if __name__ == "__main__":
         print("Warning: GitHub PAT token not found in environment variables")
         print("Set it with: export AZURE_API_KEY='github_pat_...'")
 
-    logger.info(f"Knowledge base has {len(knowledge_base.documents)} documents")
+    logger.info("Knowledge base has %s documents", len(knowledge_base.documents))
 
-    logger.info(f"Starting Smart Healthcare Assistant with Knowledge Base using Azure AI")
+    logger.info("Starting Smart Healthcare Assistant with Knowledge Base using Azure AI")
 
     print("Server starting at http://127.0.0.1:5000/")
     app.run(debug=True)
\ No newline at end of file
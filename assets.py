@@ -0,0 +1,298 @@
+"""
+Static asset pipeline: content-hashed filenames, precompressed variants and
+long-lived caching.
+
+Build the assets once per release, before the app starts:
+
+    python -m assets --static static
+
+The app only reads the manifest. Without an up-to-date one it serves the
+plain static files, unless ASSET_BUILD_ON_STARTUP=1 lets it build them.
+"""
+import os
+import sys
+import json
+import gzip
+import hashlib
+import logging
+import tempfile
+import argparse
+import mimetypes
+
+from profiler import stage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ASSET_DIR = "dist"
+MANIFEST_NAME = "manifest.json"
+ASSET_URL_PREFIX = "/assets"
+# Gzip JSON responses at least this large when the client accepts it; 0 disables
+JSON_GZIP_MIN_BYTES = int(os.environ.get("JSON_GZIP_MIN_BYTES", "1024"))
+JSON_GZIP_LEVEL = int(os.environ.get("JSON_GZIP_LEVEL", "6"))
+# Build missing or stale assets when the app starts, for development; every
+# worker process does this, so deploys run `python -m assets` instead
+ASSET_BUILD_ON_STARTUP = os.environ.get("ASSET_BUILD_ON_STARTUP", "0") == "1"
+
+HASH_LENGTH = 12
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+COMPRESSIBLE_EXTENSIONS = {".js", ".css", ".svg", ".json", ".html", ".txt", ".map"}
+# Skip variants that save less than this share of the original size
+MIN_COMPRESSION_SAVING = 0.1
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+
+def fingerprint(name, data):
+    """Return name with a content hash before its extension: app.js -> app.3f2a9c1b7d04.js."""
+    stem, extension = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{extension}"
+
+
+def build_assets(static_folder):
+    """
+    Fingerprint and precompress every file of the static folder.
+
+    Each file is copied to static/dist under its fingerprinted name, with
+    .gz and, when the brotli package is installed, .br variants for text
+    assets. The manifest maps the original relative paths to the
+    fingerprinted ones. Old fingerprinted files are kept, so pages cached
+    by clients during a deploy can still load the assets they reference.
+
+    Args:
+        static_folder (str): The app's static folder
+
+    Returns:
+        dict: The manifest
+    """
+    output = os.path.join(static_folder, ASSET_DIR)
+    os.makedirs(output, exist_ok=True)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder):
+            dirs[:] = [d for d in dirs if d != ASSET_DIR]
+        for filename in sorted(files):
+            source = os.path.join(root, filename)
+            name = os.path.relpath(source, static_folder).replace(os.sep, "/")
+            with open(source, "rb") as f:
+                data = f.read()
+
+            hashed = fingerprint(name, data)
+            target = os.path.join(output, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _write(target, data)
+            if os.path.splitext(name)[1].lower() in COMPRESSIBLE_EXTENSIONS:
+                _write_compressed(target, data)
+            manifest[name] = hashed
+
+    _write(os.path.join(output, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+    logger.info("Built %s static assets into %s", len(manifest), output)
+    return manifest
+
+
+def _write_compressed(target, data):
+    variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(data, quality=11)))
+    for suffix, compressed in variants:
+        if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING):
+            _write(target + suffix, compressed)
+
+
+def _write(path, data):
+    # Write then rename so a running server never serves a partial file; the
+    # temporary name is unique, so concurrent builds do not rename each
+    # other's files away
+    directory, name = os.path.split(path)
+    fd, temporary = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+    try:
+        # mkstemp creates the file private to the deploy user; the server may run as another
+        os.fchmod(fd, 0o644)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+def accepted_encodings(header):
+    """Return the content codings a client accepts (q > 0) from its Accept-Encoding header."""
+    accepted = set()
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = params.strip()
+        if quality.startswith("q="):
+            try:
+                if float(quality[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(coding)
+    return accepted
+
+
+class AssetPipeline:
+    def __init__(self, app=None, json_gzip_min_bytes=JSON_GZIP_MIN_BYTES, json_gzip_level=JSON_GZIP_LEVEL,
+                 build_on_startup=ASSET_BUILD_ON_STARTUP):
+        """
+        Serve fingerprinted static assets and compress large JSON responses.
+
+        Templates call asset_url("app.js") to get /assets/app.<hash>.js. Those
+        URLs change whenever the content does, so they are served with a
+        one-year immutable Cache-Control and repeat visits never revalidate
+        them. A precompressed .br or .gz variant is sent when the client
+        accepts it, so nothing is compressed per request. In debug mode
+        asset_url points at the plain static files instead, so edits show up
+        without a rebuild.
+
+        JSON API responses of at least json_gzip_min_bytes are gzipped on the
+        fly when the client accepts gzip.
+
+        Args:
+            app (Flask, optional): Application to register with
+            json_gzip_min_bytes (int): Smallest JSON body to compress; 0 disables
+            json_gzip_level (int): Gzip level for JSON responses
+            build_on_startup (bool): Build the assets when the manifest is
+                missing or stale instead of serving the plain static files
+        """
+        self.json_gzip_min_bytes = json_gzip_min_bytes
+        self.json_gzip_level = json_gzip_level
+        self.build_on_startup = build_on_startup
+        self.manifest = {}
+        self.output = None
+        self._files = set()
+        if app is not None:
+            self.init_app(app)
+
+    def load(self, static_folder):
+        """
+        Read the manifest written by `python -m assets`.
+
+        A manifest that is missing or older than a source file is not used,
+        so outdated assets are never served; the plain static files are used
+        instead, or the assets are built first when build_on_startup is set.
+        """
+        self.output = os.path.join(static_folder, ASSET_DIR)
+        path = os.path.join(self.output, MANIFEST_NAME)
+        try:
+            if not _is_stale(static_folder, path):
+                with open(path, "r") as f:
+                    self.manifest = json.load(f)
+            elif self.build_on_startup:
+                self.manifest = build_assets(static_folder)
+            else:
+                logger.warning("Static asset manifest %s is missing or stale, serving assets unfingerprinted; "
+                               "run `python -m assets` to build it", path)
+                self.manifest = {}
+        except Exception as e:
+            logger.error("Error loading static assets, serving them unfingerprinted: %s", e)
+            self.manifest = {}
+        # Known files, so requests never touch the disk to look for variants
+        self._files = {os.path.relpath(os.path.join(root, name), self.output).replace(os.sep, "/")
+                       for root, _, names in os.walk(self.output) for name in names
+                       if not name.endswith(".tmp")}
+
+    def asset_url(self, name):
+        """URL of a static asset, fingerprinted when it is in the manifest."""
+        from flask import current_app, url_for
+        hashed = self.manifest.get(name)
+        if hashed is None or current_app.debug:
+            return url_for("static", filename=name)
+        return f"{ASSET_URL_PREFIX}/{hashed}"
+
+    def send_asset(self, filename):
+        """Serve a fingerprinted asset, precompressed when the client allows."""
+        from flask import request, send_from_directory, abort
+        if filename not in self._files or filename == MANIFEST_NAME or filename.endswith((".gz", ".br")):
+            abort(404)
+
+        accepted = accepted_encodings(request.headers.get("Accept-Encoding"))
+        encoding, served = None, filename
+        for coding, suffix in ENCODINGS:
+            if coding in accepted and filename + suffix in self._files:
+                encoding, served = coding, filename + suffix
+                break
+
+        response = send_from_directory(self.output, served, max_age=31536000, conditional=True,
+                                       mimetype=_mimetype(filename))
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add("Accept-Encoding")
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+    def compress_response(self, response):
+        """Gzip a JSON response body above the size threshold if the client accepts gzip."""
+        from flask import request
+        if (not self.json_gzip_min_bytes
+                or response.mimetype != "application/json"
+                or response.direct_passthrough
+                or response.is_streamed
+                or "Content-Encoding" in response.headers
+                or not 200 <= response.status_code < 300):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        if "gzip" not in accepted_encodings(request.headers.get("Accept-Encoding")):
+            return response
+        data = response.get_data()
+        if len(data) < self.json_gzip_min_bytes:
+            return response
+
+        with stage("compress_response"):
+            response.set_data(gzip.compress(data, compresslevel=self.json_gzip_level))
+        response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    def init_app(self, app):
+        """Load the asset manifest and register the asset route, template helper and JSON compression."""
+        self.load(app.static_folder)
+        app.add_url_rule(f"{ASSET_URL_PREFIX}/<path:filename>", "asset", self.send_asset)
+        app.add_template_global(self.asset_url, "asset_url")
+        app.after_request(self.compress_response)
+
+
+def _is_stale(static_folder, manifest_path):
+    if not os.path.exists(manifest_path):
+        return True
+    built = os.path.getmtime(manifest_path)
+    for root, dirs, files in os.walk(static_folder):
+        if os.path.abspath(root) == os.path.abspath(static_folder):
+            dirs[:] = [d for d in dirs if d != ASSET_DIR]
+        if any(os.path.getmtime(os.path.join(root, name)) > built for name in files):
+            return True
+    return False
+
+
+def _mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint and precompress static assets")
+    parser.add_argument("--static", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"),
+                        help="Static folder to build (default: ./static)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    manifest = build_assets(args.static)
+    if brotli is None:
+        print("brotli is not installed; only gzip variants were written", file=sys.stderr)
+    for name, hashed in sorted(manifest.items()):
+        print(f"{name} -> {ASSET_DIR}/{hashed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.RLock()
+_settings = None
+_clients = {}
+
+
+def get_settings():
+    """
+    Return the Azure AI configuration, reading `.env` on first use.
+
+    Returns:
+        dict: token, endpoint, chat_model_name and embedding_model_name
+    """
+    global _settings
+    if _settings is None:
+        with _lock:
+            if _settings is None:
+                from dotenv import load_dotenv
+                load_dotenv()
+                _settings = {
+                    "token": os.environ.get("AZURE_API_KEY", "you_key_here"),
+                    "endpoint": os.environ.get("AZURE_ENDPOINT", "https://models.inference.ai.azure.com"),
+                    "chat_model_name": os.environ.get("AZURE_MODEL_NAME", "gpt-4o"),
+                    "embedding_model_name": os.environ.get("AZURE_EMBEDDING_MODEL", "text-embedding-ada-002"),
+                }
+    return _settings
+
+
+def _get_client(kind):
+    client = _clients.get(kind)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(kind)
+        if client is None:
+            from azure.ai.inference import ChatCompletionsClient, EmbeddingsClient
+            from azure.core.credentials import AzureKeyCredential
+
+            settings = get_settings()
+            client_class = ChatCompletionsClient if kind == "chat" else EmbeddingsClient
+            client = client_class(
+                endpoint=settings["endpoint"],
+                credential=AzureKeyCredential(settings["token"]),
+            )
+            _clients[kind] = client
+            logger.info("Created Azure %s client for %s", kind, settings['endpoint'])
+    return client
+
+
+def get_chat_client():
+    """Return the shared ChatCompletionsClient, creating it on first use."""
+    return _get_client("chat")
+
+
+def get_embeddings_client():
+    """Return the shared EmbeddingsClient, creating it on first use."""
+    return _get_client("embeddings")
+
+
+def reset():
+    """Drop cached settings and clients so the next call re-reads the environment."""
+    global _settings
+    with _lock:
+        _settings = None
+        _clients.clear()
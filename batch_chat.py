@@ -0,0 +1,159 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from admission import AdmissionRejected
+from knowledge_base import complete_with_knowledge
+from profiler import bind_record, stage
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "50"))
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+
+CATEGORY_ERROR = 'category must be a name, a list of names or "auto"'
+CONVERSATION_ERROR = "conversation must be a list of messages"
+
+
+class BatchItem:
+    def __init__(self, index, message=None, context=None, category=None, error=None):
+        """
+        One question of a batch chat request.
+
+        Args:
+            index (int): Position of the question in the request
+            message (str): The question
+            context (str, optional): Previous assistant message
+            category (str or list, optional): Category filter, as for /chat
+            error (str, optional): Why the item was rejected before running
+        """
+        self.index = index
+        self.message = message
+        self.context = context
+        self.category = category
+        self.error = error
+
+
+def last_assistant_message(conversation):
+    """Return the content of the most recent assistant message, if any."""
+    for message in reversed(conversation or []):
+        if isinstance(message, dict) and message.get("role") == "assistant":
+            return message.get("content")
+    return None
+
+
+def valid_category(category):
+    """Whether a category filter is absent or a name, "auto" or a list of names."""
+    if category is None or isinstance(category, str):
+        return True
+    return isinstance(category, list) and all(isinstance(name, str) for name in category)
+
+
+def parse_batch(data, max_items=BATCH_MAX_ITEMS):
+    """
+    Validate the body of a batch chat request.
+
+    "messages" is a list whose entries are either a question string or an
+    object with "message" and optionally "conversation" and "category".
+    Malformed entries become items carrying an error instead of failing the
+    whole batch.
+
+    Returns:
+        list: BatchItem objects in request order
+
+    Raises:
+        ValueError: If the body has no message list or too many messages
+    """
+    messages = data.get("messages") if isinstance(data, dict) else None
+    if not isinstance(messages, list) or not messages:
+        raise ValueError("No messages provided")
+    if len(messages) > max_items:
+        raise ValueError(f"Too many messages (max {max_items})")
+
+    items = []
+    for index, entry in enumerate(messages):
+        if isinstance(entry, str):
+            entry = {"message": entry}
+        if not isinstance(entry, dict) or not isinstance(entry.get("message"), str) or not entry["message"].strip():
+            items.append(BatchItem(index, error="No message provided"))
+            continue
+        category = entry.get("category", data.get("category"))
+        if not valid_category(category):
+            items.append(BatchItem(index, error=CATEGORY_ERROR))
+            continue
+        if not isinstance(entry.get("conversation", []), list):
+            items.append(BatchItem(index, error=CONVERSATION_ERROR))
+            continue
+        items.append(BatchItem(
+            index,
+            message=entry["message"],
+            context=last_assistant_message(entry.get("conversation")),
+            category=category
+        ))
+    return items
+
+
+def run_batch(items, knowledge_base, max_concurrency=BATCH_MAX_CONCURRENCY, resolve_categories=None,
+              admission=None):
+    """
+    Answer a batch of questions, yielding each result as soon as it is ready.
+
+    Retrieval runs once for the whole batch (see
+    AzureKnowledgeBase.search_batch); the chat completions are then sent
+    concurrently on at most max_concurrency threads, so the batch takes
+    roughly as long as its slowest questions rather than the sum of all.
+
+    Args:
+        items (list): BatchItem objects from parse_batch
+        knowledge_base (AzureKnowledgeBase): Knowledge base for retrieval
+        max_concurrency (int): Most upstream calls in flight at once
+        resolve_categories (callable, optional): Maps (category, message) to
+            a category list, as the /chat endpoint does
+        admission (AdmissionController, optional): Each upstream call waits
+            for a slot in the batch lane, behind interactive requests
+
+    Yields:
+        dict: {"index", "response"} or {"index", "error"}, in completion order
+    """
+    for item in items:
+        if item.error is not None:
+            yield {"index": item.index, "error": item.error}
+
+    runnable = [item for item in items if item.error is None]
+    if not runnable:
+        return
+
+    with stage("retrieval"):
+        categories = [resolve_categories(item.category, item.message) if resolve_categories else item.category
+                      for item in runnable]
+        retrieved = knowledge_base.search_batch([item.message for item in runnable], categories=categories)
+
+    workers = max(1, min(max_concurrency, len(runnable)))
+    # The calls count towards the request, so their upstream latencies are profiled and captured
+    answer = bind_record(_answer)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch-chat") as executor:
+        futures = {
+            executor.submit(answer, item, docs, admission): item
+            for item, docs in zip(runnable, retrieved)
+        }
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _answer(item, relevant_docs, admission=None):
+    start = time.perf_counter()
+    try:
+        if admission is not None:
+            with admission.slot("batch"):
+                response = complete_with_knowledge(item.message, relevant_docs, item.context)
+        else:
+            response = complete_with_knowledge(item.message, relevant_docs, item.context)
+        result = {"index": item.index, "response": response}
+    except AdmissionRejected as e:
+        result = {"index": item.index, "error": e.message, "retry_after": e.retry_after_header()}
+    except Exception as e:
+        logger.error("Error answering batch item %s: %s", item.index, e)
+        result = {"index": item.index, "error": "Failed to process this message"}
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
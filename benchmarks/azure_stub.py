@@ -0,0 +1,355 @@
+"""
+Local stand-in for the Azure AI inference chat-completions and embeddings API.
+
+Point the app at it with AZURE_ENDPOINT=http://127.0.0.1:<port> to exercise
+the full request path without spending quota:
+
+    python -m benchmarks.azure_stub --port 8001 --latency lognormal:800:0.4 --error-rate 0.02
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def parse_latency(spec):
+    """
+    Build a latency sampler from a spec string. All values are milliseconds.
+
+    Supported specs:
+        constant:MS
+        uniform:LOW:HIGH
+        normal:MEAN:STDDEV
+        lognormal:MEDIAN:SIGMA
+
+    Args:
+        spec (str): The distribution spec
+
+    Returns:
+        callable: A function returning a latency in seconds
+    """
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(":")] if params else []
+
+    if kind == "constant":
+        ms = values[0] if values else 0.0
+        return lambda: ms / 1000
+    if kind == "uniform":
+        low, high = values
+        return lambda: random.uniform(low, high) / 1000
+    if kind == "normal":
+        mean, stddev = values
+        return lambda: max(random.gauss(mean, stddev), 0.0) / 1000
+    if kind == "lognormal":
+        import math
+        median, sigma = values
+        mu = math.log(median)
+        return lambda: random.lognormvariate(mu, sigma) / 1000
+
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class StubConfig:
+    def __init__(self, latency="constant:0", error_rate=0.0, error_status=429,
+                 hang_rate=0.0, stream_chunks=8, completion_text=None, embedding_dims=1536):
+        """
+        Behaviour of the stub server.
+
+        Args:
+            latency (str): Latency distribution spec, see parse_latency
+            error_rate (float): Fraction of requests answered with error_status
+            error_status (int): HTTP status used for injected errors
+            hang_rate (float): Fraction of requests that stall for 60 seconds
+            stream_chunks (int): Number of chunks a streamed completion is split into
+            completion_text (str, optional): Fixed completion text
+            embedding_dims (int): Length of returned embedding vectors
+        """
+        self.latency_spec = latency
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        self.stream_chunks = stream_chunks
+        self.completion_text = completion_text or (
+            "This is a simulated response from the local inference stub. "
+            "Please consult a healthcare professional for definitive advice."
+        )
+        self.embedding_dims = embedding_dims
+
+
+class StubStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.hangs = 0
+        self.by_path = {}
+
+    def record(self, path, outcome):
+        with self._lock:
+            self.requests += 1
+            self.by_path[path] = self.by_path.get(path, 0) + 1
+            if outcome == "error":
+                self.errors += 1
+            elif outcome == "hang":
+                self.hangs += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "hangs": self.hangs,
+                "by_path": dict(self.by_path),
+            }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "AzureInferenceStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/info":
+            self._send_json(200, {"model_name": "stub", "model_type": "chat-completion",
+                                  "model_provider_name": "local"})
+        elif path == "/stats":
+            self._send_json(200, self.server.stats.to_dict())
+        else:
+            self._send_json(404, {"error": {"code": "NotFound", "message": path}})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"code": "BadRequest", "message": "Invalid JSON"}})
+            return
+
+        config = self.server.config
+        roll = random.random()
+        if roll < config.hang_rate:
+            self.server.stats.record(path, "hang")
+            time.sleep(60)
+            self._send_json(504, {"error": {"code": "Timeout", "message": "Upstream timeout"}})
+            return
+
+        time.sleep(self.server.next_latency(body))
+
+        if roll < config.hang_rate + config.error_rate:
+            self.server.stats.record(path, "error")
+            self._send_error(config.error_status)
+            return
+
+        self.server.stats.record(path, "ok")
+        if path == "/chat/completions":
+            if body.get("stream"):
+                self._stream_completion(body)
+            else:
+                self._send_json(200, self._completion(body))
+        elif path in ("/embeddings", "/images/embeddings"):
+            self._send_json(200, self._embeddings(body))
+        else:
+            self._send_json(404, {"error": {"code": "NotFound", "message": path}})
+
+    def _completion(self, body):
+        prompt_tokens = _estimate_tokens(body.get("messages", []))
+        text = self.server.config.completion_text
+        completion_tokens = min(len(text.split()), body.get("max_tokens") or 10 ** 6)
+        return {
+            "id": f"stub-{random.getrandbits(48):012x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": text},
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _stream_completion(self, body):
+        completion = self._completion(body)
+        text = completion["choices"][0]["message"]["content"]
+        chunks = max(self.server.config.stream_chunks, 1)
+        step = max(len(text) // chunks, 1)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        for start in range(0, len(text), step):
+            event = {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": [{"index": 0, "delta": {"content": text[start:start + step]},
+                             "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.sample_latency() / chunks)
+
+        final = {
+            "id": completion["id"],
+            "object": "chat.completion.chunk",
+            "created": completion["created"],
+            "model": completion["model"],
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            "usage": completion["usage"],
+        }
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, body):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dims = body.get("dimensions") or self.server.config.embedding_dims
+        data = [{"object": "embedding", "index": i, "embedding": _pseudo_embedding(str(text), dims)}
+                for i, text in enumerate(inputs)]
+        tokens = sum(len(str(text).split()) for text in inputs)
+        return {
+            "id": f"stub-{random.getrandbits(48):012x}",
+            "object": "list",
+            "model": body.get("model", "stub"),
+            "data": data,
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def _send_error(self, status):
+        messages = {
+            429: ("RateLimitReached", "Rate limit exceeded. Please retry after 1 second."),
+            500: ("InternalServerError", "The server had an error processing the request."),
+            503: ("ServiceUnavailable", "The service is temporarily unavailable."),
+        }
+        code, message = messages.get(status, ("Error", "Injected error"))
+        headers = {"Retry-After": "1"} if status in (429, 503) else {}
+        self._send_json(status, {"error": {"code": code, "message": message}}, headers)
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.stats = StubStats()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def sample_latency(self):
+        return self.config.sample_latency()
+
+    def next_latency(self, body):
+        """Latency for the next request; subclasses can override the distribution."""
+        return self.config.sample_latency()
+
+
+def _estimate_tokens(messages):
+    total = 0
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        total += len(str(content)) // 4 + 4
+    return total
+
+
+def _pseudo_embedding(text, dims):
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [rng.uniform(-1, 1) for _ in range(dims)]
+
+
+def start_stub(config=None, host="127.0.0.1", port=0, server_class=StubServer):
+    """
+    Start a stub server on a background thread.
+
+    Args:
+        config (StubConfig, optional): Stub behaviour
+        host (str): Interface to bind
+        port (int): Port to bind, 0 for an ephemeral port
+        server_class (type): StubServer subclass to instantiate
+
+    Returns:
+        StubServer: The running server; call shutdown() to stop it
+    """
+    server = server_class((host, port), config or StubConfig())
+    thread = threading.Thread(target=server.serve_forever, name="azure-stub", daemon=True)
+    thread.start()
+    return server
+
+
+def add_stub_arguments(parser):
+    """Register the stub behaviour options on an argparse parser."""
+    parser.add_argument("--latency", default="lognormal:600:0.35",
+                        help="Upstream latency distribution (default: lognormal:600:0.35)")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of upstream calls that fail")
+    parser.add_argument("--error-status", type=int, default=429,
+                        help="HTTP status of injected failures (default: 429)")
+    parser.add_argument("--hang-rate", type=float, default=0.0,
+                        help="Fraction of upstream calls that stall for 60 seconds")
+
+
+def config_from_args(args):
+    return StubConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        hang_rate=args.hang_rate,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Azure AI inference stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), config_from_args(args))
+    print(f"Azure inference stub listening on {server.url}")
+    print(f"Run the app with: AZURE_ENDPOINT={server.url} python app.py")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
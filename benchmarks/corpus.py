@@ -0,0 +1,124 @@
+"""
+Synthetic medical-condition corpora in the knowledge base's title/content/category schema.
+"""
+import os
+import json
+import random
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_CORPUS = os.path.join(REPO_ROOT, "knowledge", "medical_conditions")
+
+CATEGORIES = [
+    "cardiovascular disorders", "spinal disorders", "shoulder disorders",
+    "nerve compression syndromes", "neurological disorders", "knee disorders",
+    "respiratory disorders", "hip disorders", "muscle injuries", "foot disorders",
+    "overuse injuries", "autoimmune joint disorders", "endocrine disorders",
+    "renal disorders", "gastrointestinal disorders", "liver disorders",
+]
+
+BODY_PARTS = [
+    "cervical", "lumbar", "thoracic", "knee", "hip", "shoulder", "elbow", "wrist",
+    "ankle", "foot", "hand", "cardiac", "pulmonary", "renal", "hepatic", "thyroid",
+]
+
+CONDITIONS = [
+    "tendinopathy", "stenosis", "radiculopathy", "fracture", "arthritis", "bursitis",
+    "neuropathy", "insufficiency", "fibrosis", "syndrome", "instability", "strain",
+    "hypertension", "infection", "dysfunction", "degeneration",
+]
+
+SUFFIXES = ["management protocol", "treatment guidelines", "rehabilitation program",
+            "intervention strategy", "clinical pathway"]
+
+FALLBACK_VOCABULARY = (
+    "treatment management therapy patients symptoms pain physical exercise medication "
+    "surgery diagnosis imaging inflammation rehabilitation strengthening injection chronic "
+    "acute recovery function mobility assessment monitoring dose risk weeks months"
+).split()
+
+
+def load_vocabulary(path=SEED_CORPUS):
+    """
+    Collect the words of the shipped corpus, ordered by frequency.
+
+    Args:
+        path (str): Directory of seed JSON documents
+
+    Returns:
+        list: Vocabulary words, most frequent first
+    """
+    counts = {}
+    if os.path.isdir(path):
+        for filename in os.listdir(path):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(path, filename), "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            for word in doc.get("content", "").lower().split():
+                word = word.strip(".,;:()[]\"'")
+                if word.isalpha() and len(word) > 2:
+                    counts[word] = counts.get(word, 0) + 1
+    if not counts:
+        return list(FALLBACK_VOCABULARY)
+    return sorted(counts, key=counts.get, reverse=True)
+
+
+class SyntheticCorpus:
+    def __init__(self, seed=42, content_words=70, vocabulary=None):
+        """
+        Deterministic generator of synthetic medical-condition documents.
+
+        Content words are drawn from the seed corpus vocabulary with a Zipf-like
+        distribution, so term statistics resemble the real knowledge base.
+
+        Args:
+            seed (int): Random seed
+            content_words (int): Average number of words per document body
+            vocabulary (list, optional): Word list, most frequent first
+        """
+        self.seed = seed
+        self.content_words = content_words
+        self.vocabulary = vocabulary or load_vocabulary()
+        self._weights = [1.0 / (rank + 1) for rank in range(len(self.vocabulary))]
+
+    def document(self, index):
+        """Return the index-th synthetic document."""
+        rng = random.Random(self.seed * 1_000_003 + index)
+        body_part = rng.choice(BODY_PARTS)
+        condition = rng.choice(CONDITIONS)
+        title = f"{body_part.title()} {condition.title()} {rng.choice(SUFFIXES).title()} {index}"
+        length = max(10, int(rng.gauss(self.content_words, self.content_words / 5)))
+        words = rng.choices(self.vocabulary, weights=self._weights, k=length)
+        words[rng.randrange(length)] = condition
+        words[rng.randrange(length)] = body_part
+        content = " ".join(words).capitalize() + "."
+        return {"title": title, "content": content, "category": rng.choice(CATEGORIES)}
+
+    def documents(self, count, start=0):
+        for index in range(start, start + count):
+            yield self.document(index)
+
+    def queries(self, count, seed=None):
+        """Return count synthetic queries mixing title terms and content words."""
+        rng = random.Random(self.seed if seed is None else seed)
+        head = self.vocabulary[:500]
+        queries = []
+        for _ in range(count):
+            terms = [rng.choice(BODY_PARTS), rng.choice(CONDITIONS)]
+            terms += rng.sample(head, k=min(len(head), rng.randint(1, 4)))
+            rng.shuffle(terms)
+            queries.append(" ".join(terms))
+        return queries
+
+    def write(self, directory, count, start=0):
+        """
+        Write count documents as individual JSON files, like the shipped corpus.
+
+        Returns:
+            int: Number of files written
+        """
+        os.makedirs(directory, exist_ok=True)
+        for index, doc in enumerate(self.documents(count, start), start):
+            with open(os.path.join(directory, f"synthetic_{index:08d}.json"), "w", encoding="utf-8") as f:
+                json.dump(doc, f)
+        return count
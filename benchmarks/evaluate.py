@@ -0,0 +1,321 @@
+"""
+Offline evaluation of retrieval quality, answer latency and token usage.
+
+Reads questions from JSONL, one object per line:
+
+    {"id": "q001", "question": "How is gout managed?", "gold": ["Gout Management Guidelines"]}
+
+`gold` lists the documents that should be retrieved, by id or by title;
+`id` and `category` are optional. The report lists retrieved documents by
+id, with their titles alongside. Each question runs through
+AzureKnowledgeBase.search and get_ai_response_with_knowledge_azure on a
+worker pool. By default the answers come from the local Azure stub; --live
+uses the endpoint configured in the environment:
+
+    python -m benchmarks.evaluate --questions benchmarks/eval_questions.jsonl
+    python -m benchmarks.evaluate --questions release.jsonl --live --workers 4 --output release.json
+
+Finished questions are appended to a checkpoint file as they complete, so an
+interrupted run picks up where it stopped when started again with the same
+arguments (pass --fresh to start over). The checkpoint records the settings
+that shape its rows, and a run with different settings refuses to resume it.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from benchmarks.azure_stub import add_stub_arguments, config_from_args, start_stub
+from benchmarks.load_test import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_QUESTIONS = os.path.join(REPO_ROOT, "benchmarks", "eval_questions.jsonl")
+DEFAULT_KNOWLEDGE = os.path.join(REPO_ROOT, "knowledge", "medical_conditions")
+
+
+def load_questions(path):
+    """
+    Read the question set.
+
+    Returns:
+        list: dicts with id, question, gold (list of ids or titles) and category
+    """
+    questions = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            gold = entry.get("gold") or []
+            questions.append({
+                "id": str(entry.get("id", line_number)),
+                "question": entry["question"],
+                "gold": [gold] if isinstance(gold, str) else list(gold),
+                "category": entry.get("category"),
+            })
+    return questions
+
+
+class Checkpoint:
+    def __init__(self, path, params=None):
+        """
+        Append-only JSONL record of finished questions.
+
+        The first line holds the run parameters; rows recorded under other
+        parameters are not resumed.
+
+        Args:
+            path (str): Checkpoint file; created on the first write
+            params (dict, optional): Settings that shape the rows, such as
+                top_k; values must survive a JSON round trip
+        """
+        self.path = path
+        self.params = params or {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Return the rows already recorded, keyed by question id.
+
+        Raises:
+            ValueError: If the checkpoint was written with other parameters
+        """
+        rows = {}
+        if not os.path.exists(self.path):
+            return rows
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            # A run killed mid-write leaves a partial last line; drop it so
+            # the next append starts on a fresh line
+            complete = data.rfind(b"\n") + 1
+            if complete < len(data):
+                f.truncate(complete)
+        params = None
+        for line in data[:complete].splitlines():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue
+            if "params" in row:
+                params = row["params"]
+                continue
+            rows[row["id"]] = row
+
+        if (rows or params is not None) and params != self.params:
+            recorded = params or {}
+            changed = sorted(key for key in set(recorded) | set(self.params)
+                             if recorded.get(key) != self.params.get(key))
+            raise ValueError(f"Checkpoint {self.path} was written with different settings "
+                             f"({', '.join(changed) or 'unrecorded'})")
+        return rows
+
+    def append(self, row):
+        with self._lock, open(self.path, "a") as f:
+            if f.tell() == 0:
+                f.write(json.dumps({"params": self.params}) + "\n")
+            f.write(json.dumps(row) + "\n")
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def document_id(doc):
+    """Identify a retrieved document in the report; falls back to the title for documents without an id."""
+    return doc.id if doc.id is not None else doc.title
+
+
+def evaluate_question(item, knowledge_base, top_k=3, answer=True):
+    """
+    Run one question through retrieval and, optionally, the answer pipeline.
+
+    Returns:
+        dict: The report row for the question
+    """
+    from knowledge_base import get_ai_response_with_knowledge_azure
+
+    categories = [item["category"]] if item["category"] else None
+
+    start = time.perf_counter()
+    results = knowledge_base.search(item["question"], top_k, categories)
+    retrieval_ms = (time.perf_counter() - start) * 1000
+
+    gold = set(item["gold"])
+    rank = next((position for position, doc in enumerate(results, 1)
+                 if document_id(doc) in gold or doc.title in gold), None)
+
+    row = {
+        "id": item["id"],
+        "question": item["question"],
+        "retrieved": [document_id(doc) for doc in results],
+        "retrieved_titles": [doc.title for doc in results],
+        "gold": item["gold"],
+        "hit": rank is not None if gold else None,
+        "rank": rank,
+        "retrieval_ms": round(retrieval_ms, 3),
+    }
+
+    if answer:
+        usage = {}
+        start = time.perf_counter()
+        response = get_ai_response_with_knowledge_azure(item["question"], knowledge_base, categories=categories,
+                                                        usage=usage)
+        row["answer_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        row["answer"] = response
+        row["usage"] = usage
+        # The answer pipeline reports failures as an apology, so usage is the error signal
+        row["error"] = not usage
+
+    return row
+
+
+def run_evaluation(questions, knowledge_base, checkpoint, workers=4, top_k=3, answer=True):
+    """
+    Evaluate the questions not yet in the checkpoint on a worker pool.
+
+    Returns:
+        list: Report rows for every question, in question-set order
+    """
+    done = checkpoint.load()
+    pending = [item for item in questions if item["id"] not in done]
+    if done:
+        print(f"Resuming: {len(done)} questions already evaluated, {len(pending)} to go", file=sys.stderr)
+
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="evaluate") as executor:
+        futures = [executor.submit(evaluate_question, item, knowledge_base, top_k, answer) for item in pending]
+        for future in as_completed(futures):
+            row = future.result()
+            checkpoint.append(row)
+            done[row["id"]] = row
+            completed += 1
+            if completed % 50 == 0 or completed == len(pending):
+                print(f"{completed}/{len(pending)} questions evaluated", file=sys.stderr)
+
+    return [done[item["id"]] for item in questions if item["id"] in done]
+
+
+def _latency(values):
+    return {
+        "p50_ms": round(percentile(values, 50), 2),
+        "p95_ms": round(percentile(values, 95), 2),
+        "p99_ms": round(percentile(values, 99), 2),
+        "max_ms": round(max(values), 2) if values else 0.0,
+    }
+
+
+def summarize_rows(rows):
+    """
+    Aggregate report rows.
+
+    Hit rate and MRR only count questions that have gold labels.
+
+    Returns:
+        dict: Quality, latency and token usage summary
+    """
+    labelled = [row for row in rows if row["hit"] is not None]
+    summary = {
+        "questions": len(rows),
+        "labelled": len(labelled),
+        "hit_rate": round(sum(row["hit"] for row in labelled) / len(labelled), 4) if labelled else None,
+        "mrr": round(sum(1 / row["rank"] for row in labelled if row["rank"]) / len(labelled), 4) if labelled else None,
+        "retrieval": _latency([row["retrieval_ms"] for row in rows]),
+    }
+
+    answered = [row for row in rows if "answer_ms" in row]
+    if answered:
+        ok = [row for row in answered if not row["error"]]
+        tokens = {key: sum(row["usage"].get(key, 0) for row in ok)
+                  for key in ("prompt_tokens", "completion_tokens", "total_tokens")}
+        summary["answer"] = _latency([row["answer_ms"] for row in ok])
+        summary["answer"]["error_rate"] = round(1 - len(ok) / len(answered), 4)
+        summary["tokens"] = dict(tokens, mean_total=round(tokens["total_tokens"] / len(ok), 1) if ok else 0.0)
+    return summary
+
+
+def print_summary(summary):
+    print(f"questions: {summary['questions']} ({summary['labelled']} with gold labels)")
+    if summary["hit_rate"] is not None:
+        print(f"hit rate:  {summary['hit_rate']:.1%}   MRR: {summary['mrr']:.3f}")
+    retrieval = summary["retrieval"]
+    print(f"retrieval: p50 {retrieval['p50_ms']} ms, p95 {retrieval['p95_ms']} ms")
+    if "answer" in summary:
+        answer = summary["answer"]
+        print(f"answer:    p50 {answer['p50_ms']} ms, p95 {answer['p95_ms']} ms, "
+              f"errors {answer['error_rate'] * 100:.1f}%")
+        print(f"tokens:    {summary['tokens']['total_tokens']} total, {summary['tokens']['mean_total']} per answer")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate retrieval and answers over a question set")
+    parser.add_argument("--questions", default=DEFAULT_QUESTIONS, help="JSONL question set")
+    parser.add_argument("--knowledge", default=DEFAULT_KNOWLEDGE, help="Knowledge directory to load")
+    parser.add_argument("--output", default="eval_report.json", help="Report file (default: eval_report.json)")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint.jsonl)")
+    parser.add_argument("--fresh", action="store_true", help="Ignore and replace an existing checkpoint")
+    parser.add_argument("--workers", type=int, default=4, help="Questions evaluated concurrently")
+    parser.add_argument("--top-k", type=int, default=3, help="Documents retrieved per question")
+    parser.add_argument("--retrieval-only", action="store_true", help="Skip the answer pipeline")
+    parser.add_argument("--live", action="store_true",
+                        help="Call the Azure endpoint from the environment instead of the local stub")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub = None
+    if not args.live and not args.retrieval_only:
+        stub = start_stub(config_from_args(args))
+        os.environ["AZURE_ENDPOINT"] = stub.url
+        os.environ.setdefault("AZURE_API_KEY", "stub-key")
+
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    logging.basicConfig(level=logging.WARNING)
+    from knowledge_base import AzureKnowledgeBase
+
+    target = "live" if args.live else ("none" if args.retrieval_only else "stub")
+    params = {
+        "questions": os.path.abspath(args.questions),
+        "knowledge": os.path.abspath(args.knowledge),
+        "top_k": args.top_k,
+        "answer": not args.retrieval_only,
+        "target": target,
+    }
+    checkpoint = Checkpoint(args.checkpoint or os.path.splitext(args.output)[0] + ".checkpoint.jsonl", params)
+    if args.fresh:
+        checkpoint.clear()
+    else:
+        try:
+            checkpoint.load()
+        except ValueError as e:
+            parser.error(f"{e}; pass --fresh to start over")
+
+    try:
+        questions = load_questions(args.questions)
+        knowledge_base = AzureKnowledgeBase(data_path=args.knowledge)
+        rows = run_evaluation(questions, knowledge_base, checkpoint, args.workers, args.top_k,
+                              answer=not args.retrieval_only)
+    finally:
+        if stub is not None:
+            stub.shutdown()
+
+    summary = summarize_rows(rows)
+    report = {
+        "questions_file": args.questions,
+        "target": target,
+        "top_k": args.top_k,
+        "summary": summary,
+        "results": rows,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print_summary(summary)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
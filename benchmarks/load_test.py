@@ -0,0 +1,337 @@
+"""
+End-to-end load test for /chat, /upload-image and /analyze-image.
+
+By default the Flask app is started in-process against a local Azure
+inference stub, so no quota is spent:
+
+    python -m benchmarks.load_test --users 16 --duration 30 --latency lognormal:600:0.35
+
+To drive an already running deployment instead, pass --target:
+
+    python -m benchmarks.load_test --target http://127.0.0.1:5000 --users 8
+
+Every user analyzes the same sample image, so the in-process app runs with
+the image analysis cache off unless --image-cache is given; otherwise all
+but the first /analyze-image request would be cache hits. A --target
+deployment should be started with IMAGE_CACHE_SIZE=0 for the same reason.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+
+from benchmarks.azure_stub import add_stub_arguments, config_from_args, start_stub
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_IMAGE = os.path.join(REPO_ROOT, "knowledge", "9012867_1.png")
+
+SAMPLE_QUESTIONS = [
+    "What are the treatment options for type 2 diabetes?",
+    "How is hypertension managed?",
+    "What exercises help with lower back pain?",
+    "What are the symptoms of carpal tunnel syndrome?",
+    "How long does rotator cuff rehabilitation take?",
+    "What is the first-line treatment for migraine prevention?",
+    "How should gout flares be managed?",
+    "What causes plantar fasciitis?",
+]
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values using linear interpolation."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(samples, elapsed):
+    """
+    Summarize latency samples.
+
+    Args:
+        samples (list): (latency_seconds, ok) tuples
+        elapsed (float): Wall time of the run in seconds
+
+    Returns:
+        dict: Throughput, latency percentiles in ms and error rate
+    """
+    latencies = [latency * 1000 for latency, _ in samples]
+    errors = sum(1 for _, ok in samples if not ok)
+    return {
+        "requests": len(samples),
+        "requests_per_sec": round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2) if latencies else 0.0,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+    }
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, endpoint, latency, ok):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((latency, ok))
+
+    def report(self, elapsed):
+        with self._lock:
+            report = {endpoint: summarize(samples, elapsed)
+                      for endpoint, samples in sorted(self.samples.items())}
+            everything = [s for samples in self.samples.values() for s in samples]
+        report["overall"] = summarize(everything, elapsed)
+        return report
+
+
+class AppClient:
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def post_json(self, path, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        request = urllib.request.Request(self.base_url + path, data=data, method="POST")
+        request.add_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            request.add_header(name, value)
+        return self._send(request)
+
+    def post_file(self, path, field, filename, content, content_type="image/png", headers=None):
+        boundary = uuid.uuid4().hex
+        body = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f"Content-Type: {content_type}\r\n\r\n"
+        ).encode("utf-8") + content + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        request = urllib.request.Request(self.base_url + path, data=body, method="POST")
+        request.add_header("Content-Type", f"multipart/form-data; boundary={boundary}")
+        for name, value in (headers or {}).items():
+            request.add_header(name, value)
+        return self._send(request)
+
+    def _send(self, request):
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, json.loads(response.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            try:
+                payload = json.loads(e.read() or b"{}")
+            except ValueError:
+                payload = {}
+            return e.code, payload
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            return 0, {"error": str(e)}
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, client, recorder, mix, deadline, think_time, image_bytes, max_requests=None):
+        super().__init__(daemon=True)
+        self.client = client
+        self.recorder = recorder
+        self.mix = mix
+        self.deadline = deadline
+        self.think_time = think_time
+        self.image_bytes = image_bytes
+        self.max_requests = max_requests
+        self.conversation = []
+
+    def run(self):
+        scenarios = [name for name, _ in self.mix]
+        weights = [weight for _, weight in self.mix]
+        sent = 0
+        while time.time() < self.deadline:
+            if self.max_requests is not None and sent >= self.max_requests:
+                break
+            getattr(self, f"_scenario_{random.choices(scenarios, weights)[0]}")()
+            sent += 1
+            if self.think_time:
+                time.sleep(random.expovariate(1 / self.think_time))
+
+    def _timed(self, endpoint, call):
+        start = time.perf_counter()
+        status, payload = call()
+        ok = status == 200 and "error" not in payload
+        self.recorder.record(endpoint, time.perf_counter() - start, ok)
+        return ok, payload
+
+    def _scenario_chat(self):
+        message = random.choice(SAMPLE_QUESTIONS)
+        ok, payload = self._timed("/chat", lambda: self.client.post_json(
+            "/chat", {"message": message, "conversation": self.conversation[-6:]}))
+        if ok:
+            self.conversation += [{"role": "user", "content": message},
+                                  {"role": "assistant", "content": payload.get("response", "")}]
+
+    def _upload(self):
+        return self._timed("/upload-image", lambda: self.client.post_file(
+            "/upload-image", "image", "load_test.png", self.image_bytes))
+
+    def _scenario_upload(self):
+        self._upload()
+
+    def _scenario_analyze(self):
+        ok, payload = self._upload()
+        if not ok:
+            return
+        self._timed("/analyze-image", lambda: self.client.post_json(
+            "/analyze-image", {"filename": payload["filename"],
+                               "question": "What can you tell me about this medical image?"}))
+
+
+def parse_mix(spec):
+    """Parse a scenario mix like 'chat=8,analyze=1,upload=1'."""
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ("chat", "analyze", "upload"):
+            raise ValueError(f"Unknown scenario: {name}")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+def start_app_in_process(stub_url, upload_folder, image_cache=False):
+    """
+    Import the Flask app pointed at the stub and serve it on an ephemeral port.
+
+    Args:
+        stub_url (str): Base URL of the Azure inference stub
+        upload_folder (str): Directory for uploaded images
+        image_cache (bool): Keep the image analysis cache on
+
+    Returns:
+        tuple: (base_url, server)
+    """
+    os.environ["AZURE_ENDPOINT"] = stub_url
+    os.environ.setdefault("AZURE_API_KEY", "stub-key")
+    os.chdir(REPO_ROOT)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+    import logging
+    from werkzeug.serving import make_server
+    import app as app_module
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if not image_cache:
+        app_module.analysis_cache.capacity = 0
+    app_module.app.config["UPLOAD_FOLDER"] = upload_folder
+    previews = app_module.previews
+    previews.upload_folder = upload_folder
+    previews.preview_folder = os.path.join(upload_folder, os.path.basename(previews.preview_folder))
+    os.makedirs(previews.preview_folder, exist_ok=True)
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="flask-app", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def run_load(base_url, users, duration, mix, think_time=0.0, max_requests=None, warmup=0):
+    """
+    Replay concurrent virtual users against base_url.
+
+    Returns:
+        dict: Per-endpoint and overall summaries
+    """
+    with open(SAMPLE_IMAGE, "rb") as f:
+        image_bytes = f.read()
+    client = AppClient(base_url)
+
+    if warmup:
+        run_load(base_url, users, warmup, mix, think_time)
+
+    recorder = Recorder()
+    start = time.time()
+    deadline = start + duration
+    threads = [VirtualUser(client, recorder, mix, deadline, think_time, image_bytes, max_requests)
+               for _ in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.report(time.time() - start)
+
+
+def print_report(report):
+    header = f"{'endpoint':<16}{'reqs':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, row in report.items():
+        print(f"{endpoint:<16}{row['requests']:>8}{row['requests_per_sec']:>10}"
+              f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['p99_ms']:>10}"
+              f"{row['error_rate'] * 100:>8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the healthcare assistant")
+    parser.add_argument("--target", help="Base URL of a running app; omit to start one in-process")
+    parser.add_argument("--users", type=int, default=8, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="Test duration in seconds")
+    parser.add_argument("--requests-per-user", type=int, help="Stop each user after N requests")
+    parser.add_argument("--warmup", type=float, default=0, help="Warm-up duration in seconds")
+    parser.add_argument("--mix", default="chat=8,analyze=1,upload=1",
+                        help="Scenario weights (default: chat=8,analyze=1,upload=1)")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Mean pause between a user's requests in seconds")
+    parser.add_argument("--image-cache", action="store_true",
+                        help="Keep the in-process app's image analysis cache on (off by default, as every "
+                             "user analyzes the same image)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    stub = None
+    upload_dir = None
+    base_url = args.target
+    if not base_url:
+        stub = start_stub(config_from_args(args))
+        upload_dir = tempfile.TemporaryDirectory(prefix="load_test_uploads_")
+        base_url, _ = start_app_in_process(stub.url, upload_dir.name, args.image_cache)
+        print(f"Started app at {base_url} against stub {stub.url} ({args.latency})")
+
+    report = run_load(base_url, args.users, args.duration, parse_mix(args.mix),
+                      args.think_time, args.requests_per_user, args.warmup)
+
+    result = {
+        "target": args.target or "in-process",
+        "users": args.users,
+        "duration": args.duration,
+        "mix": args.mix,
+        "image_cache": args.image_cache if not args.target else None,
+        "endpoints": report,
+    }
+    if stub is not None:
+        result["stub"] = {"latency": args.latency, "error_rate": args.error_rate,
+                          **stub.stats.to_dict()}
+
+    print_report(report)
+    if stub is not None:
+        print(f"\nUpstream calls: {result['stub']['requests']} "
+              f"(injected errors: {result['stub']['errors']}, hangs: {result['stub']['hangs']})")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    if stub is not None:
+        stub.shutdown()
+    if upload_dir is not None:
+        upload_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+"""
+Replay captured traffic against a build, with the recorded upstream latencies.
+
+Capture anonymized request shapes from a deployment (see request_capture.py),
+then replay them against the current checkout, or a running build, at their
+recorded arrival times:
+
+    REQUEST_CAPTURE=1 python app.py
+    python -m benchmarks.replay captures/ --output after.json
+    python -m benchmarks.replay captures/ --speed 4 --target http://127.0.0.1:5000 --stub-port 8001
+    python -m benchmarks.replay --compare before.json after.json
+
+Every request is rebuilt from its shape: messages of the recorded word
+count drawn from the knowledge base's vocabulary, conversations of the
+recorded depth and length, batches of the recorded size, and generated
+images of the recorded count, size and dimensions. Each request carries a marker that the stubbed upstream uses
+to answer its calls with the latencies recorded for that request, so two
+builds replayed from the same capture see identical load and upstream
+behaviour and differ only in their own code.
+
+The in-process app runs with the image analysis cache off, so every
+analysis reaches the upstream stub; pass --image-cache to keep it on and
+replay the recorded cache hits as hits. A --target build should be started
+with IMAGE_CACHE_SIZE=0 unless it is meant to use its cache.
+"""
+import os
+import re
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.azure_stub import StubConfig, StubServer, start_stub
+from benchmarks.corpus import load_vocabulary
+from benchmarks.load_test import SAMPLE_IMAGE, AppClient, Recorder, print_report, start_app_in_process, summarize
+from benchmarks.retrieval_bench import _git_commit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+import admission  # noqa: E402
+from admission import CLIENT_HEADER  # noqa: E402
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+REPLAY_MARKER = "zqreplay"
+_MARKER_PATTERN = re.compile(REPLAY_MARKER + r"(\d+)")
+ENDPOINTS = ("/chat", "/chat/batch", "/upload-image", "/analyze-image", "/analyze-images")
+CONTENT_TYPES = {"png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg"}
+DEFAULT_QUESTION = "What can you tell me about this medical image?"
+DEFAULT_IMAGES_QUESTION = "What can you tell me about these medical images?"
+# Seeds of the images of /analyze-images requests start after those of the single-image requests
+MAX_IMAGES_PER_REQUEST = 64
+# Used to size images whose capture has no dimensions (typical JPEG photo)
+BYTES_PER_PIXEL = 0.35
+
+
+def load_capture(paths, endpoints=ENDPOINTS):
+    """
+    Read capture files, or every capture file in a directory, in arrival order.
+
+    Returns:
+        list: Capture entries of the given endpoints, sorted by start time
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += [os.path.join(path, name) for name in sorted(os.listdir(path))
+                      if name.endswith(".jsonl") or ".jsonl." in name]
+        else:
+            files.append(path)
+
+    entries = []
+    for path in files:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("endpoint") in endpoints:
+                    entries.append(entry)
+    entries.sort(key=lambda entry: entry["t"])
+    return entries
+
+
+def arrival_offsets(entries, speed=1.0, max_gap=None):
+    """Seconds from the start of the replay at which each entry is sent."""
+    offsets = []
+    offset = 0.0
+    for previous, entry in zip([None] + entries, entries):
+        if previous is not None:
+            gap = max(entry["t"] - previous["t"], 0.0)
+            offset += min(gap, max_gap) if max_gap is not None else gap
+        offsets.append(offset / speed)
+    return offsets
+
+
+class ReplayStubServer(StubServer):
+    def __init__(self, address, config):
+        """Azure stub answering each replayed request's calls with its recorded upstream latencies."""
+        super().__init__(address, config)
+        self.latencies = {}
+        self.fallback = 0.0
+        self._replay_lock = threading.Lock()
+
+    def load(self, entries):
+        """Queue the recorded upstream latencies of every entry under its position."""
+        recorded = []
+        with self._replay_lock:
+            for number, entry in enumerate(entries):
+                calls = [ms / 1000 for ms in entry.get("upstream_ms") or []]
+                if calls:
+                    self.latencies[number] = deque(calls)
+                    recorded += calls
+        if recorded:
+            recorded.sort()
+            self.fallback = recorded[len(recorded) // 2]
+
+    def next_latency(self, body):
+        number = _marker(body)
+        with self._replay_lock:
+            calls = self.latencies.get(number)
+            if not calls:
+                # A call the capture has no latency for, e.g. one the replayed build added
+                return self.fallback
+            # Extra calls, such as hedges or a retry on another model, repeat the last latency
+            return calls.popleft() if len(calls) > 1 else calls[0]
+
+
+def _marker(body):
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts += [part.get("text", "") for part in content if isinstance(part, dict)]
+    found = _MARKER_PATTERN.findall(" ".join(texts))
+    return int(found[-1]) if found else None
+
+
+class RequestSynthesizer:
+    def __init__(self, seed=42):
+        """
+        Stand-in texts and images of recorded shapes.
+
+        Args:
+            seed (int): Seed of the generated texts and images
+        """
+        self.seed = seed
+        self.vocabulary = load_vocabulary()
+        self._weights = [1.0 / (rank + 1) for rank in range(len(self.vocabulary))]
+        self._average_word = sum(len(word) + 1 for word in self.vocabulary[:200]) / min(len(self.vocabulary), 200)
+        self._images = {}
+
+    def rng(self, number):
+        return random.Random(self.seed * 1_000_003 + number)
+
+    def text(self, rng, words):
+        return " ".join(rng.choices(self.vocabulary, weights=self._weights, k=max(int(words), 1)))
+
+    def conversation(self, rng, shape):
+        """Alternating user and assistant messages, ending with the assistant, of the recorded total length."""
+        depth = (shape or {}).get("depth") or 0
+        if not depth:
+            return []
+        words = max(round((shape.get("chars") or 0) / depth / self._average_word), 1)
+        roles = ["assistant" if (depth - position) % 2 else "user" for position in range(depth)]
+        return [{"role": role, "content": self.text(rng, words)} for role in roles]
+
+    def image(self, shape, unique=None):
+        """
+        Encode an image of the recorded type, dimensions and colour mode, at
+        about the recorded size.
+
+        Images are smooth random colour fields with grain, so each seed
+        hashes differently; the amount of grain is tuned on a small tile so
+        the encoded size comes close to the recorded one. Without a unique
+        seed the image is generated once per shape. Without Pillow the
+        sample image is used.
+
+        Returns:
+            tuple: (encoded bytes, file extension)
+        """
+        shape = shape or {}
+        extension = shape.get("type") or "png"
+        if Image is None:
+            with open(SAMPLE_IMAGE, "rb") as f:
+                return f.read(), "png"
+
+        size = shape.get("bytes") or 200_000
+        width, height = shape.get("width"), shape.get("height")
+        if not width or not height:
+            pixels = max(size / BYTES_PER_PIXEL, 64 * 48)
+            width, height = int((pixels * 4 / 3) ** 0.5), int((pixels * 3 / 4) ** 0.5)
+        grayscale = shape.get("mode") in ("1", "L", "LA", "I", "I;16", "F")
+        key = (width, height, extension, size, grayscale, unique)
+        if key in self._images:
+            return self._images[key]
+
+        rng = random.Random(self.seed if unique is None else self.seed * 7919 + unique)
+        colours = rng.randbytes(8 * 6 * 3)
+        grain = self._grain(colours, extension, size / (width * height), grayscale)
+        result = (_encode(_field(colours, (width, height), grain, grayscale), extension), extension)
+        if unique is None:
+            self._images[key] = result
+        return result
+
+    @staticmethod
+    def _grain(colours, extension, bytes_per_pixel, grayscale, steps=6):
+        tile = (256, 192)
+        low, high = 0.0, 0.6
+        for _ in range(steps):
+            grain = (low + high) / 2
+            if len(_encode(_field(colours, tile, grain, grayscale), extension)) / (tile[0] * tile[1]) > bytes_per_pixel:
+                high = grain
+            else:
+                low = grain
+        return (low + high) / 2
+
+
+def _field(colours, size, grain, grayscale=False):
+    field = Image.frombytes("RGB", (8, 6), colours).resize(size, Image.BICUBIC)
+    if grayscale:
+        field = field.convert("L")
+    if not grain:
+        return field
+    return Image.blend(field, Image.effect_noise(size, 64).convert(field.mode), grain)
+
+
+def _encode(image, extension):
+    buffer = io.BytesIO()
+    if extension in ("jpg", "jpeg"):
+        image.save(buffer, "JPEG", quality=90)
+    else:
+        image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def build_requests(entries, client, synthesizer):
+    """
+    Turn capture entries into request thunks.
+
+    Images that analyze requests refer to are uploaded here, before the
+    timed run. Analyses that hit the image cache in the capture ask a fixed
+    question about images the same client analyzed here first, so they hit
+    it again when the target's cache is on. In "each" mode only the
+    recorded number of images are such cache hits.
+
+    Returns:
+        list: (endpoint, callable returning (status, payload)) per entry
+    """
+    requests = []
+    warm = {}
+
+    def warmed(headers, shapes, combined=False):
+        # Images this client has already asked the fixed question about
+        key = (headers.get(CLIENT_HEADER), len(shapes), combined)
+        if key not in warm:
+            filenames = [_upload(client, *synthesizer.image(image, unique=-1 - position))
+                         for position, image in enumerate(shapes)]
+            if combined:
+                client.post_json("/analyze-images", {"filenames": filenames, "question": DEFAULT_IMAGES_QUESTION},
+                                 headers)
+            else:
+                for filename in filenames:
+                    client.post_json("/analyze-image", {"filename": filename, "question": DEFAULT_QUESTION}, headers)
+            warm[key] = filenames
+        return warm[key]
+
+    for number, entry in enumerate(entries):
+        rng = synthesizer.rng(number)
+        shape = entry.get("shape") or {}
+        headers = {CLIENT_HEADER: entry["client"]} if entry.get("client") else {}
+        marker = f"{REPLAY_MARKER}{number}"
+        endpoint = entry["endpoint"]
+
+        if endpoint == "/chat":
+            payload = {
+                "message": f"{synthesizer.text(rng, (shape.get('message') or {}).get('words', 8))} {marker}",
+                "conversation": synthesizer.conversation(rng, shape.get("conversation")),
+            }
+            if shape.get("category") == "auto":
+                payload["category"] = "auto"
+            requests.append((endpoint, _post_json(client, endpoint, payload, headers)))
+
+        elif endpoint == "/chat/batch":
+            messages = []
+            for item in shape.get("messages") or [{}] * (shape.get("batch_size") or 1):
+                message = {
+                    "message": f"{synthesizer.text(rng, (item.get('message') or {}).get('words', 8))} {marker}",
+                    "conversation": synthesizer.conversation(rng, item.get("conversation")),
+                }
+                if item.get("category") == "auto":
+                    message["category"] = "auto"
+                messages.append(message)
+            payload = {"messages": messages, "stream": bool(shape.get("stream"))}
+            if shape.get("concurrency"):
+                payload["concurrency"] = shape["concurrency"]
+            requests.append((endpoint, _post_json(client, endpoint, payload, headers)))
+
+        elif endpoint == "/upload-image":
+            content, extension = synthesizer.image(shape)
+            requests.append((endpoint, _post_image(client, content, extension, headers)))
+
+        elif endpoint == "/analyze-image":
+            if shape.get("cache_hit"):
+                filename, question = warmed(headers, [shape.get("image")])[0], DEFAULT_QUESTION
+            else:
+                filename = _upload(client, *synthesizer.image(shape.get("image"), unique=number))
+                words = (shape.get("question") or {}).get("words")
+                question = f"{synthesizer.text(rng, words) if words else DEFAULT_QUESTION} {marker}"
+            payload = {
+                "filename": filename,
+                "question": question,
+                "conversation": synthesizer.conversation(rng, shape.get("conversation")),
+            }
+            requests.append((endpoint, _post_json(client, endpoint, payload, headers)))
+
+        elif endpoint == "/analyze-images":
+            images = shape.get("images") or [None] * (shape.get("image_count") or 1)
+            mode = shape.get("mode") or "combined"
+            if mode == "combined" and shape.get("cache_hit"):
+                filenames, question = warmed(headers, images, combined=True), DEFAULT_IMAGES_QUESTION
+            else:
+                hits = min(shape.get("cache_hits") or 0, len(images)) if mode == "each" else 0
+                filenames = warmed(headers, images[:hits]) if hits else []
+                filenames += [_upload(client, *synthesizer.image(image, unique=len(entries) + number *
+                                                                 MAX_IMAGES_PER_REQUEST + position))
+                              for position, image in enumerate(images[hits:], hits)]
+                if hits:
+                    # The cache matches the question, so the images it answers cannot carry the marker
+                    question = DEFAULT_QUESTION
+                else:
+                    words = (shape.get("question") or {}).get("words")
+                    question = f"{synthesizer.text(rng, words) if words else DEFAULT_IMAGES_QUESTION} {marker}"
+            payload = {
+                "filenames": filenames,
+                "mode": mode,
+                "question": question,
+                "conversation": synthesizer.conversation(rng, shape.get("conversation")),
+            }
+            requests.append((endpoint, _post_json(client, endpoint, payload, headers)))
+    return requests
+
+
+def _post_json(client, path, payload, headers):
+    return lambda: client.post_json(path, payload, headers)
+
+
+def _post_image(client, content, extension, headers):
+    content_type = CONTENT_TYPES.get(extension, "application/octet-stream")
+    return lambda: client.post_file("/upload-image", "image", f"replay.{extension}", content, content_type, headers)
+
+
+def _upload(client, content, extension):
+    status, payload = client.post_file("/upload-image", "image", f"replay.{extension}", content,
+                                       CONTENT_TYPES.get(extension, "application/octet-stream"))
+    if status != 200:
+        raise RuntimeError(f"Uploading a replay image failed with {status}: {payload}")
+    return payload["filename"]
+
+
+def run_replay(requests, offsets, concurrency=64):
+    """
+    Send every request at its offset and time it.
+
+    Latency is measured from the scheduled send time, so requests delayed
+    because every client thread was busy count as slow instead of being
+    sent late and timed as if the server were keeping up.
+
+    Returns:
+        dict: Per-endpoint and overall summaries
+    """
+    recorder = Recorder()
+
+    def send(endpoint, call, due):
+        status, payload = call()
+        recorder.record(endpoint, time.perf_counter() - due, status == 200 and "error" not in payload)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as executor:
+        for (endpoint, call), offset in zip(requests, offsets):
+            due = start + offset
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, endpoint, call, due)
+    return recorder.report(time.perf_counter() - start)
+
+
+def recorded_report(entries, offsets):
+    """
+    Summarize the latencies the capture recorded.
+
+    These are server-side durations from the profiler, so they leave out
+    the network and client time the replayed latencies include; compare
+    replays with replays.
+    """
+    samples = {}
+    for entry in entries:
+        samples.setdefault(entry["endpoint"], []).append((entry["duration_ms"] / 1000, entry.get("status") == 200))
+    elapsed = offsets[-1] if offsets else 0.0
+    report = {endpoint: summarize(values, elapsed) for endpoint, values in sorted(samples.items())}
+    report["overall"] = summarize([sample for values in samples.values() for sample in values], elapsed)
+    return report
+
+
+def compare(before_path, after_path):
+    """Print the relative change of throughput, tail latency and errors per endpoint between two replays."""
+    with open(before_path) as f:
+        before = json.load(f)["replayed"]
+    with open(after_path) as f:
+        after = json.load(f)["replayed"]
+
+    metrics = ("requests_per_sec", "p50_ms", "p95_ms", "p99_ms", "max_ms", "error_rate")
+    for endpoint in [name for name in before if name in after]:
+        print(endpoint)
+        for metric in metrics:
+            old, new = before[endpoint][metric], after[endpoint][metric]
+            change = f"{(new - old) / old * 100:>+10.1f}%" if old else ""
+            print(f"  {metric:<18}{old:>12}{new:>12}{change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured requests with their recorded upstream latencies")
+    parser.add_argument("capture", nargs="*", help="Capture files or directories (default: captures/)")
+    parser.add_argument("--target", help="Base URL of a running build; omit to start the checkout in-process")
+    parser.add_argument("--stub-port", type=int, default=0,
+                        help="Port of the upstream stub; a --target build must use it as AZURE_ENDPOINT")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        help=f"Comma-separated endpoints to replay (default: {','.join(ENDPOINTS)})")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay this many times faster than recorded")
+    parser.add_argument("--max-gap", type=float, help="Shorten pauses between requests to at most this many seconds")
+    parser.add_argument("--limit", type=int, help="Replay only the first N requests")
+    parser.add_argument("--concurrency", type=int, default=64, help="Most requests in flight")
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the generated texts and images")
+    parser.add_argument("--image-cache", action="store_true",
+                        help="Keep the in-process app's image analysis cache on, so recorded cache hits hit again")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compare two replay reports instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    endpoints = tuple(name.strip() for name in args.endpoints.split(",") if name.strip())
+    entries = load_capture(args.capture or [os.path.join(REPO_ROOT, "captures")], endpoints)
+    if args.limit:
+        entries = entries[:args.limit]
+    if not entries:
+        parser.error("No captured requests found")
+
+    stub = start_stub(StubConfig(), port=args.stub_port, server_class=ReplayStubServer)
+    stub.load(entries)
+    upload_dir = None
+    base_url = args.target
+    if not base_url:
+        # Replayed requests tell their clients apart by X-Client-Id
+        admission.ADMISSION_TRUST_CLIENT_HEADER = True
+        upload_dir = tempfile.TemporaryDirectory(prefix="replay_uploads_")
+        base_url, _ = start_app_in_process(stub.url, upload_dir.name, args.image_cache)
+        print(f"Started app at {base_url} against the replay stub {stub.url}")
+    else:
+        print(f"Replaying against {base_url}; it must use AZURE_ENDPOINT={stub.url}")
+
+    client = AppClient(base_url)
+    print(f"Preparing {len(entries)} requests...")
+    requests = build_requests(entries, client, RequestSynthesizer(args.seed))
+    offsets = arrival_offsets(entries, args.speed, args.max_gap)
+    print(f"Replaying over {offsets[-1]:.1f} s at {args.speed}x")
+    replayed = run_replay(requests, offsets, args.concurrency)
+
+    result = {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": args.target or "in-process",
+        "requests": len(entries),
+        "speed": args.speed,
+        "max_gap": args.max_gap,
+        "seed": args.seed,
+        "image_cache": args.image_cache if not args.target else None,
+        "recorded": recorded_report(entries, arrival_offsets(entries, 1.0, args.max_gap)),
+        "replayed": replayed,
+        "stub": stub.stats.to_dict(),
+    }
+
+    print_report(replayed)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    stub.shutdown()
+    if upload_dir is not None:
+        upload_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
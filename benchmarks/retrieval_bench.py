@@ -0,0 +1,357 @@
+"""
+Retrieval scaling microbenchmarks over synthetic corpora.
+
+For every backend and corpus size this times document loading, index build,
+query latency percentiles, memory footprint and ingest throughput, and writes
+the results as JSON so runs can be compared across commits:
+
+    python -m benchmarks.retrieval_bench --sizes 1000,100000 --output retrieval.json
+    python -m benchmarks.retrieval_bench --compare before.json after.json
+"""
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+
+from benchmarks.corpus import SyntheticCorpus
+from benchmarks.load_test import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def _keyword_backend(data_path):
+    from knowledge_base import AzureKnowledgeBase
+    return AzureKnowledgeBase(data_path=data_path)
+
+
+def _keyword_disk_backend(data_path):
+    from knowledge_base import AzureKnowledgeBase
+    return AzureKnowledgeBase(data_path=data_path, storage="disk")
+
+
+def _keyword_sharded_backend(data_path):
+    from knowledge_base import AzureKnowledgeBase
+    return AzureKnowledgeBase(data_path=data_path, shards=os.cpu_count() or 1)
+
+
+BACKENDS = {
+    "keyword": _keyword_backend,
+    "keyword-disk": _keyword_disk_backend,
+    "keyword-sharded": _keyword_sharded_backend,
+}
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _close(kb):
+    close = getattr(kb, "close", None)
+    if close:
+        close()
+
+
+def time_queries(kb, queries, top_k=3, warmup=10, categories=None):
+    """Run queries against kb, optionally restricted to categories, and return latency statistics in milliseconds."""
+    for query in queries[:warmup]:
+        kb.search(query, top_k, categories)
+
+    latencies = []
+    start = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        kb.search(query, top_k, categories)
+        latencies.append((time.perf_counter() - query_start) * 1000)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "queries": len(latencies),
+        "qps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 4),
+        "p95_ms": round(percentile(latencies, 95), 4),
+        "p99_ms": round(percentile(latencies, 99), 4),
+    }
+
+
+def document_bytes(documents):
+    """
+    Bytes held by the document objects themselves, apart from the index.
+
+    Counts each object and the values it owns: id, title, content and the
+    term tuples. Category strings and the terms inside the tuples are
+    interned and shared with the postings, so they are left to the index.
+    """
+    total = 0
+    for doc in documents:
+        total += sys.getsizeof(doc)
+        for cls in type(doc).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if name in ("category", "_store", "_entry"):
+                    continue
+                value = getattr(doc, name, None)
+                if value is not None and not isinstance(value, int):
+                    total += sys.getsizeof(value)
+    return total
+
+
+def measure_memory(factory, data_path, size):
+    """
+    Load the corpus under tracemalloc and report the retained allocation,
+    split into the document objects and everything else (postings,
+    vocabulary, suggestion and duplicate indexes).
+    """
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    kb = factory(data_path)
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    retained = sum(stat.size_diff for stat in
+                   tracemalloc.take_snapshot().compare_to(baseline, "filename"))
+    tracemalloc.stop()
+    documents = document_bytes(kb.documents)
+    _close(kb)
+    del kb
+    return {
+        "retained_bytes": retained,
+        "peak_bytes": peak,
+        "bytes_per_document": round(retained / size, 1) if size else 0.0,
+        "document_bytes_per_document": round(documents / size, 1) if size else 0.0,
+        "index_bytes_per_document": round((retained - documents) / size, 1) if size else 0.0,
+    }
+
+
+def measure_ingest(factory, corpus, count, workdir):
+    """Time add_document into an empty knowledge base."""
+    data_path = os.path.join(workdir, "ingest")
+    os.makedirs(data_path, exist_ok=True)
+    kb = factory(data_path)
+    docs = list(corpus.documents(count, start=10 ** 8))
+
+    start = time.perf_counter()
+    for doc in docs:
+        kb.add_document(doc["title"], doc["content"], doc["category"])
+    flush = getattr(kb, "flush", None)
+    if flush:
+        flush()
+    elapsed = time.perf_counter() - start
+
+    _close(kb)
+    shutil.rmtree(data_path, ignore_errors=True)
+    return {
+        "documents": count,
+        "seconds": round(elapsed, 4),
+        "documents_per_sec": round(count / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def measure_edits(kb, corpus, count, seed=42):
+    """
+    Time update_document and delete_document on random documents.
+
+    The edits are written to the corpus directory's document log; call
+    _discard_edits afterwards so later loads see the generated corpus.
+    """
+    rng = random.Random(seed)
+    doc_ids = rng.sample([doc.id for doc in kb.documents], min(count, len(kb.documents)))
+    updates, deletes = [], []
+    for number, doc_id in enumerate(doc_ids):
+        if number % 2:
+            start = time.perf_counter()
+            kb.delete_document(doc_id)
+            deletes.append((time.perf_counter() - start) * 1000)
+        else:
+            replacement = corpus.document(10 ** 9 + number)
+            start = time.perf_counter()
+            kb.update_document(doc_id, replacement["title"], replacement["content"])
+            updates.append((time.perf_counter() - start) * 1000)
+    return {
+        "updates": len(updates),
+        "update_p50_ms": round(percentile(updates, 50), 4),
+        "update_p99_ms": round(percentile(updates, 99), 4),
+        "deletes": len(deletes),
+        "delete_p50_ms": round(percentile(deletes, 50), 4),
+        "delete_p99_ms": round(percentile(deletes, 99), 4),
+    }
+
+
+def _discard_edits(data_path):
+    for name in os.listdir(data_path):
+        if name.startswith("documents."):
+            os.remove(os.path.join(data_path, name))
+
+
+def bench_backend(name, factory, corpus, size, data_path, workdir, queries, ingest_count, memory, edit_count=0):
+    gc.collect()
+    start = time.perf_counter()
+    kb = factory(data_path)
+    load_seconds = time.perf_counter() - start
+
+    result = {
+        "backend": name,
+        "size": size,
+        "documents_loaded": len(kb.documents),
+        "load_seconds": round(load_seconds, 4),
+        "load_documents_per_sec": round(size / load_seconds, 1) if load_seconds else 0.0,
+    }
+
+    build_index = getattr(kb, "build_index", None)
+    if build_index:
+        start = time.perf_counter()
+        build_index()
+        result["index_build_seconds"] = round(time.perf_counter() - start, 4)
+    else:
+        result["index_build_seconds"] = None
+
+    result["query"] = time_queries(kb, queries)
+    if edit_count:
+        result["edits"] = measure_edits(kb, corpus, edit_count)
+    _close(kb)
+    del kb
+    if edit_count:
+        _discard_edits(data_path)
+
+    if memory:
+        result["memory"] = measure_memory(factory, data_path, size)
+    if ingest_count:
+        result["ingest"] = measure_ingest(factory, corpus, ingest_count, workdir)
+    return result
+
+
+def run(sizes, backends, query_count=200, ingest_count=1000, memory=True, seed=42, workdir=None, edit_count=200):
+    """
+    Run the benchmark matrix.
+
+    Args:
+        sizes (list): Corpus sizes to generate
+        backends (list): Names from BACKENDS
+        query_count (int): Timed queries per run
+        ingest_count (int): Documents added when measuring ingest throughput
+        edit_count (int): Documents updated or deleted when timing edits
+        memory (bool): Whether to measure memory with tracemalloc
+        seed (int): Corpus seed
+        workdir (str, optional): Where corpora are generated
+
+    Returns:
+        dict: Metadata and one result per (backend, size)
+    """
+    import knowledge_base  # noqa: F401 - keep module import time out of the load timings
+
+    corpus = SyntheticCorpus(seed=seed)
+    queries = corpus.queries(query_count)
+    results = []
+
+    root = tempfile.mkdtemp(prefix="retrieval_bench_", dir=workdir)
+    try:
+        for size in sizes:
+            data_path = os.path.join(root, f"corpus_{size}")
+            start = time.perf_counter()
+            corpus.write(data_path, size)
+            print(f"Generated {size} documents in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+            for name in backends:
+                result = bench_backend(name, BACKENDS[name], corpus, size, data_path, root,
+                                       queries, min(ingest_count, size), memory, edit_count)
+                results.append(result)
+                print(f"{name:<10} {size:>9}  load {result['load_seconds']:.2f}s  "
+                      f"p50 {result['query']['p50_ms']:.3f}ms  p99 {result['query']['p99_ms']:.3f}ms",
+                      file=sys.stderr)
+
+            shutil.rmtree(data_path, ignore_errors=True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "results": results,
+    }
+
+
+def compare(before_path, after_path):
+    """Print the relative change of the headline metrics between two result files."""
+    with open(before_path) as f:
+        before = {(r["backend"], r["size"]): r for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = {(r["backend"], r["size"]): r for r in json.load(f)["results"]}
+
+    metrics = [
+        ("load_seconds", lambda r: r["load_seconds"]),
+        ("query_p50_ms", lambda r: r["query"]["p50_ms"]),
+        ("query_p99_ms", lambda r: r["query"]["p99_ms"]),
+        ("bytes_per_doc", lambda r: r.get("memory", {}).get("bytes_per_document")),
+        ("document_bytes_per_doc", lambda r: r.get("memory", {}).get("document_bytes_per_document")),
+        ("index_bytes_per_doc", lambda r: r.get("memory", {}).get("index_bytes_per_document")),
+        ("ingest_docs_per_sec", lambda r: r.get("ingest", {}).get("documents_per_sec")),
+        ("update_p99_ms", lambda r: r.get("edits", {}).get("update_p99_ms")),
+        ("delete_p99_ms", lambda r: r.get("edits", {}).get("delete_p99_ms")),
+    ]
+    for key in sorted(set(before) & set(after)):
+        print(f"{key[0]} @ {key[1]}")
+        for label, getter in metrics:
+            old, new = getter(before[key]), getter(after[key])
+            if not old or new is None:
+                continue
+            print(f"  {label:<24}{old:>14.4f}{new:>14.4f}{(new - old) / old * 100:>+10.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval scaling microbenchmarks")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Comma-separated corpus sizes (default: 1000,10000,100000)")
+    parser.add_argument("--backends", default=",".join(BACKENDS),
+                        help=f"Comma-separated backends (available: {', '.join(BACKENDS)})")
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries per run")
+    parser.add_argument("--ingest", type=int, default=1000, help="Documents added in the ingest test")
+    parser.add_argument("--edits", type=int, default=200, help="Documents updated or deleted in the edit test")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc pass")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="Directory for generated corpora (default: system temp)")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"),
+                        help="Compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    logging.disable(logging.INFO)
+    backends = [name.strip() for name in args.backends.split(",") if name.strip()]
+    unknown = [name for name in backends if name not in BACKENDS]
+    if unknown:
+        parser.error(f"Unknown backends: {', '.join(unknown)}")
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = run(sizes, backends, args.queries, args.ingest, not args.no_memory, args.seed, args.workdir, args.edits)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
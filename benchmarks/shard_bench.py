@@ -0,0 +1,158 @@
+"""
+Keyword search latency and throughput against the number of search shards.
+
+Loads one synthetic corpus, then times the same queries in-process and with
+each shard count, both one query at a time (latency), restricted to one
+category (filtered latency) and from several threads at once (throughput). Shards only pay off with as many idle cores as
+shards; on fewer cores the result shows the cost of the round trip instead.
+
+    python -m benchmarks.shard_bench --size 200000 --shards 1,2,4,8
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+
+from benchmarks.corpus import CATEGORIES, SyntheticCorpus
+from benchmarks.load_test import percentile
+from benchmarks.retrieval_bench import _close, _git_commit, time_queries
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def time_concurrent(kb, queries, threads, top_k=3):
+    """Run queries from several threads and return the overall throughput and latency."""
+    latencies = []
+    lock = threading.Lock()
+    chunks = [queries[offset::threads] for offset in range(threads)]
+
+    def worker(chunk):
+        own = []
+        for query in chunk:
+            start = time.perf_counter()
+            kb.search(query, top_k)
+            own.append((time.perf_counter() - start) * 1000)
+        with lock:
+            latencies.extend(own)
+
+    pool = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "threads": threads,
+        "queries": len(latencies),
+        "qps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 4),
+        "p99_ms": round(percentile(latencies, 99), 4),
+    }
+
+
+def run(size, shard_counts, query_count=500, threads=None, seed=42, workdir=None):
+    """
+    Time in-process search and every shard count on one corpus.
+
+    Args:
+        size (int): Corpus size
+        shard_counts (list): Shard counts to compare with in-process search
+        query_count (int): Timed queries per configuration
+        threads (int, optional): Client threads for the throughput run
+            (default: one per CPU, at least 4)
+        seed (int): Corpus seed
+        workdir (str, optional): Where the corpus is generated
+
+    Returns:
+        dict: Metadata and one result per configuration, with the speedup
+        over in-process search
+    """
+    from knowledge_base import AzureKnowledgeBase
+
+    cpus = os.cpu_count() or 1
+    threads = threads or max(4, cpus)
+    corpus = SyntheticCorpus(seed=seed)
+    queries = corpus.queries(query_count)
+    results = []
+
+    root = tempfile.mkdtemp(prefix="shard_bench_", dir=workdir)
+    try:
+        data_path = os.path.join(root, "corpus")
+        corpus.write(data_path, size)
+        for shards in [0] + shard_counts:
+            start = time.perf_counter()
+            kb = AzureKnowledgeBase(data_path=data_path, shards=shards)
+            result = {
+                "shards": shards,
+                "load_seconds": round(time.perf_counter() - start, 4),
+                "sequential": time_queries(kb, queries),
+                "filtered": time_queries(kb, queries, categories=[CATEGORIES[0]]),
+                "concurrent": time_concurrent(kb, queries, threads),
+            }
+            _close(kb)
+            del kb
+            results.append(result)
+            print(f"shards {shards or 'off':>4}  p50 {result['sequential']['p50_ms']:.3f}ms  "
+                  f"p99 {result['sequential']['p99_ms']:.3f}ms  "
+                  f"filtered p50 {result['filtered']['p50_ms']:.3f}ms  "
+                  f"{result['concurrent']['qps']:.0f} qps with {threads} threads", file=sys.stderr)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    baseline = results[0]
+    for result in results:
+        result["latency_speedup"] = round(baseline["sequential"]["p50_ms"] / result["sequential"]["p50_ms"], 2)
+        result["throughput_speedup"] = round(result["concurrent"]["qps"] / baseline["concurrent"]["qps"], 2)
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": cpus,
+        "size": size,
+        "seed": seed,
+        "results": results,
+    }
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    default_shards = ",".join(str(n) for n in (1, 2, 4, 8, 16) if n <= max(cpus, 2))
+    parser = argparse.ArgumentParser(description="Sharded keyword search scaling benchmark")
+    parser.add_argument("--size", type=int, default=100000, help="Corpus size (default: 100000)")
+    parser.add_argument("--shards", default=default_shards,
+                        help=f"Comma-separated shard counts (default: {default_shards})")
+    parser.add_argument("--queries", type=int, default=500, help="Timed queries per configuration")
+    parser.add_argument("--threads", type=int, help="Client threads for the throughput run")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workdir", help="Directory for the generated corpus (default: system temp)")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    shard_counts = [int(n) for n in args.shards.split(",") if n.strip()]
+    if any(n < 1 for n in shard_counts):
+        parser.error("Shard counts must be at least 1")
+    report = run(args.size, shard_counts, args.queries, args.threads, args.seed, args.workdir)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
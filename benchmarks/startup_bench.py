@@ -0,0 +1,140 @@
+"""
+Cold-start benchmark and import-time budget check.
+
+Times `import app` in fresh interpreters and parses `python -X importtime`
+output to enforce a budget on the app's cumulative import time. Modules that
+must only be loaded on first use (Azure SDK, scikit-learn, SciPy) fail the
+check if they are imported at startup:
+
+    python -m benchmarks.startup_bench --runs 5
+    python -m benchmarks.startup_bench --check --budget-ms 600
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+from benchmarks.load_test import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULE = "app"
+DEFAULT_BUDGET_MS = 600
+DEFERRED_MODULES = ("azure", "sklearn", "scipy")
+
+
+def _run(args, env=None):
+    merged = dict(os.environ, **(env or {}))
+    return subprocess.run([sys.executable, *args], cwd=REPO_ROOT, env=merged,
+                          capture_output=True, text=True)
+
+
+def time_cold_start(module=DEFAULT_MODULE, runs=5):
+    """
+    Import module in runs fresh interpreters.
+
+    Returns:
+        dict: Wall-clock statistics of the import in milliseconds
+    """
+    code = (
+        "import time, logging; logging.disable(logging.INFO); start = time.perf_counter(); "
+        f"import {module}; print((time.perf_counter() - start) * 1000)"
+    )
+    samples = []
+    for _ in range(runs):
+        result = _run(["-c", code])
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip().splitlines()[-1])
+        samples.append(float(result.stdout.strip().splitlines()[-1]))
+    return {
+        "runs": runs,
+        "median_ms": round(statistics.median(samples), 1),
+        "min_ms": round(min(samples), 1),
+        "p90_ms": round(percentile(samples, 90), 1),
+    }
+
+
+def parse_importtime(stderr):
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        list: (module, self_us, cumulative_us, depth) tuples in import order
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_field, cumulative_field, raw_name = line.split("|", 2)
+        self_us = int(self_field.split(":")[1])
+        cumulative_us = int(cumulative_field)
+        depth = (len(raw_name) - len(raw_name.lstrip())) // 2
+        rows.append((raw_name.strip(), self_us, cumulative_us, depth))
+    return rows
+
+
+def import_profile(module=DEFAULT_MODULE):
+    """Run `-X importtime` for module and return the parsed rows."""
+    result = _run(["-X", "importtime", "-c", f"import {module}"])
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return parse_importtime(result.stderr)
+
+
+def check_budget(rows, module=DEFAULT_MODULE, budget_ms=DEFAULT_BUDGET_MS, deferred=DEFERRED_MODULES):
+    """
+    Check an import profile against the startup budget.
+
+    Returns:
+        tuple: (ok, summary dict)
+    """
+    cumulative_ms = next((cum / 1000 for name, _, cum, _ in rows if name == module), 0.0)
+    eager = sorted({name.split(".")[0] for name, _, _, _ in rows
+                    if name.split(".")[0] in deferred})
+    heaviest = sorted(((name, cum / 1000) for name, _, cum, depth in rows if depth <= 2),
+                      key=lambda item: item[1], reverse=True)[:10]
+
+    ok = cumulative_ms <= budget_ms and not eager
+    return ok, {
+        "module": module,
+        "cumulative_ms": round(cumulative_ms, 1),
+        "budget_ms": budget_ms,
+        "eagerly_imported": eager,
+        "heaviest_imports": [{"module": name, "cumulative_ms": round(ms, 1)} for name, ms in heaviest],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark and import-time budget")
+    parser.add_argument("--module", default=DEFAULT_MODULE, help="Module to import (default: app)")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters to time")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help=f"Cumulative import-time budget (default: {DEFAULT_BUDGET_MS})")
+    parser.add_argument("--check", action="store_true",
+                        help="Only run the importtime budget check; exit 1 when it fails")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    args = parser.parse_args()
+
+    ok, budget = check_budget(import_profile(args.module), args.module, args.budget_ms)
+    report = {"budget": budget}
+    if not args.check:
+        report["cold_start"] = time_cold_start(args.module, args.runs)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if not ok:
+        if budget["eagerly_imported"]:
+            print(f"FAIL: imported at startup: {', '.join(budget['eagerly_imported'])}", file=sys.stderr)
+        if budget["cumulative_ms"] > args.budget_ms:
+            print(f"FAIL: import of {args.module} took {budget['cumulative_ms']} ms "
+                  f"(budget {args.budget_ms} ms)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import os
+import random
+from array import array
+from operator import eq
+
+SHINGLE_SIZE = 3
+SIGNATURE_BITS = 6
+SIGNATURE_SIZE = 1 << SIGNATURE_BITS
+LSH_BANDS = 16
+# Estimated Jaccard similarity above which two documents are near-duplicates
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", "0.8"))
+# "flag" keeps near-duplicates but collapses them in search results;
+# "merge" does not add them to the knowledge base at all
+DEDUP_MODE = os.environ.get("DEDUP_MODE", "flag")
+
+_MASK = 0xFFFFFFFF
+_VALUE_BITS = 32 - SIGNATURE_BITS
+_VALUE_MASK = (1 << _VALUE_BITS) - 1
+_EMPTY = _MASK
+# Fixed random order in which each empty bin looks for a filled one to borrow from.
+# Neighbouring empty bins then borrow from different bins, so an LSH band made of
+# empty bins does not collapse into one shared value.
+_PROBES = [random.Random(position).sample(range(SIGNATURE_SIZE), SIGNATURE_SIZE) for position in range(SIGNATURE_SIZE)]
+
+
+def shingle_hashes(terms, size=SHINGLE_SIZE):
+    """Return the 32-bit hashes of the distinct shingles of a term sequence."""
+    if len(terms) < size:
+        return {hash(tuple(terms)) & _MASK} if terms else set()
+    return {hash(shingle) & _MASK for shingle in zip(*(terms[i:] for i in range(size)))}
+
+
+def signature(terms):
+    """
+    Compute the MinHash signature of a document with one-permutation hashing.
+
+    Shingles are taken over the document's index terms (Document.terms:
+    normalized, stopwords removed, first occurrences in order), which are
+    already computed at load and make the signature insensitive to
+    punctuation, inflection and repeated words.
+
+    Instead of SIGNATURE_SIZE independent hash functions, each shingle is
+    hashed once: the top bits pick a bin and the bin keeps the minimum of the
+    remaining bits. Empty bins borrow from a non-empty one, probed in a
+    fixed random order per bin, so that signatures of short texts stay
+    comparable. The cost is linear in the number of shingles. Shingles are
+    hashed with Python's string hash, so signatures are only comparable
+    within one process.
+
+    Args:
+        terms (tuple): The document's index terms
+
+    Returns:
+        array: SIGNATURE_SIZE unsigned ints, or None for a document without terms
+    """
+    hashes = shingle_hashes(terms)
+    if not hashes:
+        return None
+
+    bins = [_EMPTY] * SIGNATURE_SIZE
+    value_bits, value_mask = _VALUE_BITS, _VALUE_MASK
+    # Tuple hashes are already well mixed, so the top bits can pick the bin directly
+    for h in hashes:
+        slot = h >> value_bits
+        value = h & value_mask
+        if value < bins[slot]:
+            bins[slot] = value
+
+    if _EMPTY in bins:
+        filled = list(bins)
+        for position, value in enumerate(bins):
+            if value != _EMPTY:
+                continue
+            for attempt, source in enumerate(_PROBES[position], 1):
+                value = bins[source]
+                if value != _EMPTY:
+                    # Offset by the attempt so borrowed values differ from the source bin
+                    filled[position] = (value + attempt * 0x6F4F2A41) & _MASK
+                    break
+        bins = filled
+    return array('I', bins)
+
+
+def similarity(a, b):
+    """Estimate the Jaccard similarity of two documents from their signatures."""
+    return sum(map(eq, a, b)) / len(a)
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold=DEDUP_THRESHOLD, bands=LSH_BANDS):
+        """
+        Locality-sensitive hashing index over document MinHash signatures.
+
+        Signatures are split into bands; documents sharing any band are
+        candidates, confirmed by comparing full signatures. With 16 bands of
+        4 rows, pairs above ~0.5 similarity almost always collide, so a 0.8
+        threshold loses very few duplicates while each lookup only touches
+        its own buckets.
+
+        Each document is assigned a representative: itself, or the first
+        indexed document it duplicates. Search uses representatives to
+        collapse copies of the same text into one result.
+
+        Args:
+            threshold (float): Minimum estimated similarity of a duplicate
+            bands (int): Number of LSH bands (must divide SIGNATURE_SIZE)
+        """
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = SIGNATURE_SIZE // bands
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+        self._representative = {}
+        # representative -> its duplicates, so removing or moving a document
+        # only touches its own cluster
+        self._members = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def match(self, sig, keys=None):
+        """
+        Find the indexed document most similar to a signature.
+
+        Args:
+            sig (array): The signature to look up
+            keys (list, optional): Its band_keys(), when already computed
+
+        Returns:
+            tuple: (representative index, similarity), or None if no indexed
+            document reaches the threshold
+        """
+        if sig is None:
+            return None
+
+        best = None
+        best_similarity = self.threshold
+        seen = set()
+        for band, key in enumerate(keys or self.band_keys(sig)):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                score = similarity(sig, self._signatures[candidate])
+                if score >= best_similarity:
+                    best, best_similarity = candidate, score
+        if best is None:
+            return None
+        return self.representative(best), best_similarity
+
+    def add(self, doc_index, sig, representative=None, keys=None):
+        """
+        Index a document's signature.
+
+        Args:
+            doc_index (int): Index of the document
+            sig (array): Its signature (None for empty documents)
+            representative (int, optional): Known representative, when the
+                caller already ran match()
+            keys (list, optional): The signature's band_keys()
+
+        Returns:
+            int: The document's representative index
+        """
+        if sig is None:
+            return doc_index
+        keys = keys or self.band_keys(sig)
+        if representative is None:
+            found = self.match(sig, keys)
+            representative = found[0] if found else doc_index
+
+        self._signatures[doc_index] = sig
+        if representative != doc_index:
+            self._representative[doc_index] = representative
+            self._members.setdefault(representative, set()).add(doc_index)
+        for band, key in enumerate(keys):
+            self._buckets[band].setdefault(key, []).append(doc_index)
+        return representative
+
+    def remove(self, doc_index):
+        """Drop a document; its duplicates get the earliest remaining copy as representative."""
+        sig = self._signatures.pop(doc_index, None)
+        if sig is None:
+            return
+        for band, key in enumerate(self.band_keys(sig)):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.remove(doc_index)
+                if not bucket:
+                    del self._buckets[band][key]
+
+        representative = self._representative.pop(doc_index, None)
+        if representative is not None:
+            self._discard_member(representative, doc_index)
+        members = sorted(self._members.pop(doc_index, ()))
+        if members:
+            successor = members[0]
+            del self._representative[successor]
+            for member in members[1:]:
+                self._representative[member] = successor
+            if len(members) > 1:
+                self._members[successor] = set(members[1:])
+
+    def move(self, old_index, new_index):
+        """Renumber a document, e.g. when it fills the slot of a deleted one."""
+        sig = self._signatures.pop(old_index, None)
+        if sig is None:
+            return
+        self._signatures[new_index] = sig
+        for band, key in enumerate(self.band_keys(sig)):
+            bucket = self._buckets[band][key]
+            bucket[bucket.index(old_index)] = new_index
+
+        representative = self._representative.pop(old_index, None)
+        if representative is not None:
+            self._representative[new_index] = representative
+            self._discard_member(representative, old_index)
+            self._members.setdefault(representative, set()).add(new_index)
+        members = self._members.pop(old_index, None)
+        if members:
+            for member in members:
+                self._representative[member] = new_index
+            self._members[new_index] = members
+
+    def _discard_member(self, representative, doc_index):
+        members = self._members.get(representative)
+        if members is not None:
+            members.discard(doc_index)
+            if not members:
+                del self._members[representative]
+
+    def representative(self, doc_index):
+        return self._representative.get(doc_index, doc_index)
+
+    def clusters(self):
+        """Return representative -> duplicate indices for every document that has copies."""
+        clusters = {}
+        for doc_index, representative in self._representative.items():
+            clusters.setdefault(representative, []).append(doc_index)
+        return clusters
+
+    def band_keys(self, sig):
+        """Split a signature into one bucket key per band."""
+        raw = sig.tobytes()
+        width = len(raw) // self.bands
+        return [raw[start:start + width] for start in range(0, len(raw), width)]
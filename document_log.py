@@ -0,0 +1,477 @@
+import os
+import json
+import time
+import zlib
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+LOG_FILENAME = "documents.log"
+SNAPSHOT_FILENAME = "documents.snapshot"
+# Held by every process while it appends, so records never interleave
+LOCK_FILENAME = "documents.log.lock"
+# Held while the log is compacted or replayed, so one process compacts at a time
+COMPACT_LOCK_FILENAME = "documents.snapshot.lock"
+# 0 waits for fsync on every mutation (concurrent writers share one fsync);
+# a positive value fsyncs in the background at most this often instead
+DOCUMENT_LOG_SYNC_MS = float(os.environ.get("DOCUMENT_LOG_SYNC_MS", "0"))
+# Compact the log into the snapshot once it grows past this size
+DOCUMENT_LOG_COMPACT_BYTES = int(os.environ.get("DOCUMENT_LOG_COMPACT_BYTES", str(16 * 1024 * 1024)))
+
+
+def encode_record(record):
+    """Serialize a record as one line: CRC-32 of the payload in hex, a space, the JSON payload."""
+    payload = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return b"%08x %s\n" % (zlib.crc32(payload), payload)
+
+
+def decode_record(line):
+    """Parse a line written by encode_record, or return None if it is damaged."""
+    if len(line) < 10 or line[8:9] != b" " or not line.endswith(b"\n"):
+        return None
+    payload = line[9:-1]
+    try:
+        if int(line[:8], 16) != zlib.crc32(payload):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+class _Segment:
+    """
+    One of the files records are read from.
+
+    A segment opens the file for reading when it is created and keeps the
+    descriptor, so its records stay readable after the file is renamed,
+    replaced or removed; renaming only updates path. The descriptor is
+    closed once no record refers to the segment any more.
+    """
+
+    __slots__ = ("path", "fd", "inode")
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.inode = os.fstat(self.fd).st_ino
+
+    def read(self, offset, length):
+        return os.pread(self.fd, length, offset)
+
+    def __del__(self):
+        fd = getattr(self, "fd", None)
+        if fd is not None:
+            os.close(fd)
+
+
+class LogEntry:
+    """
+    Where the latest record of a document is.
+
+    Compaction moves an entry to the snapshot by replacing its location in
+    one assignment, so a reader holding the entry always finds the record.
+    """
+
+    __slots__ = ("id", "put", "location")
+
+    def __init__(self, doc_id, put, segment, offset, length):
+        self.id = doc_id
+        self.put = put
+        self.location = (segment, offset, length)
+
+    def read(self):
+        """Return the record as a dict, or None if it no longer checks out or belongs to another document."""
+        segment, offset, length = self.location
+        record = decode_record(segment.read(offset, length))
+        if record is None or record.get("id") != self.id:
+            return None
+        return record
+
+
+class DocumentLog:
+    def __init__(self, data_path, sync_ms=DOCUMENT_LOG_SYNC_MS, compact_bytes=DOCUMENT_LOG_COMPACT_BYTES):
+        """
+        Append-only log of document mutations with a compacted snapshot.
+
+        Every add (and later update or delete) appends one checksummed line
+        to documents.log; nothing is rewritten in place. Replaying the
+        snapshot and then the log reproduces the mutations on top of the
+        seed JSON files. A write torn by a crash fails its checksum or lacks
+        its newline, so it is dropped and truncated away on the next start;
+        a half-written document is never loaded.
+
+        Several processes may share the log: each append takes an flock on
+        documents.log.lock and writes at the file's actual end, so records
+        of different processes never overlap and every entry points at its
+        own record. Compaction and replay take a second flock, on
+        documents.snapshot.lock, so one process compacts at a time and none
+        replays a half-compacted directory. A process that finds the log
+        rotated by another one's compaction reopens it before appending.
+        Without fcntl only one process may write the log.
+
+        Writers wait until their record is fsynced, but concurrent writers
+        share one fsync (group commit): whoever finds no fsync running
+        syncs everything written so far, the others wait for it. With
+        sync_ms > 0 writers return immediately and a background thread
+        fsyncs periodically, so a crash can lose the last sync_ms of writes.
+
+        Once the log passes compact_bytes it is folded, together with the
+        old snapshot, into a new documents.snapshot (written to a temporary
+        file, fsynced and renamed over the old one) and restarted empty, so startup only
+        replays the mutations since the last compaction. Records are keyed
+        by document id, so replaying a record twice after a crash
+        mid-compaction is harmless.
+
+        Only the location of each document's latest record is kept in
+        memory, not the record itself; compaction copies the checksummed
+        lines from the old files, so memory does not grow with the size of
+        the documents. put() returns that location as a LogEntry, from
+        which the document can be read back later, including after it has
+        been replaced or compacted.
+
+        Args:
+            data_path (str): Knowledge directory holding the log and snapshot
+            sync_ms (float): Background fsync period; 0 syncs on every commit
+            compact_bytes (int): Log size that triggers compaction
+        """
+        self.data_path = data_path
+        self.sync_ms = sync_ms
+        self.compact_bytes = compact_bytes
+        self.log_path = os.path.join(data_path, LOG_FILENAME)
+        self.snapshot_path = os.path.join(data_path, SNAPSHOT_FILENAME)
+        self.rotated_path = self.log_path + ".old"
+        self.lock_path = os.path.join(data_path, LOCK_FILENAME)
+        self.compact_lock_path = os.path.join(data_path, COMPACT_LOCK_FILENAME)
+
+        # Net effect of the snapshot and log: document id -> LogEntry of its
+        # latest record
+        self._records = {}
+        self._seed_ids = frozenset()
+        self._segment = None
+        self._file = None
+        self._append_lock = None
+        self._compact_lock = None
+        self._size = 0
+        self._written = 0
+        self._synced = 0
+        self._syncing = False
+        self._compacting = False
+        self._lock = threading.Lock()
+        self._synced_cond = threading.Condition(self._lock)
+        self._sync_thread = None
+
+    def replay(self, seed_ids=()):
+        """
+        Read the snapshot and the log, then open the log for appending.
+
+        Args:
+            seed_ids (iterable): Ids of documents loaded from the seed JSON
+                files; deletes of other documents need not be kept
+
+        Returns:
+            iterator: The net records in order, each a dict with "op" ("put"
+            or "delete") and "id", plus the document fields for puts. They
+            are read back from disk one at a time as the iterator advances.
+        """
+        self._seed_ids = frozenset(seed_ids)
+        self._records = {}
+        if self._append_lock is None:
+            self._append_lock = open(self.lock_path, "ab")
+            self._compact_lock = open(self.compact_lock_path, "ab")
+
+        with self._locked(self._compact_lock):
+            for path in (self.snapshot_path, self.rotated_path):
+                if os.path.exists(path):
+                    self._replay_file(_Segment(path))
+            # Other processes may be appending; the torn tail of a crashed one
+            # can only be told apart from a write in progress under their lock
+            with self._locked(self._append_lock):
+                # Every segment needs its file, so the log is created up front
+                self._file = open(self.log_path, "ab")
+                self._segment = _Segment(self.log_path)
+                self._replay_file(self._segment, truncate=True)
+                self._size = os.fstat(self._file.fileno()).st_size
+        if self.sync_ms > 0 and self._sync_thread is None:
+            self._sync_thread = threading.Thread(target=self._sync_loop, name="document-log-sync", daemon=True)
+            self._sync_thread.start()
+        if os.path.exists(self.rotated_path) or self._size >= self.compact_bytes:
+            self.compact()
+        return self._read_records(list(self._records.values()))
+
+    def entry(self, doc_id):
+        """Return the LogEntry of a document's latest record, or None."""
+        return self._records.get(doc_id)
+
+    def put(self, doc_id, document, sync=True):
+        """
+        Record a document's current content.
+
+        Args:
+            doc_id (str): Stable document id
+            document (dict): title, content and category
+            sync (bool): Wait until the record is durable; pass False to
+                batch several writes and call sync() once
+
+        Returns:
+            LogEntry: Where the record is, to read the document back from
+        """
+        return self._append(dict(document, op="put", id=doc_id), sync)
+
+    def delete(self, doc_id, sync=True):
+        """Record that a document was removed."""
+        self._append({"op": "delete", "id": doc_id}, sync)
+
+    def sync(self):
+        """Block until everything appended so far is on disk."""
+        with self._lock:
+            target = self._written
+        self._sync_until(target)
+
+    flush = sync
+
+    def compact(self):
+        """
+        Fold the snapshot and the log into a new snapshot and start a new log.
+
+        The current log is renamed aside under the append lock, so every
+        writer, in this process or another, carries on in a fresh file while
+        the snapshot is written. The snapshot is folded from the files
+        rather than from this process's records, so records other processes
+        appended are kept. The rotated log is removed only once the new
+        snapshot is durable. If another process is compacting, this returns
+        without doing anything.
+        """
+        with self._lock:
+            if self._compacting or self._file is None:
+                return
+            self._compacting = True
+        try:
+            with self._locked(self._compact_lock, blocking=False) as acquired:
+                if acquired:
+                    self._compact()
+        except Exception as e:
+            logger.error("Error compacting document log: %s", e)
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def _compact(self):
+        with self._lock:
+            with self._locked(self._append_lock):
+                if not os.path.exists(self.rotated_path):
+                    # Otherwise a compaction died after rotating and the
+                    # rotated log is still waiting for its snapshot
+                    os.replace(self.log_path, self.rotated_path)
+                self._reopen_if_rotated()
+
+        # Latest record of every document: id -> (segment, offset, length, put).
+        # Segments keep their files open, so the records stay readable while
+        # the snapshot is replaced.
+        latest = {}
+        folded = set()
+        for path in (self.snapshot_path, self.rotated_path):
+            if os.path.exists(path):
+                segment = _Segment(path)
+                folded.add(segment.inode)
+                for record, offset, length in self._scan(segment):
+                    latest.pop(record["id"], None)
+                    latest[record["id"]] = (segment, offset, length, record["op"] == "put")
+
+        moved = {}
+        offset = 0
+        temporary = self.snapshot_path + ".tmp"
+        with open(temporary, "wb") as f:
+            snapshot = _Segment(temporary)
+            for doc_id, (segment, start, length, put) in latest.items():
+                if not put and doc_id not in self._seed_ids:
+                    continue
+                f.write(segment.read(start, length))
+                moved[(segment.inode, start)] = (snapshot, offset, length)
+                offset += length
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.snapshot_path)
+        snapshot.path = self.snapshot_path
+        self._sync_directory()
+
+        with self._lock:
+            # Move the entries to their copy in the snapshot; entries replaced
+            # since keep their location in the new log
+            for doc_id, entry in list(self._records.items()):
+                segment, start, _ = entry.location
+                location = moved.get((segment.inode, start))
+                if location is not None:
+                    entry.location = location
+                elif segment.inode in folded and not entry.put:
+                    del self._records[doc_id]
+        os.remove(self.rotated_path)
+        logger.info("Compacted document log into a snapshot of %s records", len(moved))
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+            self._append_lock.close()
+            self._compact_lock.close()
+            self._append_lock = None
+            self._compact_lock = None
+
+    def _append(self, record, sync):
+        line = encode_record(record)
+        with self._lock:
+            if self._file is None:
+                raise RuntimeError("Document log is not open")
+            with self._locked(self._append_lock):
+                self._reopen_if_rotated()
+                # Other processes append to the same file, so only its end is
+                # where this record lands
+                offset = os.fstat(self._file.fileno()).st_size
+                self._file.write(line)
+                # Hand the line to the OS now so only a machine crash can lose it before fsync
+                self._file.flush()
+            entry = self._apply(record["id"], record["op"] == "put", self._segment, offset, len(line))
+            self._written += 1
+            self._size = offset + len(line)
+            target = self._written
+            compact = self._size >= self.compact_bytes and not self._compacting
+
+        if sync and self.sync_ms <= 0:
+            self._sync_until(target)
+        if compact:
+            threading.Thread(target=self.compact, name="document-log-compact", daemon=True).start()
+        return entry
+
+    @staticmethod
+    @contextmanager
+    def _locked(lock_file, blocking=True):
+        # Yields whether the flock was taken, which only fails without blocking
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reopen_if_rotated(self):
+        # Called with both locks held: a compaction, here or in another
+        # process, renamed the log this process has open
+        try:
+            if os.stat(self.log_path).st_ino == self._segment.inode:
+                return
+        except FileNotFoundError:
+            pass
+        while self._syncing:
+            self._synced_cond.wait()
+        # Everything written to the old file is made durable before it is left
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._synced = self._written
+        self._synced_cond.notify_all()
+        self._file.close()
+        self._segment.path = self.rotated_path
+        self._file = open(self.log_path, "ab")
+        self._segment = _Segment(self.log_path)
+
+    def _sync_until(self, target):
+        with self._lock:
+            while self._synced < target:
+                if self._syncing:
+                    # Someone else's fsync is running; it or the next one covers this record
+                    self._synced_cond.wait()
+                    continue
+                self._syncing = True
+                covered = self._written
+                file = self._file
+                self._lock.release()
+                try:
+                    file.flush()
+                    os.fsync(file.fileno())
+                finally:
+                    self._lock.acquire()
+                    self._syncing = False
+                    self._synced_cond.notify_all()
+                self._synced = max(self._synced, covered)
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_ms / 1000)
+            try:
+                if self._file is not None:
+                    self.sync()
+            except Exception as e:
+                logger.error("Error syncing document log: %s", e)
+
+    def _apply(self, doc_id, put, segment, offset, length):
+        # Re-inserted so the records stay in the order of their latest change
+        self._records.pop(doc_id, None)
+        entry = self._records[doc_id] = LogEntry(doc_id, put, segment, offset, length)
+        return entry
+
+    def _read_records(self, entries):
+        for entry in entries:
+            record = entry.read()
+            if record is None:
+                segment, offset, _ = entry.location
+                logger.error("Record at offset %s of %s changed since it was replayed", offset, segment.path)
+                continue
+            yield record
+
+    def _replay_file(self, segment, truncate=False):
+        count = 0
+        for record, offset, length in self._scan(segment, truncate):
+            self._apply(record["id"], record["op"] == "put", segment, offset, length)
+            count += 1
+        logger.info("Replayed %s records from %s", count, os.path.basename(segment.path))
+        return count
+
+    @staticmethod
+    def _scan(segment, truncate=False):
+        # Yield (record, offset, length) of every intact record
+        path = segment.path
+        offset = 0
+        with open(path, "rb") as f:
+            for line in f:
+                record = decode_record(line)
+                if record is None:
+                    if not line.endswith(b"\n"):
+                        # Torn final write: drop it so new records start on a clean line
+                        logger.warning("Dropping incomplete record at the end of %s", path)
+                        break
+                    logger.error("Skipping damaged record at offset %s of %s", offset, path)
+                else:
+                    yield record, offset, len(line)
+                offset += len(line)
+            size = f.seek(0, os.SEEK_END)
+        if truncate and offset < size:
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+    def _sync_directory(self):
+        # Make the rename itself durable; not supported on every platform
+        try:
+            fd = os.open(self.data_path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
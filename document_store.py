@@ -0,0 +1,175 @@
+"""
+Shared, versioned data file of the seed corpus.
+
+The contents of the knowledge directory's JSON files are written once into
+documents.<version>.dat, where the version is a fingerprint of those files.
+Every worker maps the same file read-only, so the corpus is stored once on
+disk and once in the page cache however many workers there are. Build it
+as part of a deploy, so no worker pays for it at startup:
+
+    python -m document_store knowledge/medical_conditions
+"""
+import os
+import json
+import mmap
+import struct
+import hashlib
+import logging
+import argparse
+import tempfile
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STORE_FILENAME = "documents.{version}.dat"
+LOCK_FILENAME = "documents.dat.lock"
+STORE_MAGIC = b"KBSTORE1"
+# Offset of the index, then the magic, at the end of the file
+_TRAILER = struct.Struct("<Q8s")
+
+
+def seed_files(directory):
+    """Return the names of the seed JSON files, sorted."""
+    return sorted(name for name in os.listdir(directory) if name.endswith(".json"))
+
+
+def seed_version(directory):
+    """Fingerprint the seed files by name, size and modification time."""
+    digest = hashlib.blake2b(digest_size=8)
+    for name in seed_files(directory):
+        stat = os.stat(os.path.join(directory, name))
+        digest.update(f"{name}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_store(directory, version=None):
+    """
+    Write the data file for the current seed files, unless it exists already.
+
+    Concurrent builders take a lock file, so the file is built once; it is
+    written under a temporary name, fsynced and renamed into place, so a
+    reader never sees a partial file. Data files of older versions are
+    removed; workers still mapping them keep their mapping.
+
+    The file holds the UTF-8 contents back to back, then a JSON index of
+    [id, title, category, offset, length] per document, then the index
+    offset and STORE_MAGIC.
+
+    Returns:
+        str: Path of the data file
+    """
+    version = version or seed_version(directory)
+    path = os.path.join(directory, STORE_FILENAME.format(version=version))
+    if os.path.exists(path):
+        return path
+
+    with open(os.path.join(directory, LOCK_FILENAME), "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(path):
+            return path
+
+        fd, temporary = tempfile.mkstemp(prefix=".documents.", suffix=".tmp", dir=directory)
+        try:
+            os.fchmod(fd, 0o644)
+            index = []
+            offset = 0
+            with os.fdopen(fd, "wb") as f:
+                for name in seed_files(directory):
+                    with open(os.path.join(directory, name), "r") as source:
+                        doc = json.load(source)
+                    if "content" not in doc or "title" not in doc:
+                        continue
+                    data = doc["content"].encode("utf-8")
+                    f.write(data)
+                    index.append([name[:-len(".json")], doc["title"], doc.get("category"), offset, len(data)])
+                    offset += len(data)
+                f.write(json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+                f.write(_TRAILER.pack(offset, STORE_MAGIC))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+
+        for name in os.listdir(directory):
+            if name.startswith("documents.") and name.endswith(".dat") and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+    logger.info("Built document data file %s with %s documents", os.path.basename(path), len(index))
+    return path
+
+
+class DocumentStore:
+    def __init__(self, directory, build=True):
+        """
+        Read-only view of the seed corpus in its shared data file.
+
+        Contents are addressed by (offset, length), so the knowledge base
+        keeps only those two numbers per document and the text is paged in
+        from the file when a document is read. Pages of the mapping belong
+        to the OS page cache: they are shared with the other workers,
+        evicted under memory pressure and do not grow the heap.
+
+        Documents added or edited later live in the document log, not here.
+
+        Args:
+            directory (str): Knowledge directory with the seed files
+            build (bool): Build the data file if the current version is
+                missing; otherwise a missing file raises FileNotFoundError
+        """
+        version = seed_version(directory)
+        self.path = os.path.join(directory, STORE_FILENAME.format(version=version))
+        if build:
+            build_store(directory, version)
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        index_offset, magic = _TRAILER.unpack(self._map[-_TRAILER.size:])
+        if magic != STORE_MAGIC:
+            self._map.close()
+            raise ValueError(f"{self.path} is not a document data file")
+        self._index_offset = index_offset
+
+    def documents(self):
+        """
+        Return the documents in the file.
+
+        Returns:
+            list: [id, title, category, offset, length] per document
+        """
+        return json.loads(self._map[self._index_offset:-_TRAILER.size])
+
+    def read(self, offset, length):
+        """Return the text stored at offset."""
+        return self._map[offset:offset + length].decode("utf-8")
+
+    def close(self):
+        # Readers may still hold documents; they fail instead of reading freed memory
+        self._map.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the shared document data file of knowledge directories")
+    parser.add_argument("directories", nargs="*",
+                        default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge",
+                                              "medical_conditions")],
+                        help="Knowledge directories (default: ./knowledge/medical_conditions)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    for directory in args.directories:
+        print(build_store(directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import sys
+from text_processing import unique_terms
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class BaseDocument:
+    """
+    Fields and dict-style access shared by in-memory and stored documents.
+
+    Subclasses provide `content` and `terms`, the distinct index terms of
+    the content; only the fields every document keeps in memory are slots
+    here. Item access (`doc['title']`) is supported so code written against
+    the original dict documents keeps working.
+    """
+
+    __slots__ = ("id", "title", "category", "title_terms")
+
+    FIELDS = ("title", "content", "category")
+
+    def to_dict(self):
+        return {"id": self.id, "title": self.title, "content": self.content, "category": self.category}
+
+    def release(self):
+        """Drop data that can be recomputed once the document is indexed; nothing for in-memory documents."""
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def __repr__(self):
+        return f"{type(self).__name__}(title={self.title!r}, category={self.category!r})"
+
+
+class Document(BaseDocument):
+    """
+    A knowledge base document with its search fields normalized once at load.
+
+    `title_terms` and `terms` are the distinct index terms of the title and
+    content (see text_processing.normalize), interned so documents share one
+    copy of each term.
+    Documents use __slots__ and interned category strings to keep the
+    per-document footprint small.
+    """
+
+    __slots__ = ("content", "terms")
+
+    def __init__(self, title, content, category=None, doc_id=None):
+        """
+        Args:
+            title (str): Title of the document
+            content (str): Text content of the document
+            category (str, optional): Category for organizing documents
+            doc_id (str, optional): Stable id, assigned by the knowledge base
+        """
+        self.id = doc_id
+        self.title = title
+        self.content = content
+        self.category = _intern(category)
+        self.title_terms = unique_terms(title)
+        self.terms = unique_terms(content)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["title"], data["content"], data.get("category"), data.get("id"))
+
+
+class StoredDocument(BaseDocument):
+    """
+    A Document whose content lives in a DocumentStore.
+
+    Only the id, title, category, title terms and the content's location
+    stay in memory. `content` is read from the store on access, and `terms`
+    is derived from it when the index needs it and dropped again by
+    release(), so a document costs the same memory however long it is.
+    """
+
+    __slots__ = ("_store", "_offset", "_length", "_terms")
+
+    def __init__(self, store, offset, length, title, category=None, doc_id=None):
+        """
+        Args:
+            store (DocumentStore): Store holding the content
+            offset (int): Where the content starts in the store
+            length (int): Length of the content's UTF-8 encoding
+            title (str): Title of the document
+            category (str, optional): Category for organizing documents
+            doc_id (str, optional): Stable id, assigned by the knowledge base
+        """
+        self.id = doc_id
+        self.title = title
+        self.category = _intern(category)
+        self.title_terms = unique_terms(title)
+        self._store = store
+        self._offset = offset
+        self._length = length
+        self._terms = None
+
+    @property
+    def content(self):
+        return self._store.read(self._offset, self._length)
+
+    @property
+    def terms(self):
+        if self._terms is None:
+            self._terms = unique_terms(self.content)
+        return self._terms
+
+    def release(self):
+        self._terms = None
+
+
+class LoggedDocument(BaseDocument):
+    """
+    A Document whose content lives in its record in the document log.
+
+    Used for documents added or edited after the data file was built; like
+    StoredDocument it keeps only the title fields in memory and reads the
+    content back from the log entry on access.
+    """
+
+    __slots__ = ("_entry", "_terms")
+
+    def __init__(self, entry, title, category=None, doc_id=None, terms=None):
+        """
+        Args:
+            entry (LogEntry): The document's record in the document log
+            title (str): Title of the document
+            category (str, optional): Category for organizing documents
+            doc_id (str, optional): Stable id, assigned by the knowledge base
+            terms (tuple, optional): Content terms already computed, kept
+                until the document is indexed
+        """
+        self.id = doc_id
+        self.title = title
+        self.category = _intern(category)
+        self.title_terms = unique_terms(title)
+        self._entry = entry
+        self._terms = terms
+
+    @property
+    def content(self):
+        record = self._entry.read()
+        if record is None:
+            raise ValueError(f"Document log record of {self.id} is damaged or not its own")
+        return record["content"]
+
+    @property
+    def terms(self):
+        if self._terms is None:
+            self._terms = unique_terms(self.content)
+        return self._terms
+
+    def release(self):
+        self._terms = None
+
+
+class SearchResult:
+    """
+    A read-only view of a Document carrying its search score.
+
+    Results reference the underlying document instead of copying it. Item
+    access mirrors the document and adds `similarity` for the score.
+    """
+
+    __slots__ = ("document", "score")
+
+    def __init__(self, document, score):
+        self.document = document
+        self.score = score
+
+    def __getitem__(self, key):
+        if key == "similarity":
+            return self.score
+        return self.document[key]
+
+    def get(self, key, default=None):
+        if key == "similarity":
+            return self.score
+        return self.document.get(key, default)
+
+    def __getattr__(self, name):
+        if name in SearchResult.__slots__:
+            raise AttributeError(name)
+        return getattr(self.document, name)
+
+    def to_dict(self):
+        data = self.document.to_dict()
+        data["similarity"] = self.score
+        return data
+
+    def __repr__(self):
+        return f"SearchResult(title={self.document.title!r}, score={self.score!r})"
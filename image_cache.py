@@ -0,0 +1,235 @@
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+from image_previews import Image, load_image
+
+logger = logging.getLogger(__name__)
+
+# "exact" answers only byte-identical uploads; "similar" also answers resized or
+# recompressed copies whose pixels are confirmed to be the same
+IMAGE_CACHE_MATCH = os.environ.get("IMAGE_CACHE_MATCH", "exact")
+# Analyses kept, least recently used evicted first; 0 disables the cache
+IMAGE_CACHE_SIZE = int(os.environ.get("IMAGE_CACHE_SIZE", "1000"))
+# "similar" only: most differing bits (of 64) between two images' dHashes for
+# them to be compared pixel by pixel
+IMAGE_CACHE_MAX_DISTANCE = int(os.environ.get("IMAGE_CACHE_MAX_DISTANCE", "5"))
+# "similar" only: mean squared error and largest difference of any pixel (0-255)
+# between the 64x64 grayscale copies of matching images
+IMAGE_CACHE_MAX_MSE = float(os.environ.get("IMAGE_CACHE_MAX_MSE", "5"))
+IMAGE_CACHE_MAX_PIXEL_DIFF = int(os.environ.get("IMAGE_CACHE_MAX_PIXEL_DIFF", "24"))
+
+HASH_SIZE = 8
+# Edge of the grayscale copy compared pixel by pixel
+PIXEL_EDGE = 64
+# Matching images must also have nearly the same shape, so crops of an image never match it
+MAX_ASPECT_DIFFERENCE = 0.03
+# Decode size for hashing; JPEGs are decoded at a reduced scale close to this
+_HASH_DECODE_EDGE = 256
+
+ImageFingerprint = namedtuple("ImageFingerprint", ["digest", "dhash", "aspect", "pixels"])
+
+
+def image_hash(path, perceptual=True):
+    """
+    Fingerprint an image file for the analysis cache.
+
+    The digest is a hash of the file's bytes. With perceptual=True the
+    image is also decoded for a difference hash (dHash) and a 64x64
+    grayscale copy. For the dHash the image is reduced to 9x8 grayscale
+    pixels, and each bit records whether a pixel is brighter than its right
+    neighbour. Resizing and recompression change few bits, and a different
+    image changes about half of them. The dHash only finds candidates: 64
+    bits cannot see a small change such as a lesion painted in, so the
+    grayscale copies are compared before a match is accepted.
+
+    Returns:
+        ImageFingerprint: Perceptual fields are None unless requested;
+        None for an unreadable file, or without Pillow when perceptual
+    """
+    try:
+        digest = hashlib.blake2b()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                digest.update(chunk)
+        digest = digest.digest()
+    except OSError as e:
+        logger.warning("Could not hash %s: %s", os.path.basename(path), e)
+        return None
+    if not perceptual:
+        return ImageFingerprint(digest, None, None, None)
+
+    if Image is None:
+        return None
+    try:
+        image = load_image(path, _HASH_DECODE_EDGE)
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning("Could not hash %s: %s", os.path.basename(path), e)
+        return None
+
+    aspect = image.width / image.height
+    gray = image.convert("L")
+    pixels = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(0, len(pixels), HASH_SIZE + 1):
+        for left, right in zip(pixels[row:row + HASH_SIZE], pixels[row + 1:row + HASH_SIZE + 1]):
+            value = (value << 1) | (left > right)
+    return ImageFingerprint(digest, value, aspect, gray.resize((PIXEL_EDGE, PIXEL_EDGE), Image.BOX).tobytes())
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def pixel_difference(a, b):
+    """Return (mean squared error, largest absolute difference) of two equally sized grayscale copies."""
+    total = 0
+    worst = 0
+    for x, y in zip(a, b):
+        difference = abs(x - y)
+        total += difference * difference
+        if difference > worst:
+            worst = difference
+    return total / len(a), worst
+
+
+def question_key(question):
+    """Case, whitespace and trailing punctuation do not make a different question."""
+    return " ".join((question or "").lower().split()).rstrip("?.! ")
+
+
+class ImageAnalysisCache:
+    def __init__(self, match=IMAGE_CACHE_MATCH, capacity=IMAGE_CACHE_SIZE, max_distance=IMAGE_CACHE_MAX_DISTANCE,
+                 max_mse=IMAGE_CACHE_MAX_MSE, max_pixel_diff=IMAGE_CACHE_MAX_PIXEL_DIFF):
+        """
+        Answers to image questions, found again for the same images.
+
+        Entries are keyed by the client, the question and the fingerprints
+        of the images, in order, so one client never receives an answer
+        produced for another client's upload. With match="exact" a stored
+        answer is returned only for byte-identical files, found by digest.
+
+        With match="similar" the same radiograph uploaded again resized or
+        recompressed also matches. Every image must have the same shape
+        and a dHash within max_distance bits, and its 64x64 grayscale copy
+        must be within max_mse and max_pixel_diff of the stored one. The
+        mean error bounds overall changes such as contrast. The per-pixel
+        bound catches small local ones, such as a marking, that barely move
+        the mean. Changes smaller than a pixel of the 64x64 copy can still
+        go unseen, which is why "exact" is the default.
+
+        The conversation context is not part of the key: the answer is about
+        the image. Only successful model answers should be stored.
+
+        Args:
+            match (str): "exact" or "similar"
+            capacity (int): Entries kept; 0 disables the cache
+            max_distance (int): Largest Hamming distance between candidate hashes
+            max_mse (float): Largest mean squared error of the grayscale copies
+            max_pixel_diff (int): Largest difference of any grayscale pixel
+        """
+        if match not in ("exact", "similar"):
+            raise ValueError(f'Image cache match must be "exact" or "similar", not {match!r}')
+        self.match = match
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.max_mse = max_mse
+        self.max_pixel_diff = max_pixel_diff
+        # (client, question) -> {digests: (fingerprints, answer)}
+        self._by_question = {}
+        self._order = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self):
+        return self.capacity > 0 and (self.match == "exact" or Image is not None)
+
+    def fingerprint(self, path):
+        """Fingerprint an image for get() and put(), decoding it only when similar images can match."""
+        return image_hash(path, perceptual=self.match == "similar")
+
+    def get(self, fingerprints, question, client=None):
+        """
+        Find a stored answer for the same images, question and client.
+
+        Args:
+            fingerprints (list): fingerprint() of each image; None entries never match
+            question (str): The question asked
+            client (str, optional): Who asked; answers are not shared across clients
+
+        Returns:
+            str: The stored answer, or None
+        """
+        if not self.enabled or not fingerprints or None in fingerprints:
+            return None
+        key = (client, question_key(question))
+        digests = tuple(fingerprint.digest for fingerprint in fingerprints)
+        with self._lock:
+            entries = self._by_question.get(key, {})
+            best, best_error = (digests, 0.0) if digests in entries else (None, None)
+            if best is None and self.match == "similar":
+                for stored_digests, (stored, _) in entries.items():
+                    error = self._difference(fingerprints, stored)
+                    if error is not None and (best_error is None or error < best_error):
+                        best, best_error = stored_digests, error
+            if best is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._order.move_to_end((key, best))
+            answer = entries[best][1]
+        logger.info("Image analysis cache hit with pixel error %.2f", best_error)
+        return answer
+
+    def put(self, fingerprints, question, answer, client=None):
+        """Store the answer to a client's question about images with these fingerprints."""
+        if not self.enabled or not fingerprints or None in fingerprints:
+            return
+        key = (client, question_key(question))
+        digests = tuple(fingerprint.digest for fingerprint in fingerprints)
+        with self._lock:
+            self._by_question.setdefault(key, {})[digests] = (tuple(fingerprints), answer)
+            self._order[(key, digests)] = None
+            self._order.move_to_end((key, digests))
+            while len(self._order) > self.capacity:
+                (old_key, old_digests), _ = self._order.popitem(last=False)
+                entries = self._by_question[old_key]
+                del entries[old_digests]
+                if not entries:
+                    del self._by_question[old_key]
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "match": self.match,
+                "entries": len(self._order),
+                "capacity": self.capacity,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 3) if lookups else None,
+            }
+
+    def _difference(self, fingerprints, stored):
+        # Largest per-image mean squared error, or None if any image does not match
+        if len(fingerprints) != len(stored):
+            return None
+        worst = 0.0
+        for image, stored_image in zip(fingerprints, stored):
+            if abs(image.aspect - stored_image.aspect) > MAX_ASPECT_DIFFERENCE * stored_image.aspect:
+                return None
+            if hamming(image.dhash, stored_image.dhash) > self.max_distance:
+                return None
+            mse, largest = pixel_difference(image.pixels, stored_image.pixels)
+            if mse > self.max_mse or largest > self.max_pixel_diff:
+                return None
+            worst = max(worst, mse)
+        return worst
+
+
+analysis_cache = ImageAnalysisCache()
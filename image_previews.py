@@ -0,0 +1,247 @@
+import os
+import io
+import base64
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from profiler import stage
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = ImageOps = None
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_DIRNAME = "previews"
+# Longest edge in pixels of each preview; the chat view shows "thumb" inline
+# (at most 300 CSS pixels high) and "medium" in the lightbox
+PREVIEW_SIZES = {"thumb": 480, "medium": 1280}
+PREVIEW_WORKERS = int(os.environ.get("PREVIEW_WORKERS", "2"))
+PREVIEW_JPEG_QUALITY = int(os.environ.get("PREVIEW_JPEG_QUALITY", "80"))
+# How long a request waits for a preview that is still being generated
+PREVIEW_WAIT_SECONDS = float(os.environ.get("PREVIEW_WAIT_SECONDS", "10"))
+
+# Longest edge of images sent to the vision model, which downscales larger ones itself
+MODEL_IMAGE_MAX_EDGE = int(os.environ.get("MODEL_IMAGE_MAX_EDGE", "2048"))
+MODEL_IMAGE_JPEG_QUALITY = int(os.environ.get("MODEL_IMAGE_JPEG_QUALITY", "90"))
+
+# Upload names are unique, so a preview never changes once written
+PREVIEW_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+
+class PreviewGenerator:
+    def __init__(self, upload_folder, sizes=None, workers=PREVIEW_WORKERS, quality=PREVIEW_JPEG_QUALITY):
+        """
+        Downscaled JPEG previews of uploaded images, generated off the request path.
+
+        submit() queues an upload on a small thread pool right after it is
+        saved; Pillow releases the GIL while decoding and resampling, so the
+        workers run in parallel with request threads. Each upload is decoded
+        once: JPEGs are decoded directly at a reduced scale (draft mode), the
+        largest preview is resampled from that and every smaller one from the
+        preview above it. Previews are written next to the uploads and
+        survive restarts; a preview requested before it exists is generated
+        on demand.
+
+        Args:
+            upload_folder (str): Folder holding the original uploads
+            sizes (dict, optional): Preview name -> longest edge in pixels
+            workers (int): Background threads
+            quality (int): JPEG quality of the previews
+        """
+        self.upload_folder = upload_folder
+        self.preview_folder = os.path.join(upload_folder, PREVIEW_DIRNAME)
+        self.sizes = dict(sizes or PREVIEW_SIZES)
+        self.quality = quality
+        self.workers = workers
+
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.preview_folder, exist_ok=True)
+
+    @property
+    def available(self):
+        return Image is not None
+
+    def submit(self, filename):
+        """
+        Queue the previews of an upload for generation.
+
+        Returns:
+            Future: Resolves to True when the previews were written, or None
+            when Pillow is not installed
+        """
+        if not self.available:
+            return None
+        with self._lock:
+            future = self._pending.get(filename)
+            if future is None:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image-preview")
+                future = self._pending[filename] = self._executor.submit(self._run, filename)
+        return future
+
+    def path_for(self, filename, size, timeout=PREVIEW_WAIT_SECONDS):
+        """
+        Return the path of a preview, waiting for it if it is being generated.
+
+        Args:
+            filename (str): Upload file name
+            size (str): A key of sizes
+            timeout (float): Longest wait for a pending preview
+
+        Returns:
+            str: Path of the preview, or None if it cannot be produced
+        """
+        if size not in self.sizes:
+            return None
+        path = self.preview_path(filename, size)
+        if os.path.exists(path):
+            return path
+        if not os.path.exists(os.path.join(self.upload_folder, filename)):
+            return None
+
+        future = self.submit(filename)
+        if future is None:
+            return None
+        with stage("preview_wait"):
+            try:
+                future.result(timeout=timeout)
+            except Exception as e:
+                logger.warning("Preview of %s not available: %s", filename, e)
+                return None
+        return path if os.path.exists(path) else None
+
+    def preview_path(self, filename, size):
+        return os.path.join(self.preview_folder, f"{filename}.{size}.jpg")
+
+    def generate(self, filename):
+        """Write every preview of an upload; return False if it is not a readable image."""
+        source = os.path.join(self.upload_folder, filename)
+        try:
+            image = load_image(source, max(self.sizes.values()))
+            for size, edge in sorted(self.sizes.items(), key=lambda item: -item[1]):
+                if max(image.size) > edge:
+                    image = _shrink(image, edge)
+                self._save(image, self.preview_path(filename, size))
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning("Could not generate previews of %s: %s", filename, e)
+            return False
+        return True
+
+    def init_app(self, app):
+        """Register the preview route, /uploads/<filename>/preview/<size>."""
+        from flask import abort, send_file
+        from werkzeug.utils import secure_filename
+
+        def image_preview(filename, size):
+            if secure_filename(filename) != filename:
+                abort(404)
+            path = self.path_for(filename, size)
+            if path is None:
+                abort(404)
+            # send_file answers If-None-Match with 304 and Range with 206
+            response = send_file(path, mimetype="image/jpeg", conditional=True, max_age=31536000)
+            response.headers["Cache-Control"] = PREVIEW_CACHE_CONTROL
+            return response
+
+        app.add_url_rule("/uploads/<filename>/preview/<size>", "image_preview", image_preview)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _run(self, filename):
+        try:
+            return self.generate(filename)
+        finally:
+            with self._lock:
+                self._pending.pop(filename, None)
+
+    def _save(self, image, path):
+        # Write then rename so a concurrent request never serves a partial file;
+        # the temporary name is unique across threads and worker processes
+        directory, name = os.path.split(path)
+        fd, temporary = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        try:
+            # mkstemp creates the file private to this user; previews are served as static files
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, "JPEG", quality=self.quality, optimize=True, progressive=True)
+            os.replace(temporary, path)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+
+
+def load_image(path, max_edge):
+    """
+    Decode an image upright as RGB or grayscale, at no more than max_edge pixels.
+
+    JPEGs are decoded at a reduced scale when that still covers max_edge,
+    which skips most of the decoding work for large photos.
+    """
+    with Image.open(path) as image:
+        image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "L"):
+            image = _flatten(image)
+        # Decode before the file is closed
+        image.load()
+    if max(image.size) > max_edge:
+        image = _shrink(image, max_edge)
+    return image
+
+
+def encode_for_model(path, max_edge=MODEL_IMAGE_MAX_EDGE, quality=MODEL_IMAGE_JPEG_QUALITY):
+    """
+    Prepare an upload for the vision model as a base64 JPEG no larger than max_edge.
+
+    The model downscales larger images anyway, so sending them smaller only
+    saves upload time and request size. Without Pillow, or for a file Pillow
+    cannot read, the file is sent as it is.
+
+    Returns:
+        str: Base64-encoded image data
+    """
+    if Image is not None:
+        try:
+            image = load_image(path, max_edge)
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality)
+            return base64.b64encode(buffer.getvalue()).decode("ascii")
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logger.warning("Sending %s unprocessed: %s", os.path.basename(path), e)
+    with open(path, "rb") as f:
+        return base64.b64encode(f.read()).decode("ascii")
+
+
+def _shrink(image, edge):
+    scale = edge / max(image.size)
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    # reducing_gap resamples from a cheap integer reduction first, which is much faster on large images
+    return image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+
+def _flatten(image):
+    # JPEG has no alpha channel: composite transparent images onto white
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode in ("I", "I;16", "I;16B", "F"):
+        # 16-bit and float scans (e.g. X-rays): stretch the used range over 8 bits instead of clipping it
+        low, high = image.getextrema()
+        scale = 255 / (high - low) if high > low else 1
+        return image.convert("F").point(lambda value: (value - low) * scale).convert("L")
+    return image.convert("L" if image.mode == "1" else "RGB")
@@ -1,23 +1,117 @@
 import os
+import time
 import logging
-from azure.ai.inference import ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage, AssistantMessage
-from azure.core.credentials import AzureKeyCredential
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 
-load_dotenv()
+from admission import AdmissionRejected
+from azure_clients import get_settings
+from image_cache import analysis_cache
+from image_previews import encode_for_model
+from profiler import annotate, bind_record, stage
+from upstream import complete
+from routing import router
 
 logger = logging.getLogger(__name__)
 
-token = os.environ.get("AZURE_API_KEY", "you_key_here")
-endpoint = os.environ.get("AZURE_ENDPOINT", "https://models.inference.ai.azure.com")
-model_name = os.environ.get("AZURE_MODEL_NAME", "gpt-4o")
-client = ChatCompletionsClient(
-    endpoint=endpoint,
-    credential=AzureKeyCredential(token),
-)
+# Most images in one /analyze-images request
+MAX_IMAGES_PER_REQUEST = int(os.environ.get("MAX_IMAGES_PER_REQUEST", "8"))
+# Threads decoding, resizing and encoding the images of one request
+IMAGE_PREPROCESS_WORKERS = int(os.environ.get("IMAGE_PREPROCESS_WORKERS", "4"))
+# Answer length for one image; a series gets more, up to three times this
+IMAGE_MAX_TOKENS = 300
 
-def get_ai_response_for_image(base64_image, question="Please analyze this medical image.", context=None):
+
+def encode_images(paths, max_workers=IMAGE_PREPROCESS_WORKERS):
+    """
+    Prepare several uploads for the vision model in parallel.
+
+    Pillow releases the GIL while decoding, resampling and encoding, so the
+    images are processed concurrently on a small thread pool.
+
+    Args:
+        paths (list): Paths of the uploaded images
+        max_workers (int): Most images processed at once
+
+    Returns:
+        list: Base64-encoded images, in the order of paths
+    """
+    if len(paths) == 1:
+        return [encode_for_model(paths[0])]
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(paths))),
+                            thread_name_prefix="image-encode") as executor:
+        return list(executor.map(encode_for_model, paths))
+
+
+def cached_analysis(paths, question, client=None):
+    """
+    Look up an earlier answer from the same client to the same question about the same images.
+
+    Args:
+        paths (list): Paths of the uploaded images, in order
+        question (str): The question asked
+        client (str, optional): Who asked, see admission.client_id
+
+    Returns:
+        tuple: (image fingerprints to store a new answer under, cached answer or None)
+    """
+    if not analysis_cache.enabled:
+        return None, None
+    with stage("image_hash"):
+        hashes = [analysis_cache.fingerprint(path) for path in paths]
+    answer = analysis_cache.get(hashes, question, client)
+    annotate(image_cache_hit=answer is not None)
+    return hashes, answer
+
+
+def analyze_each(paths, question, context=None, admission=None, max_concurrency=IMAGE_PREPROCESS_WORKERS,
+                 client=None):
+    """
+    Analyze several images with one concurrent model call per image.
+
+    Each image is looked up in the analysis cache, then encoded and sent on
+    its own worker thread.
+
+    Args:
+        paths (list): Paths of the uploaded images
+        question (str): The instruction for analysis, asked of every image
+        context (str, optional): Previous conversation context
+        admission (AdmissionController, optional): Each call waits for an
+            upstream slot in the image lane
+        max_concurrency (int): Most calls in flight at once
+        client (str, optional): Who asked; scopes the analysis cache
+
+    Returns:
+        list: {"index", "response"} or {"index", "error"} per image, in order
+    """
+    def answer(index, path):
+        start = time.perf_counter()
+        try:
+            hashes, cached = cached_analysis([path], question, client)
+            if cached is not None:
+                result = {"index": index, "response": cached, "cached": True}
+            else:
+                base64_image = encode_for_model(path)
+                if admission is not None:
+                    with admission.slot("image"):
+                        response = get_ai_response_for_images([base64_image], question, context, hashes, client)
+                else:
+                    response = get_ai_response_for_images([base64_image], question, context, hashes, client)
+                result = {"index": index, "response": response}
+        except AdmissionRejected as e:
+            result = {"index": index, "error": e.message, "retry_after": e.retry_after_header()}
+        except Exception as e:
+            logger.error("Error analyzing image %s: %s", index, e)
+            result = {"index": index, "error": "Failed to analyze this image"}
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+        return result
+
+    workers = max(1, min(max_concurrency, len(paths)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-analysis") as executor:
+        return list(executor.map(bind_record(answer), range(len(paths)), paths))
+
+
+def get_ai_response_for_image(base64_image, question="Please analyze this medical image.", context=None,
+                              image_hashes=None, client=None):
     """
     Get a response from Azure AI about an image.
 
@@ -25,24 +119,55 @@ def get_ai_response_for_image(base64_image, question="Please analyze this medica
         base64_image (str): The base64-encoded image data.
         question (str): The instruction for analysis (default provided).
         context (str, optional): Previous conversation context.
+        image_hashes (list, optional): Cache fingerprint of the image; a
+            successful answer is cached under it.
+        client (str, optional): Who asked; the cached answer is theirs only.
+
+    Returns:
+        str: The AI's response.
+    """
+    return get_ai_response_for_images([base64_image], question, context, image_hashes, client)
+
+
+def get_ai_response_for_images(base64_images, question="Please analyze these medical images.", context=None,
+                               image_hashes=None, client=None):
+    """
+    Get one response from Azure AI about a series of images sent in a single message.
+
+    The model sees all images together, so it can compare views or slices
+    of the same study.
+
+    Args:
+        base64_images (list): The base64-encoded images, in display order.
+        question (str): The instruction for analysis.
+        context (str, optional): Previous conversation context.
+        image_hashes (list, optional): Cache fingerprints of the images; a
+            successful answer is cached under them.
+        client (str, optional): Who asked; the cached answer is theirs only.
 
     Returns:
         str: The AI's response.
     """
     try:
+        from azure.ai.inference.models import SystemMessage, UserMessage, AssistantMessage
+
+        model_name = get_settings()["chat_model_name"]
+
         vision_prompt = {
             "role": "user",
             "content": [
                 {
                     "type": "text",
                     "text": question
-                },
+                }
+            ] + [
                 {
                     "type": "image_url",
                     "image_url": {
                         "url": f"data:image/jpeg;base64,{base64_image}"
                     }
                 }
+                for base64_image in base64_images
             ]
         }
 
@@ -61,23 +186,30 @@ def get_ai_response_for_image(base64_image, question="Please analyze this medica
 
         messages.append(UserMessage(vision_prompt))
 
-        logger.info("Sending image analysis request to Azure AI")
-        logger.info(f"Using model: {model_name}")
-
-        response = client.complete(
-            messages=messages,
-            temperature=0.7,
-            top_p=0.95,
-            max_tokens=300,
-            model=model_name
-        )
+        logger.info("Sending image analysis request with %s images to Azure AI", len(base64_images))
+        logger.info("Using model: %s", model_name)
+
+        route = router.choose(question, image=True)
+        with stage("upstream"):
+            start = time.perf_counter()
+            response = complete(
+                "image",
+                messages=messages,
+                temperature=0.7,
+                top_p=0.95,
+                max_tokens=IMAGE_MAX_TOKENS * min(len(base64_images), 3),
+                model=route.model
+            )
+            router.record(route, time.perf_counter() - start)
 
         answer = response.choices[0].message.content
         logger.info("Received image analysis response from Azure AI")
+        if image_hashes and answer:
+            analysis_cache.put(image_hashes, question, answer, client)
         return answer
 
     except Exception as e:
-        logger.error(f"Error analyzing image: {str(e)}")
+        logger.error("Error analyzing image: %s", e)
 
         if "content policy" in str(e).lower() or "unsafe" in str(e).lower():
             return ("I'm not able to analyze this particular type of image due to safety guidelines. "
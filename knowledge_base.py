@@ -1,65 +1,225 @@
 import os
 import json
-import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import heapq
 import logging
+import time
 import random
-from dotenv import load_dotenv
-from azure.ai.inference import EmbeddingsClient, ChatCompletionsClient
-from azure.ai.inference.models import SystemMessage, UserMessage, AssistantMessage
-from azure.core.credentials import AzureKeyCredential
-
-load_dotenv()
+import threading
+import uuid
+from array import array
+from bisect import bisect_left, insort
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from documents import Document, LoggedDocument, SearchResult, StoredDocument
+from dedup import DEDUP_MODE, NearDuplicateIndex, signature
+from document_log import DocumentLog
+from document_store import DocumentStore
+from spelling import TrigramIndex
+from suggest import SuggestionIndex
+from text_processing import normalize
+from profiler import annotate, stage
+from upstream import complete
+from routing import router
 
 logger = logging.getLogger(__name__)
 
-token = os.environ.get("AZURE_API_KEY","you_key_here")
-endpoint = os.environ.get("AZURE_ENDPOINT", "https://models.inference.ai.azure.com")
-chat_model_name = os.environ.get("AZURE_MODEL_NAME", "gpt-4o")
-embedding_model_name = os.environ.get("AZURE_EMBEDDING_MODEL", "text-embedding-ada-002")
+ROUTER_MIN_SHARE = float(os.environ.get("CATEGORY_ROUTER_MIN_SHARE", "0.6"))
+# Candidates ranked per requested result, so collapsing duplicates rarely needs a full sort
+COLLAPSE_OVERSCAN = 4
+# "memory" keeps document text on the heap; "disk" keeps it in a memory-mapped
+# data file shared by the workers and in the document log, and only the index
+# and titles in memory (see DocumentStore)
+KB_STORAGE = os.environ.get("KB_STORAGE", "memory")
+# Worker processes scoring keyword searches in parallel, each over a shard of
+# the index held in shared memory (see ShardedSearch); 0 searches in-process
+KB_SEARCH_SHARDS = int(os.environ.get("KB_SEARCH_SHARDS", "0"))
+
+
+class _ReadWriteLock:
+    """
+    Many readers or one writer.
+
+    Used as a context manager it takes the write side, which is reentrant;
+    reading() takes the read side. The writer may also read, and reads nest.
+    Waiting writers keep new readers out, so a steady stream of searches
+    cannot starve edits.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+
+    def __enter__(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._depth += 1
+                return self
+            self._waiting_writers += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = me
+            self._depth = 1
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._cond:
+            self._depth -= 1
+            if not self._depth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def reading(self):
+        held = getattr(self._local, "reads", 0)
+        if held or self._writer == threading.get_ident():
+            self._local.reads = held + 1
+            try:
+                yield
+            finally:
+                self._local.reads = held
+            return
+
+        with self._cond:
+            while self._writer is not None or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        self._local.reads = 1
+        try:
+            yield
+        finally:
+            self._local.reads = 0
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
 
-chat_client = ChatCompletionsClient(
-    endpoint=endpoint,
-    credential=AzureKeyCredential(token),
-)
 
-embedding_client = EmbeddingsClient(
-    endpoint=endpoint,
-    credential=AzureKeyCredential(token),
-)
+def _insert_posting(entries, doc_index):
+    # Postings stay sorted, so removing or renumbering an entry is a bisect
+    if not entries or entries[-1] < doc_index:
+        entries.append(doc_index)
+    else:
+        insort(entries, doc_index)
+
+
+def _remove_posting(entries, doc_index):
+    del entries[bisect_left(entries, doc_index)]
 
 
 class AzureKnowledgeBase:
-    def __init__(self, data_path="knowledge"):
+    def __init__(self, data_path="knowledge", storage=KB_STORAGE, shards=KB_SEARCH_SHARDS):
         """
         Initialize the knowledge base with documents from the specified directory.
 
+        With storage="disk" the seed corpus is read from a memory-mapped data
+        file shared by all workers, and documents added or edited since from
+        their records in the document log. Contents are only read back for
+        the documents a search returns (and when a document is edited or
+        deleted), so resident memory is bounded by the index rather than
+        the corpus.
+
+        With shards > 0 keyword searches are scored by that many worker
+        processes, so a search no longer holds the GIL of the request
+        threads for its whole scoring pass and large indexes are scored on
+        several cores. The shards are a snapshot of the index: after
+        documents change, searches run in-process until the snapshot has
+        been rebuilt in the background.
+
         Args:
             data_path (str): Path to the directory containing knowledge documents
+            storage (str): "memory" or "disk"
+            shards (int): Search worker processes; 0 searches in-process
         """
+        if storage not in ("memory", "disk"):
+            raise ValueError(f"Unknown knowledge base storage: {storage}")
+        self.storage = storage
+        self._store = None
         self.documents = []
+        self._ids = {}
         self.embeddings = []
+        self._partitions = {}
+        self._spelling = TrigramIndex()
+        self.suggestions = SuggestionIndex()
+        self._dedup = NearDuplicateIndex()
+        self.dedup_mode = DEDUP_MODE
+        self.search_shards = shards
+        self._sharded = None
+        # Bumped on every index change, so shard snapshots can tell they are stale
+        self._generation = 0
         self.data_path = data_path
+        self._log = DocumentLog(data_path)
+        # Changes to the documents and indexes take the write side; searches
+        # take the read side for scoring and building their results
+        self._lock = _ReadWriteLock()
         self.load_documents(data_path)
 
     def load_documents(self, data_path):
-        """Load documents from the knowledge directory."""
+        """
+        Load documents from the knowledge directory.
+
+        The JSON files are the seed corpus; each document's id is its file
+        name without the extension. Documents added since are replayed from
+        the document log on top of them. With disk storage the seed corpus
+        comes from the shared data file instead, built from the JSON files
+        first if no worker has built the current version yet.
+        """
         try:
             if not os.path.exists(data_path):
                 os.makedirs(data_path)
-                logger.warning(f"Created empty knowledge directory at {data_path}")
-                return
+                logger.warning("Created empty knowledge directory at %s", data_path)
+
+            documents = {}
+            if self.storage == "disk":
+                if self._store is not None:
+                    self._store.close()
+                self._store = DocumentStore(data_path)
+                for doc_id, title, category, offset, length in self._store.documents():
+                    documents[doc_id] = StoredDocument(self._store, offset, length, title, category, doc_id)
+            else:
+                for filename in os.listdir(data_path):
+                    if filename.endswith('.json'):
+                        with open(os.path.join(data_path, filename), 'r') as f:
+                            doc = json.load(f)
+                            if 'content' in doc and 'title' in doc:
+                                doc_id = filename[:-len('.json')]
+                                documents[doc_id] = Document(doc['title'], doc['content'], doc.get('category'),
+                                                             doc_id)
 
-            for filename in os.listdir(data_path):
-                if filename.endswith('.json'):
-                    with open(os.path.join(data_path, filename), 'r') as f:
-                        doc = json.load(f)
-                        if 'content' in doc and 'title' in doc:
-                            self.documents.append(doc)
+            for record in self._log.replay(seed_ids=documents):
+                if record["op"] == "delete":
+                    documents.pop(record["id"], None)
+                else:
+                    doc = Document(record["title"], record["content"], record.get("category"), record["id"])
+                    if self.storage == "disk":
+                        doc = self._logged(doc, self._log.entry(doc.id))
+                    documents[doc.id] = doc
+            self.documents = list(documents.values())
 
-            logger.info(f"Loaded {len(self.documents)} documents from knowledge base")
+            self.build_index()
+            logger.info("Loaded %s documents from knowledge base", len(self.documents))
+            duplicates = sum(len(copies) for copies in self._dedup.clusters().values())
+            if duplicates:
+                logger.info("Flagged %s near-duplicate documents", duplicates)
         except Exception as e:
-            logger.error(f"Error loading knowledge base: {str(e)}")
+            logger.error("Error loading knowledge base: %s", e)
+
+    @staticmethod
+    def _logged(doc, entry):
+        # Content is read back from the log; the terms are kept for indexing
+        return LoggedDocument(entry, doc.title, doc.category, doc.id, doc.terms)
+
+    def _persist(self, doc):
+        """Write a document to the document log (without waiting for fsync) and return the copy to index."""
+        entry = self._log.put(doc.id, doc.to_dict(), sync=False)
+        return self._logged(doc, entry) if self.storage == "disk" else doc
 
     def create_embeddings(self):
         """
@@ -79,86 +239,640 @@ class AzureKnowledgeBase:
             category (str, optional): Category for organizing documents
         """
         try:
-            doc = {
-                "title": title,
-                "content": content,
-                "category": category
-            }
-
-            self.documents.append(doc)
-            self._save_document(doc)
-            logger.info(f"Added new document: {title}")
-            return True
+            doc = Document(title, content, category, uuid.uuid4().hex)
+            with self._lock:
+                doc_index, added = self._append_document(doc, persist=True)
         except Exception as e:
-            logger.error(f"Error adding document: {str(e)}")
+            logger.error("Error adding document: %s", e)
             return False
 
-    def _save_document(self, doc):
-        """Save a document to the knowledge directory."""
+        if added:
+            try:
+                # Outside the lock so concurrent adds can share the fsync
+                self._log.sync()
+            except Exception as e:
+                logger.error("Error syncing added document, removing it again: %s", e)
+                self._rollback([doc.id])
+                return False
+            self._schedule_shard_rebuild()
+            logger.info("Added new document: %s", title)
+        return True
+
+    def add_documents(self, documents):
+        """
+        Add many documents at once.
+
+        The documents are written to the document log together and synced to
+        disk once for the whole batch. If that sync fails, the documents
+        added by the batch are removed again and counted as rejected.
+
+        Args:
+            documents (list): dicts with title, content and optional category
+
+        Returns:
+            dict: Number of documents added, merged into existing
+                near-duplicates, and rejected
+        """
+        counts = {"added": 0, "merged": 0, "rejected": 0}
+        added_ids = []
+        for data in documents:
+            if not isinstance(data, dict) or not data.get("title") or not data.get("content"):
+                counts["rejected"] += 1
+                continue
+            try:
+                doc = Document(data["title"], data["content"], data.get("category"), uuid.uuid4().hex)
+                with self._lock:
+                    doc_index, added = self._append_document(doc, persist=True)
+                if added:
+                    added_ids.append(doc.id)
+                    counts["added"] += 1
+                else:
+                    counts["merged"] += 1
+            except Exception as e:
+                logger.error("Error adding document: %s", e)
+                counts["rejected"] += 1
+
+        if added_ids:
+            try:
+                self._log.sync()
+            except Exception as e:
+                logger.error("Error syncing bulk ingest, removing its documents again: %s", e)
+                self._rollback(added_ids)
+                counts["rejected"] += counts["added"]
+                counts["added"] = 0
+        if counts["added"]:
+            self._schedule_shard_rebuild()
+        logger.info("Bulk ingest: %s", counts)
+        return counts
+
+    def get_document(self, doc_id):
+        """Return the document with this id, or None."""
+        with self._lock.reading():
+            doc_index = self._ids.get(doc_id)
+            return None if doc_index is None else self.documents[doc_index]
+
+    def update_document(self, doc_id, title=None, content=None, category=None):
+        """
+        Replace fields of an existing document, keeping its id.
+
+        Only the document's own entries in the postings, spelling and
+        suggestion indexes and the duplicate index are patched, so an edit
+        costs the same however large the knowledge base is.
+
+        Args:
+            doc_id (str): Id of the document
+            title (str, optional): New title; None keeps the current one
+            content (str, optional): New content; None keeps the current one
+            category (str, optional): New category; None keeps the current
+                one and an empty string clears it
+
+        Returns:
+            Document: The updated document, or None if no document has this id
+        """
+        with self._lock:
+            doc_index = self._ids.get(doc_id)
+            if doc_index is None:
+                return None
+            old = self.documents[doc_index]
+            doc = Document(
+                title if title is not None else old.title,
+                content if content is not None else old.content,
+                (category or None) if category is not None else old.category,
+                doc_id
+            )
+            doc = self._persist(doc)
+
+            self._unindex_document(doc_index, old)
+            self.documents[doc_index] = doc
+            sig = signature(doc.terms)
+            self._index_document(doc_index, doc)
+            self._dedup.add(doc_index, sig)
+        self._log.sync()
+        self._schedule_shard_rebuild()
+        logger.info("Updated document %s: %s", doc_id, doc.title)
+        return doc
+
+    def delete_document(self, doc_id):
+        """
+        Remove a document.
+
+        The last document moves into the freed slot, so only its postings
+        are renumbered and the document list stays dense.
+
+        Returns:
+            bool: True if the document existed
+        """
+        with self._lock:
+            doc_index = self._ids.get(doc_id)
+            if doc_index is None:
+                return False
+            doc = self.documents[doc_index]
+            self._log.delete(doc_id, sync=False)
+
+            self._remove_document(doc_index)
+        self._log.sync()
+        self._schedule_shard_rebuild()
+        logger.info("Deleted document %s: %s", doc_id, doc.title)
+        return True
+
+    def _remove_document(self, doc_index):
+        """Unindex a document and move the last document into its slot."""
+        doc = self.documents[doc_index]
+        self._unindex_document(doc_index, doc)
+        last_index = len(self.documents) - 1
+        if doc_index != last_index:
+            moved = self.documents[last_index]
+            self._renumber_document(moved, last_index, doc_index)
+            self.documents[doc_index] = moved
+            self._ids[moved.id] = doc_index
+        self.documents.pop()
+        del self._ids[doc.id]
+
+    def _rollback(self, doc_ids):
+        """
+        Take back added documents whose log records could not be synced.
+
+        Their records may still reach the disk, so a delete record is
+        written for each as well, on a best-effort basis.
+        """
+        with self._lock:
+            for doc_id in doc_ids:
+                doc_index = self._ids.get(doc_id)
+                if doc_index is not None:
+                    self._remove_document(doc_index)
+                try:
+                    self._log.delete(doc_id, sync=False)
+                except Exception as e:
+                    logger.error("Error recording rollback of document %s: %s", doc_id, e)
+
+    def flush(self):
+        """Block until every document added so far is durable on disk."""
         try:
-            filename = "".join(x for x in doc['title'] if x.isalnum() or x in " _").strip()
-            filename = filename.replace(" ", "_").lower()
+            self._log.sync()
+        except Exception as e:
+            logger.error("Error syncing document log: %s", e)
+
+    def close(self):
+        """Flush the document log and release the document store and search shards."""
+        if self._sharded is not None:
+            self._sharded.close()
+        self._log.close()
+        if self._store is not None:
+            self._store.close()
+
+    def build_index(self):
+        """Rebuild the token postings and duplicate index from the loaded documents."""
+        with self._lock:
+            self._partitions = {}
+            self._spelling = TrigramIndex()
+            self.suggestions = SuggestionIndex()
+            self._dedup = NearDuplicateIndex()
+
+            documents = self.documents
+            self.documents = []
+            self._ids = {}
+            for doc in documents:
+                self._append_document(doc)
+            self._build_shards()
 
-            with open(os.path.join(self.data_path, f"{filename}.json"), 'w') as f:
-                json.dump(doc, f, indent=2)
+    def _build_shards(self):
+        """Snapshot the index into the search shards, if sharded search is enabled."""
+        if self.search_shards <= 0:
+            return
+        try:
+            with self._lock:
+                if self._sharded is None:
+                    from sharded_search import ShardedSearch
+                    self._sharded = ShardedSearch(self.search_shards)
+            # Copying the index out only reads it, so searches carry on meanwhile
+            with self._lock.reading():
+                if self._sharded.generation != self._generation:
+                    self._sharded.build(self._partitions, self.documents, self._generation)
         except Exception as e:
-            logger.error(f"Error saving document: {str(e)}")
+            logger.error("Error building search shards, searching in-process: %s", e)
+
+    def _schedule_shard_rebuild(self):
+        if self._sharded is not None:
+            self._sharded.schedule_rebuild(self._build_shards)
+
+    def _append_document(self, doc, persist=False):
+        """
+        Append a document and index it, checking for near-duplicates first.
+
+        In "merge" mode a near-duplicate of an existing document is not added;
+        in "flag" mode it is indexed and linked to the existing copy so search
+        results show only one of them.
+
+        With persist=True the document is written to the document log before
+        it is indexed (without waiting for fsync), so a failed write leaves
+        it out of the index as well.
+
+        Returns:
+            tuple: (document index, whether the document was added); for a
+            merged document the index is that of the existing copy
+        """
+        sig = signature(doc.terms)
+        keys = self._dedup.band_keys(sig) if sig is not None else None
+        found = self._dedup.match(sig, keys)
+        if found is not None:
+            existing, score = found
+            if self.dedup_mode == "merge":
+                logger.info("Merged near-duplicate '%s' into '%s' (similarity %.2f)",
+                            doc.title, self.documents[existing].title, score)
+                doc.release()
+                return existing, False
+            logger.debug("'%s' is a near-duplicate of '%s'", doc.title, self.documents[existing].title)
+
+        if persist:
+            doc = self._persist(doc)
+        doc_index = len(self.documents)
+        self.documents.append(doc)
+        if doc.id is not None:
+            self._ids[doc.id] = doc_index
+        self._index_document(doc_index, doc)
+        self._dedup.add(doc_index, sig, found[0] if found else doc_index, keys)
+        return doc_index, True
+
+    def duplicates(self):
+        """Return the titles of documents flagged as near-duplicates, grouped by the copy kept in results."""
+        with self._lock.reading():
+            return [
+                {"title": self.documents[kept].title, "duplicates": [self.documents[idx].title for idx in copies]}
+                for kept, copies in sorted(self._dedup.clusters().items())
+            ]
 
-    def _keyword_search(self, query, top_k=3):
+    def _index_document(self, doc_index, doc):
         """
-        Perform a simple keyword-based search of the documents.
+        Add a document's tokens to its category partition and its title and
+        words to the suggestions.
+
+        Each category has its own title and content postings, so a search
+        restricted to some categories never touches the others.
+        """
+        self.suggestions.add_document(doc.title, doc.content)
+        self._generation += 1
+
+        partition = self._partitions.get(doc.category)
+        if partition is None:
+            partition = {"docs": array('I'), "title": {}, "content": {}}
+            self._partitions[doc.category] = partition
+        _insert_posting(partition["docs"], doc_index)
+
+        for field, terms in (("title", doc.title_terms), ("content", doc.terms)):
+            postings = partition[field]
+            for term in terms:
+                entries = postings.get(term)
+                if entries is None:
+                    postings[term] = array('I', (doc_index,))
+                    self._spelling.add(term)
+                else:
+                    _insert_posting(entries, doc_index)
+        doc.release()
+
+    def _unindex_document(self, doc_index, doc):
+        """Undo _index_document, and drop the document from the duplicate index."""
+        self.suggestions.remove_document(doc.title, doc.content)
+        self._dedup.remove(doc_index)
+        self._generation += 1
+
+        partition = self._partitions[doc.category]
+        _remove_posting(partition["docs"], doc_index)
+        for field, terms in (("title", doc.title_terms), ("content", doc.terms)):
+            postings = partition[field]
+            for term in terms:
+                entries = postings[term]
+                _remove_posting(entries, doc_index)
+                if not entries:
+                    del postings[term]
+                    if not self._document_frequency(term):
+                        self._spelling.remove(term)
+        if not partition["docs"]:
+            del self._partitions[doc.category]
+        doc.release()
+
+    def _renumber_document(self, doc, old_index, new_index):
+        """Point every index entry of a document at its new position."""
+        partition = self._partitions[doc.category]
+        _remove_posting(partition["docs"], old_index)
+        _insert_posting(partition["docs"], new_index)
+        for field, terms in (("title", doc.title_terms), ("content", doc.terms)):
+            postings = partition[field]
+            for term in terms:
+                entries = postings[term]
+                _remove_posting(entries, old_index)
+                _insert_posting(entries, new_index)
+        self._dedup.move(old_index, new_index)
+        doc.release()
+
+    def suggest(self, prefix, limit=8):
+        """
+        Suggest document titles and frequent terms completing a prefix.
+
+        Args:
+            prefix (str): Text typed so far
+            limit (int): Maximum number of suggestions
+
+        Returns:
+            list: dicts with "text" and "kind"
+        """
+        # Lookups only exclude edits; SuggestionIndex serializes its own merges
+        with self._lock.reading():
+            return self.suggestions.suggest(prefix, limit)
+
+    def categories(self):
+        """Return the number of documents in each category."""
+        with self._lock.reading():
+            return {category: len(partition["docs"]) for category, partition in self._partitions.items()
+                    if category is not None}
+
+    def _select_partitions(self, categories=None):
+        """Return the partitions for the given category names, or all of them."""
+        if categories is None:
+            return list(self._partitions.values())
+        if isinstance(categories, str):
+            categories = [categories]
+
+        wanted = {category.lower() for category in categories if category}
+        return [partition for category, partition in self._partitions.items()
+                if category is not None and category.lower() in wanted]
+
+    def infer_categories(self, query, max_categories=2, min_share=ROUTER_MIN_SHARE):
+        """
+        Guess which categories a query is about.
+
+        Each category is weighted by how many of its documents match the
+        query terms (title matches count 3, content matches 1). The top
+        categories are returned once they cover min_share of the total weight.
+
+        Args:
+            query (str): The user's question
+            max_categories (int): Most categories to return
+            min_share (float): Fraction of the match weight they must cover
+
+        Returns:
+            list: Category names, or None when the query is not clearly about
+            a few categories and should search everything
+        """
+        with self._lock.reading():
+            terms = list(dict.fromkeys(self._correct_terms(normalize(query))))
+            weights = {}
+            for category, partition in self._partitions.items():
+                if category is None:
+                    continue
+                weight = sum(3 * len(partition["title"].get(term, ())) + len(partition["content"].get(term, ()))
+                             for term in terms)
+                if weight:
+                    weights[category] = weight
+
+            total = sum(weights.values())
+            if not total:
+                return None
+
+            selected = []
+            covered = 0
+            for category in sorted(weights, key=weights.get, reverse=True)[:max_categories]:
+                selected.append(category)
+                covered += weights[category]
+                if covered / total >= min_share:
+                    logger.info("Routed query to categories: %s", selected)
+                    return selected
+            return None
+
+    def _document_frequency(self, term):
+        return sum(len(partition["title"].get(term, ())) + len(partition["content"].get(term, ()))
+                   for partition in self._partitions.values())
+
+    def _correct_terms(self, terms, cache=None):
+        """
+        Replace terms missing from the vocabulary with their closest correction.
+
+        Candidates come from the trigram index and are confirmed with a
+        bounded edit distance; ties go to the more common term. Terms with no
+        candidate are dropped. A cache dict shared across calls lets a batch
+        of queries correct each unknown term only once.
+        """
+        corrected = []
+        for term in terms:
+            if term in self._spelling:
+                corrected.append(term)
+                continue
+
+            if cache is not None and term in cache:
+                best = cache[term]
+            else:
+                candidates = self._spelling.corrections(term)
+                best = None
+                if candidates:
+                    best = min(candidates, key=lambda c: (c[1], -self._document_frequency(c[0])))[0]
+                    logger.info("Corrected query term '%s' to '%s'", term, best)
+                if cache is not None:
+                    cache[term] = best
+            if best is not None:
+                corrected.append(best)
+        return corrected
+
+    def _keyword_search(self, query, top_k=3, categories=None):
+        """
+        Perform a keyword-based search of the documents.
+
+        The query goes through the same normalization as the documents, so
+        only the postings of its distinct index terms are touched. Each term
+        scores 3 for a title match and 1 for a content match.
 
         Args:
             query (str): The search query
             top_k (int): Number of results to return
+            categories (list, optional): Only search these categories
 
         Returns:
-            list: Top k relevant documents
+            list: Top k relevant documents as SearchResult views
         """
-        if not self.documents:
-            return []
+        with self._lock.reading():
+            if not self.documents:
+                return []
+
+            partitions = self._select_partitions(categories)
+            terms = list(dict.fromkeys(self._correct_terms(normalize(query))))
+            if self._sharded is not None:
+                results = self._search_shards([(terms, categories)], [partitions], top_k)
+                if results is not None:
+                    return results[0]
+            return self._rank(self._score(terms, partitions), partitions, top_k)
+
+    def _keyword_search_batch(self, queries, top_k=3, categories=None):
+        """
+        Keyword search for several queries in one pass.
+
+        Queries are normalized up front, each distinct misspelled term is
+        corrected once for the whole batch, and queries that search the same
+        partitions share one lookup of each term's postings.
+
+        Args:
+            queries (list): Search queries
+            top_k (int): Number of results per query
+            categories (list, optional): One category filter per query (None
+                entries search everything)
+
+        Returns:
+            list: One list of SearchResult views per query, in query order
+        """
+        with self._lock.reading():
+            if not self.documents:
+                return [[] for _ in queries]
+            if categories is None:
+                categories = [None] * len(queries)
+
+            corrections = {}
+            groups = {}
+            corrected = []
+            for position, (query, selected) in enumerate(zip(queries, categories)):
+                terms = list(dict.fromkeys(self._correct_terms(normalize(query), corrections)))
+                if isinstance(selected, str):
+                    selected = [selected]
+                key = None if selected is None else tuple(sorted({c.lower() for c in selected if c}))
+                groups.setdefault(key, []).append((position, terms))
+                corrected.append((terms, selected))
+
+            if self._sharded is not None:
+                # One round trip to the shards for the whole batch
+                results = self._search_shards(
+                    corrected, [self._select_partitions(selected) for _, selected in corrected], top_k)
+                if results is not None:
+                    return results
+
+            results = [None] * len(queries)
+            for key, members in groups.items():
+                partitions = self._select_partitions(None if key is None else list(key))
+                postings = {}
+                for _, terms in members:
+                    for term in terms:
+                        if term not in postings:
+                            postings[term] = [(partition["title"].get(term, ()), partition["content"].get(term, ()))
+                                              for partition in partitions]
+                for position, terms in members:
+                    scores = {}
+                    for term in terms:
+                        for title_entries, content_entries in postings[term]:
+                            for idx in title_entries:
+                                scores[idx] = scores.get(idx, 0) + 3
+                            for idx in content_entries:
+                                scores[idx] = scores.get(idx, 0) + 1
+                    results[position] = self._rank(scores, partitions, top_k)
+            return results
 
-        query = query.lower()
-        query_terms = query.split()
+    @staticmethod
+    def _score(terms, partitions):
+        scores = {}
+        for partition in partitions:
+            title_postings = partition["title"]
+            content_postings = partition["content"]
+            for term in terms:
+                for idx in title_postings.get(term, ()):
+                    scores[idx] = scores.get(idx, 0) + 3
+                for idx in content_postings.get(term, ()):
+                    scores[idx] = scores.get(idx, 0) + 1
+        return scores
 
-        scores = []
-        for doc in self.documents:
-            title = doc['title'].lower()
-            content = doc['content'].lower()
+    def _rank(self, scores, partitions, top_k):
+        """
+        Take the top k scored documents, or a random sample of the partitions
+        if nothing matched.
 
-            title_score = sum(3 for term in query_terms if term in title)
-            content_score = sum(1 for term in query_terms if term in content)
+        Near-duplicates are collapsed: only the best-scoring copy of a text is
+        returned, and the next distinct document takes the freed slot.
+        """
+        key = lambda idx: (scores[idx], -idx)
+        candidates = heapq.nlargest(top_k * COLLAPSE_OVERSCAN, scores, key=key)
+        filtered_indices = self._collapse(candidates, top_k)
+        if len(filtered_indices) < top_k and len(candidates) < len(scores):
+            filtered_indices = self._collapse(sorted(scores, key=key, reverse=True), top_k)
+        return self._results(filtered_indices, scores, partitions, top_k)
 
-            score = title_score + content_score
-            scores.append(score)
+    def _search_shards(self, queries, partitions, top_k):
+        """
+        Rank corrected queries on the search shards, like _rank does.
 
-        top_indices = np.argsort(scores)[-top_k:][::-1]
+        Args:
+            queries (list): (terms, categories) per query
+            partitions (list): The selected partitions of each query, for the
+                random sample returned when nothing matches
+            top_k (int): Number of results per query
 
-        filtered_indices = [idx for idx in top_indices if scores[idx] > 0]
+        Returns:
+            list: One list of SearchResult views per query, or None when the
+            shards are out of date and the in-process index must be used
+        """
+        generation = self._generation
+        limit = top_k * COLLAPSE_OVERSCAN
+        ranked = self._search_sharded(queries, limit, generation)
+        if ranked is None:
+            return None
 
+        results = []
+        for query, query_partitions, candidates in zip(queries, partitions, ranked):
+            filtered_indices = self._collapse([idx for idx, _ in candidates], top_k)
+            if len(filtered_indices) < top_k and len(candidates) == limit:
+                # Duplicates filled the candidates: fetch every match, as _rank sorts all scores
+                candidates = self._search_sharded([query], None, generation)
+                if candidates is None:
+                    return None
+                candidates = candidates[0]
+                filtered_indices = self._collapse([idx for idx, _ in candidates], top_k)
+            results.append(self._results(filtered_indices, dict(candidates), query_partitions, top_k))
+
+        # Indices found by the shards may point at other documents once the index changed
+        if self._generation != generation:
+            return None
+        return results
+
+    def _search_sharded(self, queries, limit, generation):
+        # Any failure of the shards falls back to the in-process index for this search
+        try:
+            return self._sharded.search(queries, limit, generation)
+        except BrokenProcessPool as e:
+            # ShardedSearch has dropped the dead pool; a rebuild starts a new one
+            logger.error("Search shard worker died, searching in-process until the shards are rebuilt: %s", e)
+            self._schedule_shard_rebuild()
+        except Exception as e:
+            # e.g. a rebuild removed the blocks this search was about to attach
+            logger.warning("Error searching shards, searching in-process: %s", e)
+        return None
+
+    def _results(self, filtered_indices, scores, partitions, top_k):
         if not filtered_indices:
-            if self.documents:
-                available_indices = list(range(len(self.documents)))
+            representative = self._dedup.representative
+            available_indices = [idx for partition in partitions for idx in partition["docs"]
+                                 if representative(idx) == idx]
+            if available_indices:
                 filtered_indices = random.sample(
                     available_indices,
                     min(top_k, len(available_indices))
                 )
 
-        results = []
-        for idx in filtered_indices:
-            doc = self.documents[idx].copy()
-            doc['similarity'] = 0.5
-            results.append(doc)
+        return [SearchResult(self.documents[idx], scores.get(idx, 0)) for idx in filtered_indices]
 
-        return results
+    def _collapse(self, ranked, top_k):
+        representative = self._dedup.representative
+        seen = set()
+        kept = []
+        for idx in ranked:
+            cluster = representative(idx)
+            if cluster in seen:
+                continue
+            seen.add(cluster)
+            kept.append(idx)
+            if len(kept) == top_k:
+                break
+        return kept
 
-    def search(self, query, top_k=3):
+    def search(self, query, top_k=3, categories=None):
         """
         Search for relevant documents based on the query.
 
         Args:
             query (str): The search query
             top_k (int): Number of results to return
+            categories (list, optional): Restrict the search to these categories
 
         Returns:
             list: Top k relevant documents
@@ -168,65 +882,158 @@ class AzureKnowledgeBase:
             return []
 
         try:
-            results = self._keyword_search(query, top_k)
-            logger.info(f"Found {len(results)} relevant documents using keyword search")
+            results = self._keyword_search(query, top_k, categories)
+            logger.info("Found %s relevant documents using keyword search", len(results))
             return results
         except Exception as e:
-            logger.error(f"Error performing keyword search: {str(e)}")
+            logger.error("Error performing keyword search: %s", e)
             return []
 
+    def search_batch(self, queries, top_k=3, categories=None):
+        """
+        Search for relevant documents for several queries at once.
 
-def get_ai_response_with_knowledge_azure(user_input, knowledge_base, context=None):
+        Args:
+            queries (list): The search queries
+            top_k (int): Number of results per query
+            categories (list, optional): One category filter per query
+
+        Returns:
+            list: One list of relevant documents per query, in query order
+        """
+        if not self.documents:
+            logger.warning("Knowledge base is empty")
+            return [[] for _ in queries]
+
+        try:
+            results = self._keyword_search_batch(queries, top_k, categories)
+            logger.info("Ran keyword search for a batch of %s queries", len(queries))
+            return results
+        except Exception as e:
+            logger.error("Error performing batch keyword search: %s", e)
+            return [[] for _ in queries]
+
+
+def build_knowledge_messages(user_input, relevant_docs, context=None):
     """
-    Get an AI response enhanced with domain-specific knowledge using Azure AI.
+    Build the chat messages for a question answered from knowledge documents.
 
     Args:
         user_input (str): The user's question
-        knowledge_base (AzureKnowledgeBase): Knowledge base for retrieving context
+        relevant_docs (list): Documents retrieved for the question
         context (str, optional): Previous conversation context
 
+    Returns:
+        list: azure.ai.inference chat messages
+    """
+    from azure.ai.inference.models import SystemMessage, UserMessage, AssistantMessage
+
+    system_prompt = (
+        "You are a specialized healthcare assistant providing accurate medical information. "
+        "Focus on symptoms, conditions, and general wellness advice. "
+        "Keep responses concise but informative. "
+        "Always include appropriate disclaimers about consulting healthcare professionals for definitive advice."
+    )
+
+    if relevant_docs:
+        system_prompt += "\n\nUse the following specialized information to inform your response:\n\n"
+        for i, doc in enumerate(relevant_docs, 1):
+            system_prompt += f"{doc['title']}: {doc['content']}\n\n"
+
+    messages = [SystemMessage(system_prompt)]
+
+    if context:
+        messages.append(AssistantMessage(context))
+
+    messages.append(UserMessage(user_input))
+    return messages
+
+
+def complete_with_knowledge(user_input, relevant_docs, context=None, usage=None):
+    """
+    Ask the chat model a question with already retrieved documents.
+
+    Unlike get_ai_response_with_knowledge_azure this raises on failure, so
+    callers answering several questions can report errors per question.
+    The model is picked by the router (see routing.ModelRouter); if the fast
+    model fails the question is retried once on the full model.
+
+    Args:
+        user_input (str): The user's question
+        relevant_docs (list): Documents retrieved for the question
+        context (str, optional): Previous conversation context
+        usage (dict, optional): Filled with the model used and the prompt,
+            completion and total token counts reported by the service
+
     Returns:
         str: The AI's response
     """
-    try:
-        relevant_docs = knowledge_base.search(user_input)
+    route = router.choose(user_input, relevant_docs, context)
+    messages = build_knowledge_messages(user_input, relevant_docs, context)
+
+    logger.info("Sending enhanced request to Azure AI")
+    logger.info("Using model: %s", route.model)
+
+    with stage("upstream"):
+        start = time.perf_counter()
+        try:
+            response = _complete_knowledge(route, messages)
+        except Exception as e:
+            if route.name == "full":
+                raise
+            logger.warning("Fast model failed, escalating to the full model: %s", e)
+            route = router.full("fast_failed", route.confidence)
+            start = time.perf_counter()
+            response = _complete_knowledge(route, messages)
+        router.record(route, time.perf_counter() - start)
 
-        system_prompt = (
-            "You are a specialized healthcare assistant providing accurate medical information. "
-            "Focus on symptoms, conditions, and general wellness advice. "
-            "Keep responses concise but informative. "
-            "Always include appropriate disclaimers about consulting healthcare professionals for definitive advice."
+    if usage is not None and response.usage is not None:
+        usage.update(
+            model=route.model,
+            prompt_tokens=response.usage.prompt_tokens,
+            completion_tokens=response.usage.completion_tokens,
+            total_tokens=response.usage.total_tokens
         )
 
-        if relevant_docs:
-            system_prompt += "\n\nUse the following specialized information to inform your response:\n\n"
-            for i, doc in enumerate(relevant_docs, 1):
-                system_prompt += f"{doc['title']}: {doc['content']}\n\n"
+    answer = response.choices[0].message.content
+    logger.info("Received enhanced response from Azure AI")
 
+    return answer
 
-        messages = [SystemMessage(system_prompt)]
 
-        if context:
-            messages.append(AssistantMessage(context))
+def _complete_knowledge(route, messages):
+    return complete(
+        route.upstream_kind("knowledge"),
+        messages=messages,
+        temperature=0.7,
+        top_p=0.95,
+        max_tokens=250,
+        model=route.model
+    )
 
-        messages.append(UserMessage(user_input))
 
-        logger.info("Sending enhanced request to Azure AI")
-        logger.info(f"Using model: {chat_model_name}")
+def get_ai_response_with_knowledge_azure(user_input, knowledge_base, context=None, categories=None, usage=None):
+    """
+    Get an AI response enhanced with domain-specific knowledge using Azure AI.
 
-        response = chat_client.complete(
-            messages=messages,
-            temperature=0.7,
-            top_p=0.95,
-            max_tokens=250,
-            model=chat_model_name
-        )
+    Args:
+        user_input (str): The user's question
+        knowledge_base (AzureKnowledgeBase): Knowledge base for retrieving context
+        context (str, optional): Previous conversation context
+        categories (list, optional): Restrict retrieval to these categories
+        usage (dict, optional): Filled with the token usage of the model call;
+            left empty when the call fails
 
-        answer = response.choices[0].message.content
-        logger.info(f"Received enhanced response from Azure AI")
+    Returns:
+        str: The AI's response
+    """
+    try:
+        with stage("retrieval"):
+            relevant_docs = knowledge_base.search(user_input, categories=categories)
+        annotate(retrieval_hits=len(relevant_docs), retrieval_categories=len(categories) if categories else 0)
 
-        return answer
+        return complete_with_knowledge(user_input, relevant_docs, context, usage)
 
     except Exception as e:
-        logger.error(f"Error getting AI response: {str(e)}")
-        return "I'm sorry, I encountered an error while processing your request. Please try again later."
\ No newline at end of file
+        logger.error("Error getting AI response: %s", e)
+        return "I'm sorry, I encountered an error while processing your request. Please try again later."
@@ -0,0 +1,210 @@
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import random
+import logging
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# "json" writes one JSON object per line, "text" the classic human-readable lines
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Records waiting for the writer thread; when the queue is full new records are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+# Share of INFO and DEBUG records kept per logger, e.g. "knowledge_base=0.1,routing=0.05"
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+_exception_formatter = logging.Formatter()
+
+
+def parse_sample_rates(spec):
+    """Parse "name=rate,..." into a dict, ignoring malformed entries."""
+    rates = {}
+    for entry in spec.split(","):
+        name, _, rate = entry.partition("=")
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON objects, including any `extra` fields."""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rates):
+        """
+        Keep a random share of the INFO and DEBUG records of chosen loggers.
+
+        A rate applies to the named logger and its children. Warnings and
+        errors always pass. Kept records carry a sample_rate field so
+        counts can be scaled back up.
+
+        Args:
+            rates (dict): Logger name -> share of records to keep (0-1)
+        """
+        super().__init__()
+        self.rates = rates
+        self._resolved = {}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+    def _rate(self, name):
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate = 1.0
+            candidate = name
+            while candidate:
+                if candidate in self.rates:
+                    rate = self.rates[candidate]
+                    break
+                candidate = candidate.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the logging thread.
+
+    Like QueueHandler, the message is merged with its arguments and any
+    exception is rendered to text before the record is queued, so the
+    listener never sees objects the caller may still change. Fields passed
+    through `extra` are kept, and JSON encoding happens on the listener
+    thread. When the queue is full the record is dropped and counted; the
+    count is reported in the next record that fits.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._reported = 0
+
+    def prepare(self, record):
+        message = record.getMessage()
+        record = copy.copy(record)
+        record.msg = message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = _exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            dropped = self.dropped
+            if dropped != self._reported:
+                self.queue.put_nowait(self._dropped_record(dropped - self._reported))
+                self._reported = dropped
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    @staticmethod
+    def _dropped_record(count):
+        return logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                 "Dropped %d log records while the log queue was full", (count,), None)
+
+
+class _Listener(QueueListener):
+    def __init__(self, handler, *outputs):
+        super().__init__(handler.queue, *outputs, respect_handler_level=True)
+        self.queue_handler = handler
+
+    def enqueue_sentinel(self):
+        # Wait for room at shutdown instead of failing on a full queue
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is None:
+            return
+        super().stop()
+        handler = self.queue_handler
+        if handler.dropped != handler._reported:
+            for output in self.handlers:
+                output.handle(handler._dropped_record(handler.dropped - handler._reported))
+            handler._reported = handler.dropped
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, queue_size=LOG_QUEUE_SIZE, sample_rates=LOG_SAMPLE_RATES):
+    """
+    Route all logging through a queue drained by a background thread.
+
+    Request threads only append records to a bounded in-memory queue; a
+    QueueListener thread formats them and writes them to stderr, so a slow
+    or blocked log destination never stalls a request. Calling this again
+    has no effect.
+
+    Args:
+        level (str): Root log level
+        fmt (str): "json" or "text"
+        queue_size (int): Most records waiting to be written
+        sample_rates (str or dict): Per-logger sampling, see SamplingFilter
+
+    Returns:
+        QueueListener: The running listener; stop() flushes it
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    if isinstance(sample_rates, str):
+        sample_rates = parse_sample_rates(sample_rates)
+    if sample_rates:
+        handler.addFilter(SamplingFilter(sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = _Listener(handler, output)
+    _listener.start()
+    # Drain what is still queued on a normal exit
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,333 @@
+import os
+import io
+import json
+import time
+import hmac
+import uuid
+import random
+import logging
+import cProfile
+import pstats
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+# Requests whose X-Profile header equals this secret are always profiled and
+# captured; forced profiling is off while it is unset
+PROFILE_SECRET = os.environ.get("PROFILE_SECRET", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_RING_SIZE = int(os.environ.get("PROFILE_RING_SIZE", "50"))
+SLOW_REQUEST_THRESHOLD_MS = float(os.environ.get("SLOW_REQUEST_THRESHOLD_MS", "2000"))
+
+_current_record = contextvars.ContextVar("request_profile", default=None)
+
+
+def current_record():
+    """Return the RequestRecord for the request being handled, if any."""
+    return _current_record.get()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a named stage of the current request.
+
+    Stages are recorded on the active RequestRecord; outside of a request
+    this is a no-op, so service modules can use it unconditionally.
+
+    Args:
+        name (str): Stage name, e.g. "retrieval" or "upstream"
+    """
+    record = _current_record.get()
+    if record is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.add_stage(name, (time.perf_counter() - start) * 1000)
+
+
+def annotate(**values):
+    """
+    Attach attributes, such as the number of documents retrieved, to the
+    current request's RequestRecord. Like stage(), a no-op outside a request.
+    """
+    record = _current_record.get()
+    if record is not None:
+        record.attributes.update(values)
+
+
+def bind_record(fn):
+    """
+    Wrap fn so that, run on a worker thread, it counts towards the current
+    request: its stage(), annotate() and upstream timings reach the
+    request's RequestRecord. Outside a request fn is returned unchanged.
+    """
+    record = _current_record.get()
+    if record is None:
+        return fn
+
+    def run(*args, **kwargs):
+        token = _current_record.set(record)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_record.reset(token)
+    return run
+
+
+class RequestRecord:
+    def __init__(self, method, path, profile=False):
+        """
+        Timing record for a single request.
+
+        Args:
+            method (str): HTTP method
+            path (str): Request path
+            profile (bool): Whether to run cProfile for this request
+        """
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.stages = []
+        self.attributes = {}
+        self.duration_ms = None
+        self.status = None
+        self.forced = False
+        self.profiler = cProfile.Profile() if profile else None
+        self._start = time.perf_counter()
+
+    def start(self):
+        if self.profiler is not None:
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Another profiler is already active on this thread
+                self.profiler = None
+
+    def stop(self, status=None):
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.duration_ms = (time.perf_counter() - self._start) * 1000
+        self.status = status
+
+    def add_stage(self, name, duration_ms):
+        self.stages.append({"name": name, "ms": round(duration_ms, 3)})
+
+    def append(self, name, value):
+        """Add a value to a list attribute, e.g. one latency per upstream call."""
+        self.attributes.setdefault(name, []).append(value)
+
+    def stage_totals(self):
+        """Return the summed duration of each stage name."""
+        totals = {}
+        for entry in self.stages:
+            totals[entry["name"]] = totals.get(entry["name"], 0.0) + entry["ms"]
+        return totals
+
+    def server_timing(self):
+        """Format the stage totals as a Server-Timing header value."""
+        parts = [f"{name};dur={ms:.1f}" for name, ms in self.stage_totals().items()]
+        if self.duration_ms is not None:
+            parts.append(f"total;dur={self.duration_ms:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms or 0.0, 3),
+            "status": self.status,
+            "forced": self.forced,
+            "stages": self.stages,
+            "stage_totals": self.stage_totals(),
+            "attributes": self.attributes,
+            "has_profile": self.profiler is not None,
+        }
+
+
+class ProfileStore:
+    def __init__(self, directory=PROFILE_DIR, capacity=PROFILE_RING_SIZE):
+        """
+        Bounded on-disk ring of captured request profiles.
+
+        Each capture is a `<id>.json` summary plus, when cProfile ran, a
+        `<id>.prof` pstats dump. Once the ring is full the oldest captures
+        are removed.
+
+        Args:
+            directory (str): Directory the captures are written to
+            capacity (int): Maximum number of captures kept
+        """
+        self.directory = directory
+        self.capacity = capacity
+        self._lock = threading.Lock()
+
+    def save(self, record):
+        """Persist a record and trim the ring."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            summary = record.to_dict()
+
+            if record.profiler is not None:
+                record.profiler.dump_stats(self._path(record.id, "prof"))
+                summary["top_functions"] = self._top_functions(record.profiler)
+
+            tmp_path = self._path(record.id, "json") + ".tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(summary, f, indent=2)
+            os.replace(tmp_path, self._path(record.id, "json"))
+
+            self._trim()
+        except Exception as e:
+            logger.error("Error saving request profile: %s", e)
+
+    def list(self):
+        """Return capture summaries, newest first."""
+        summaries = []
+        for name in self._capture_names():
+            summary = self.get(name)
+            if summary:
+                summaries.append(summary)
+        summaries.sort(key=lambda s: s.get("started_at", 0), reverse=True)
+        return summaries
+
+    def get(self, capture_id):
+        """Return the summary of a capture, or None if it does not exist."""
+        path = self.path_for(capture_id, "json")
+        if not path:
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def path_for(self, capture_id, kind):
+        """Return the on-disk path of a capture artifact, or None."""
+        if not capture_id.isalnum() or kind not in ("json", "prof"):
+            return None
+        path = self._path(capture_id, kind)
+        return path if os.path.exists(path) else None
+
+    def _path(self, capture_id, kind):
+        return os.path.join(self.directory, f"{capture_id}.{kind}")
+
+    def _capture_names(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [name[:-5] for name in os.listdir(self.directory) if name.endswith(".json")]
+
+    def _trim(self):
+        with self._lock:
+            names = self._capture_names()
+            if len(names) <= self.capacity:
+                return
+            names.sort(key=lambda n: os.path.getmtime(self._path(n, "json")))
+            for name in names[:len(names) - self.capacity]:
+                for kind in ("json", "prof"):
+                    try:
+                        os.remove(self._path(name, kind))
+                    except FileNotFoundError:
+                        pass
+
+    @staticmethod
+    def _top_functions(profiler, limit=25):
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue().splitlines()
+
+
+class RequestProfiler:
+    def __init__(self, store=None, sample_rate=PROFILE_SAMPLE_RATE,
+                 slow_threshold_ms=SLOW_REQUEST_THRESHOLD_MS, secret=PROFILE_SECRET):
+        """
+        Per-request stage timing with sampled cProfile and slow-request capture.
+
+        Stage timings are recorded for every request. cProfile only runs for
+        requests whose `X-Profile` header carries the profiling secret, or
+        for a random sample while the admin toggle is on. A sample rate of 0
+        leaves only those forced requests. Requests slower than the
+        threshold, and every forced request, are saved to the store.
+
+        Args:
+            store (ProfileStore, optional): Where captures are written
+            sample_rate (float): Fraction of requests profiled while enabled
+            slow_threshold_ms (float): Latency above which requests are captured
+            secret (str): X-Profile value that forces profiling; empty
+                disables forcing
+        """
+        self.store = store or ProfileStore()
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self.secret = secret
+        self.enabled = sample_rate > 0
+
+    def configure(self, enabled=None, sample_rate=None, slow_threshold_ms=None):
+        """Update the admin toggle and thresholds at runtime."""
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+        if slow_threshold_ms is not None:
+            self.slow_threshold_ms = float(slow_threshold_ms)
+
+    def settings(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "slow_threshold_ms": self.slow_threshold_ms,
+            "ring_size": self.store.capacity,
+        }
+
+    def init_app(self, app):
+        """Register the request hooks on a Flask app."""
+        from flask import request, g
+
+        @app.before_request
+        def _start_request_record():
+            forced = self._forced(request.headers.get(PROFILE_HEADER))
+            sampled = self.enabled and random.random() < self.sample_rate
+            record = RequestRecord(request.method, request.path, profile=forced or sampled)
+            record.forced = forced
+            g.request_record = record
+            g.request_record_token = _current_record.set(record)
+            record.start()
+
+        @app.after_request
+        def _finish_request_record(response):
+            record = g.get("request_record")
+            if record is None:
+                return response
+
+            record.stop(response.status_code)
+            response.headers["Server-Timing"] = record.server_timing()
+            response.headers["X-Request-Id"] = record.id
+
+            if record.forced or record.duration_ms >= self.slow_threshold_ms:
+                logger.info("Capturing profile for %s %s (%.0f ms)", record.method, record.path, record.duration_ms)
+                self.store.save(record)
+
+            return response
+
+        @app.teardown_request
+        def _reset_request_record(exc=None):
+            token = g.pop("request_record_token", None)
+            if token is not None:
+                _current_record.reset(token)
+
+    def _forced(self, value):
+        if not self.secret or not value:
+            return False
+        return hmac.compare_digest(value.encode("utf-8"), self.secret.encode("utf-8"))
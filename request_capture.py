@@ -0,0 +1,244 @@
+"""
+Opt-in capture of anonymized request shapes and timings.
+
+Each captured /chat, /chat/batch, /upload-image, /analyze-image and
+/analyze-images request becomes one JSON line holding its size and
+structure (message lengths, conversation depth, batch size, retrieval hits,
+image count, mode and sizes), its stage timings and the latency of every
+upstream model call. Texts, file names and addresses are never
+written; callers are only told apart by a hash salted per process, so
+captures cannot be linked to clients or across restarts.
+
+benchmarks/replay.py replays a capture against any build with a stubbed
+upstream that answers with the recorded latencies.
+"""
+import os
+import json
+import uuid
+import hashlib
+import logging
+import random
+import threading
+
+from admission import client_id
+from image_previews import Image
+
+logger = logging.getLogger(__name__)
+
+# Capture from startup; it can also be switched at runtime with POST /admin/capture
+REQUEST_CAPTURE = os.environ.get("REQUEST_CAPTURE", "0").lower() in ("1", "true", "yes")
+REQUEST_CAPTURE_DIR = os.environ.get("REQUEST_CAPTURE_DIR", "captures")
+REQUEST_CAPTURE_SAMPLE_RATE = float(os.environ.get("REQUEST_CAPTURE_SAMPLE_RATE", "1"))
+# A capture file reaching this size is renamed to <name>.1, replacing the previous one
+REQUEST_CAPTURE_MAX_BYTES = int(os.environ.get("REQUEST_CAPTURE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+CAPTURE_FILENAME = "requests.{pid}.jsonl"
+CAPTURE_VERSION = 1
+# Flask endpoint -> captured path
+CAPTURED_ENDPOINTS = {
+    "chat": "/chat",
+    "chat_batch": "/chat/batch",
+    "upload_image": "/upload-image",
+    "analyze_image": "/analyze-image",
+    "analyze_images": "/analyze-images",
+}
+
+
+def _text_shape(text):
+    text = text if isinstance(text, str) else ""
+    return {"chars": len(text), "words": len(text.split())}
+
+
+def _conversation_shape(conversation):
+    if not isinstance(conversation, list):
+        conversation = []
+    return {
+        "depth": len(conversation),
+        "chars": sum(len(str(message.get("content") or "")) for message in conversation if isinstance(message, dict)),
+    }
+
+
+def _category_shape(category):
+    return None if not category else "auto" if category == "auto" else "fixed"
+
+
+def _image_shape(source, size, filename):
+    shape = {"bytes": size, "type": os.path.splitext(filename)[1].lstrip(".").lower()}
+    if Image is not None:
+        try:
+            # Only reads the header
+            with Image.open(source) as image:
+                shape["width"], shape["height"] = image.size
+                shape["mode"] = image.mode
+        except (OSError, ValueError):
+            pass
+    return shape
+
+
+def _uploaded_image_shape(upload_folder, filename):
+    path = os.path.join(upload_folder, os.path.basename(filename)) if isinstance(filename, str) else None
+    return _image_shape(path, os.path.getsize(path), path) if path and os.path.isfile(path) else None
+
+
+class RequestCapture:
+    def __init__(self, directory=REQUEST_CAPTURE_DIR, enabled=REQUEST_CAPTURE,
+                 sample_rate=REQUEST_CAPTURE_SAMPLE_RATE, max_bytes=REQUEST_CAPTURE_MAX_BYTES):
+        """
+        Write the shape and timings of sampled requests as JSON lines.
+
+        Timings come from the request's RequestRecord: its duration, stage
+        totals and the attributes service modules attach with
+        profiler.annotate(), such as retrieval hits and the latency of each
+        upstream call. Records are written from a teardown hook, after the
+        response has been handed to the server. Each process writes its own
+        file, requests.<pid>.jsonl.
+
+        Args:
+            directory (str): Directory for the capture files
+            enabled (bool): Whether capturing starts switched on
+            sample_rate (float): Fraction of requests captured
+            max_bytes (int): Size at which a capture file is rotated
+        """
+        self.directory = directory
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.path = None
+        self._salt = uuid.uuid4().bytes
+        self._file = None
+        self._captured = 0
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=None, sample_rate=None):
+        """Update the toggle and sample rate at runtime."""
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = min(max(float(sample_rate), 0.0), 1.0)
+
+    def settings(self):
+        return {
+            "enabled": self.enabled,
+            "sample_rate": self.sample_rate,
+            "path": self.path,
+            "captured": self._captured,
+        }
+
+    def init_app(self, app):
+        """Register the capture hook; RequestProfiler.init_app must have been called first."""
+        from flask import request, g, current_app
+
+        @app.teardown_request
+        def _capture_request(exc=None):
+            record = g.get("request_record")
+            if (not self.enabled or record is None or record.duration_ms is None
+                    or request.endpoint not in CAPTURED_ENDPOINTS
+                    or random.random() >= self.sample_rate):
+                return
+            try:
+                entry = self.entry(request.endpoint, record, request, current_app.config["UPLOAD_FOLDER"])
+                self.write(entry)
+            except Exception as e:
+                logger.error("Error capturing request: %s", e)
+
+    def entry(self, endpoint, record, request, upload_folder):
+        """Build the anonymized capture line of a finished request."""
+        attributes = record.attributes
+        shape = {}
+        data = request.get_json(silent=True) if request.is_json else None
+        data = data if isinstance(data, dict) else {}
+        if endpoint == "chat":
+            shape = {
+                "message": _text_shape(data.get("message")),
+                "conversation": _conversation_shape(data.get("conversation")),
+                "category": _category_shape(data.get("category")),
+                "retrieval_hits": attributes.get("retrieval_hits"),
+                "retrieval_categories": attributes.get("retrieval_categories"),
+            }
+        elif endpoint == "chat_batch":
+            messages = data.get("messages")
+            messages = messages if isinstance(messages, list) else []
+            items = []
+            for item in messages:
+                item = {"message": item} if isinstance(item, str) else item if isinstance(item, dict) else {}
+                items.append({
+                    "message": _text_shape(item.get("message")),
+                    "conversation": _conversation_shape(item.get("conversation")),
+                    "category": _category_shape(item.get("category", data.get("category"))),
+                })
+            concurrency = data.get("concurrency")
+            shape = {
+                "batch_size": len(messages),
+                "messages": items,
+                "stream": bool(data.get("stream")),
+                "concurrency": concurrency if isinstance(concurrency, int) else None,
+            }
+        elif endpoint == "analyze_image":
+            question = data.get("question")
+            shape = {
+                "question": None if question is None else _text_shape(question),
+                "conversation": _conversation_shape(data.get("conversation")),
+                "image": _uploaded_image_shape(upload_folder, data.get("filename")),
+                "cache_hit": attributes.get("image_cache_hit"),
+            }
+        elif endpoint == "analyze_images":
+            question = data.get("question")
+            filenames = data.get("filenames")
+            filenames = filenames if isinstance(filenames, list) else []
+            mode = data.get("mode", "combined")
+            shape = {
+                "image_count": len(filenames),
+                "mode": mode if mode in ("combined", "each") else None,
+                "question": None if question is None else _text_shape(question),
+                "conversation": _conversation_shape(data.get("conversation")),
+                "images": [_uploaded_image_shape(upload_folder, filename) for filename in filenames],
+                # "combined" answers every image from the cache or none; "each" counts the images it answered
+                "cache_hit": attributes.get("image_cache_hit") if mode != "each" else None,
+                "cache_hits": attributes.get("image_cache_hits") if mode == "each" else None,
+            }
+        elif endpoint == "upload_image":
+            upload = request.files.get("image")
+            if upload is not None:
+                stream = upload.stream
+                size = stream.seek(0, os.SEEK_END)
+                stream.seek(0)
+                shape = _image_shape(stream, size, upload.filename or "")
+
+        return {
+            "v": CAPTURE_VERSION,
+            "endpoint": CAPTURED_ENDPOINTS[endpoint],
+            "t": round(record.started_at, 3),
+            "client": self._client(),
+            "status": record.status,
+            "duration_ms": round(record.duration_ms, 1),
+            "stages": {name: round(ms, 1) for name, ms in record.stage_totals().items()},
+            "upstream_ms": attributes.get("upstream_ms", []),
+            "shape": shape,
+        }
+
+    def write(self, entry):
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                # Named when first written, so every forked worker has its own file
+                self.path = os.path.join(self.directory, CAPTURE_FILENAME.format(pid=os.getpid()))
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            self._captured += 1
+            if self._file.tell() >= self.max_bytes:
+                self._file.close()
+                os.replace(self.path, self.path + ".1")
+                self._file = None
+                logger.info("Rotated request capture %s", self.path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _client(self):
+        return hashlib.blake2b(client_id().encode("utf-8"), key=self._salt, digest_size=6).hexdigest()
+
@@ -0,0 +1,159 @@
+import os
+import logging
+import threading
+
+from azure_clients import get_settings
+from text_processing import normalize
+from upstream import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+# Smaller model for easy questions; routing is off when unset
+FAST_MODEL_NAME = os.environ.get("AZURE_FAST_MODEL_NAME", "")
+# Share of the best possible keyword score the top document must reach
+ROUTER_MIN_CONFIDENCE = float(os.environ.get("ROUTER_MIN_CONFIDENCE", "0.5"))
+# The top document must beat the runner-up by this fraction of its score
+ROUTER_MIN_MARGIN = float(os.environ.get("ROUTER_MIN_MARGIN", "0.25"))
+ROUTER_MAX_CONTEXT_CHARS = int(os.environ.get("ROUTER_MAX_CONTEXT_CHARS", "1500"))
+ROUTER_MAX_QUESTION_CHARS = int(os.environ.get("ROUTER_MAX_QUESTION_CHARS", "400"))
+
+# A query term scores 3 for a title match plus 1 for a content match
+MAX_TERM_SCORE = 4
+
+
+class Route:
+    __slots__ = ("name", "model", "reason", "confidence")
+
+    def __init__(self, name, model, reason, confidence=None):
+        """
+        The model chosen for one question.
+
+        Args:
+            name (str): "fast" or "full"
+            model (str): Model name sent upstream
+            reason (str): Why this route was taken
+            confidence (float, optional): Retrieval confidence of the question
+        """
+        self.name = name
+        self.model = model
+        self.reason = reason
+        self.confidence = confidence
+
+    def upstream_kind(self, kind):
+        """Latency class for upstream deadlines, kept apart per model."""
+        return kind if self.name == "full" else f"{kind}_{self.name}"
+
+    def __repr__(self):
+        return f"Route(name={self.name!r}, model={self.model!r}, reason={self.reason!r})"
+
+
+class ModelRouter:
+    def __init__(self, fast_model=FAST_MODEL_NAME, min_confidence=ROUTER_MIN_CONFIDENCE,
+                 min_margin=ROUTER_MIN_MARGIN, max_context_chars=ROUTER_MAX_CONTEXT_CHARS,
+                 max_question_chars=ROUTER_MAX_QUESTION_CHARS):
+        """
+        Send easy questions to a fast model and everything else to the full one.
+
+        A question goes to the fast model only when the knowledge base
+        answers it confidently: the top document covers at least
+        min_confidence of the best possible keyword score and clearly beats
+        the runner-up, the question is short and the conversation context is
+        small. Questions without retrieval, long conversations and images
+        always use the full model.
+
+        Args:
+            fast_model (str): Fast model name; empty disables routing
+            min_confidence (float): Minimum top-document confidence (0-1)
+            min_margin (float): Minimum lead of the top document over the second
+            max_context_chars (int): Longest conversation context for the fast route
+            max_question_chars (int): Longest question for the fast route
+        """
+        self.fast_model = fast_model
+        self.min_confidence = min_confidence
+        self.min_margin = min_margin
+        self.max_context_chars = max_context_chars
+        self.max_question_chars = max_question_chars
+
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._counts = {}
+
+    def choose(self, question, relevant_docs=None, context=None, image=False):
+        """
+        Pick the route for a question.
+
+        Args:
+            question (str): The user's question
+            relevant_docs (list, optional): Retrieved SearchResults; None when
+                the question was not run through retrieval
+            context (str, optional): Previous conversation context
+            image (bool): Whether the question is about an image
+
+        Returns:
+            Route: The chosen route
+        """
+        if image:
+            return self.full("image")
+        if relevant_docs is None:
+            return self.full("no_retrieval")
+
+        confidence = self.confidence(question, relevant_docs)
+        if not self.fast_model:
+            return self.full("routing_disabled", confidence)
+        if context and len(context) > self.max_context_chars:
+            return self.full("long_context", confidence)
+        if len(question) > self.max_question_chars:
+            return self.full("long_question", confidence)
+        if confidence < self.min_confidence:
+            return self.full("low_confidence", confidence)
+
+        top = max(relevant_docs, key=lambda doc: doc.score)
+        # Copies of the top document do not make the question ambiguous
+        runner_up = max((doc.score for doc in relevant_docs if doc.title != top.title), default=0)
+        if top.score - runner_up < self.min_margin * top.score:
+            return self.full("ambiguous", confidence)
+        return Route("fast", self.fast_model, "confident", confidence)
+
+    @staticmethod
+    def confidence(question, relevant_docs):
+        """Score of the top document as a share of what a perfect match would score."""
+        terms = set(normalize(question))
+        if not terms or not relevant_docs:
+            return 0.0
+        top = max(doc.score for doc in relevant_docs)
+        return min(top / (MAX_TERM_SCORE * len(terms)), 1.0)
+
+    def record(self, route, seconds):
+        """Record the upstream latency of a routed call."""
+        key = (route.name, route.reason)
+        with self._lock:
+            tracker = self._latencies.get(route.name)
+            if tracker is None:
+                tracker = self._latencies[route.name] = LatencyTracker()
+            self._counts[key] = self._counts.get(key, 0) + 1
+        tracker.record(seconds)
+        logger.info("Routed to %s model %s (%s) in %.0f ms", route.name, route.model, route.reason, seconds * 1000)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+            latencies = dict(self._latencies)
+        routes = {}
+        for (name, reason), count in counts.items():
+            route = routes.setdefault(name, {"requests": 0, "reasons": {}})
+            route["requests"] += count
+            route["reasons"][reason] = count
+        for name, tracker in latencies.items():
+            routes[name].update({
+                "p50_ms": round(tracker.percentile(50) * 1000, 1),
+                "p95_ms": round(tracker.percentile(95) * 1000, 1),
+            })
+        return {"fast_model": self.fast_model or None, "min_confidence": self.min_confidence, "routes": routes}
+
+    @staticmethod
+    def full(reason, confidence=None):
+        """Return the full-model route, e.g. to escalate after the fast model failed."""
+        return Route("full", get_settings()["chat_model_name"], reason, confidence)
+
+
+router = ModelRouter()
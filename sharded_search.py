@@ -0,0 +1,326 @@
+"""
+Keyword search scattered over worker processes.
+
+The knowledge base's postings are split into shards by document index
+(document i belongs to shard i % shards) and copied into one shared memory
+block per shard in CSR form: for every term id, a sorted slice of local
+document numbers for the title and one for the content. Within a shard the
+documents are numbered category by category, so each category is one range
+of local numbers, and a query restricted to some categories only scores
+the part of each slice that falls in their ranges. Worker processes attach the
+blocks by name, so the postings exist once in memory however many workers
+read them, and score their shard with numpy outside the parent's GIL. The
+parent keeps the term dictionary, corrects and encodes each query, sends it
+to every shard and merges the per-shard top candidates.
+"""
+import os
+import heapq
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Seconds without further changes before the shards are rebuilt after documents
+# were added, edited or deleted; searches run in-process until then
+SHARD_REBUILD_DELAY = float(os.environ.get("SHARD_REBUILD_DELAY", "2"))
+
+TITLE_WEIGHT = 3
+CONTENT_WEIGHT = 1
+_NO_CATEGORY = 0
+
+# Worker side: build id -> list of (SharedMemory, arrays) per shard
+_attached = {}
+
+
+def _attach(build_id, name, layout):
+    blocks = _attached.get(build_id)
+    if blocks is None:
+        # A new build replaces the previous one; release its mappings
+        for old in list(_attached):
+            for block, arrays in _attached.pop(old).values():
+                arrays.clear()
+                block.close()
+        blocks = _attached[build_id] = {}
+    entry = blocks.get(name)
+    if entry is None:
+        block = shared_memory.SharedMemory(name=name)
+        arrays = [np.ndarray((count,), dtype=dtype, buffer=block.buf, offset=offset)
+                  for offset, dtype, count in layout]
+        entry = blocks[name] = (block, arrays)
+    return entry[1]
+
+
+def _search_shard(build_id, name, layout, queries, limit):
+    """Score every query against one shard; runs in a worker process."""
+    title_offsets, title_postings, content_offsets, content_postings, doc_map, bounds = _attach(build_id, name, layout)
+    fields = ((title_offsets, title_postings, TITLE_WEIGHT), (content_offsets, content_postings, CONTENT_WEIGHT))
+    results = []
+    for term_ids, category_ids in queries:
+        if category_ids is None:
+            ranges = [(0, len(doc_map))]
+        else:
+            ranges = [(int(bounds[category_id]), int(bounds[category_id + 1]))
+                      for category_id in sorted(set(category_ids))]
+            ranges = [(start, end) for start, end in ranges if start < end]
+        scores = np.zeros(len(doc_map), dtype=np.int32)
+        for term_id in term_ids:
+            for offsets, postings, weight in fields:
+                entries = postings[offsets[term_id]:offsets[term_id + 1]]
+                if category_ids is None:
+                    # A document appears at most once in a term's postings, so fancy indexing adds exactly once
+                    scores[entries] += weight
+                    continue
+                for start, end in ranges:
+                    scores[entries[np.searchsorted(entries, start):np.searchsorted(entries, end)]] += weight
+
+        local = np.concatenate([np.flatnonzero(scores[start:end]) + start for start, end in ranges]) \
+            if ranges else np.zeros(0, dtype=np.int64)
+        matched = scores[local].astype(np.int64)
+        doc_indices = doc_map[local].astype(np.int64)
+        # Highest score first, then lowest document index, as in-process ranking does
+        keys = (matched << 32) - doc_indices
+        if limit is not None and len(keys) > limit:
+            top = np.argpartition(-keys, limit)[:limit]
+            keys, doc_indices, matched = keys[top], doc_indices[top], matched[top]
+        order = np.argsort(-keys, kind="stable")
+        results.append(list(zip(doc_indices[order].tolist(), matched[order].tolist())))
+    return results
+
+
+def _ready():
+    return os.getpid()
+
+
+class ShardedSearch:
+    def __init__(self, shards):
+        """
+        Score keyword queries in parallel over worker processes.
+
+        build() snapshots the knowledge base's postings into shared memory;
+        search() then returns each query's top candidates as (document
+        index, score) pairs, ranked exactly like the in-process search.
+        The snapshot belongs to one generation of the knowledge base: after
+        documents change, search() returns None until build() has run
+        again, so callers fall back to the in-process index.
+
+        If a worker dies, the pool cannot run anything again: search()
+        raises BrokenProcessPool once and returns None from then on, and
+        the next build() starts a new pool.
+
+        Args:
+            shards (int): Number of shards and worker processes
+        """
+        self.shards = shards
+        self.generation = None
+        self._vocabulary = {}
+        self._categories = {}
+        self._blocks = []
+        self._layouts = []
+        self._build_id = 0
+        self._executor = None
+        self._timer = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def build(self, partitions, documents, generation):
+        """
+        Copy the postings into new shared memory blocks.
+
+        The caller must keep the documents and partitions from changing
+        while this runs. Searches keep using the previous blocks until the
+        new ones are in place.
+
+        Args:
+            partitions (dict): The knowledge base's category partitions
+            documents (list): Its documents, in index order
+            generation (int): Its change counter; searches with another
+                generation are refused
+        """
+        vocabulary = {}
+        fields = {}
+        for field in ("title", "content"):
+            term_ids, lengths, postings = [], [], []
+            for partition in partitions.values():
+                for term, entries in partition[field].items():
+                    term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                    lengths.append(len(entries))
+                    postings.append(np.frombuffer(entries, dtype=np.dtype(f"u{entries.itemsize}")))
+            terms = np.repeat(np.array(term_ids, dtype=np.int64), np.array(lengths, dtype=np.int64))
+            docs = np.concatenate(postings).astype(np.int64) if postings else np.zeros(0, dtype=np.int64)
+            order = np.argsort(terms, kind="stable")
+            fields[field] = (terms[order], docs[order])
+
+        categories = {}
+        document_categories = np.fromiter(
+            (_NO_CATEGORY if doc.category is None else
+             categories.setdefault(doc.category.lower(), len(categories) + 1) for doc in documents),
+            dtype=np.int16, count=len(documents))
+
+        blocks, layouts = [], []
+        try:
+            for shard in range(self.shards):
+                # Number the shard's documents category by category; bounds[c]
+                # is where category id c starts
+                shard_categories = document_categories[shard::self.shards]
+                order = np.argsort(shard_categories, kind="stable")
+                position = np.empty(len(order), dtype=np.int64)
+                position[order] = np.arange(len(order))
+                bounds = np.zeros(len(categories) + 2, dtype=np.int64)
+                np.cumsum(np.bincount(shard_categories, minlength=len(categories) + 1), out=bounds[1:])
+
+                arrays = []
+                for field in ("title", "content"):
+                    terms, docs = fields[field]
+                    mine = docs % self.shards == shard
+                    terms, local = terms[mine], position[docs[mine] // self.shards]
+                    by_term = np.lexsort((local, terms))
+                    counts = np.bincount(terms, minlength=len(vocabulary))
+                    offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+                    np.cumsum(counts, out=offsets[1:])
+                    arrays += [offsets, local[by_term].astype(np.uint32)]
+                arrays += [(order * self.shards + shard).astype(np.uint32), bounds]
+                block, layout = self._copy_to_shared_memory(arrays)
+                blocks.append(block)
+                layouts.append(layout)
+        except Exception:
+            for block in blocks:
+                block.close()
+                block.unlink()
+            raise
+
+        with self._lock:
+            if self._closed:
+                for block in blocks:
+                    block.close()
+                    block.unlink()
+                return
+            old_blocks = self._blocks
+            self._vocabulary = vocabulary
+            self._categories = categories
+            self._blocks = blocks
+            self._layouts = layouts
+            self._build_id += 1
+            self.generation = generation
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.shards, mp_context=_context())
+                # Start every worker now rather than on a request thread
+                for future in [self._executor.submit(_ready) for _ in range(self.shards)]:
+                    future.result()
+        # Workers still mapping the old blocks keep them until they switch
+        for block in old_blocks:
+            block.close()
+            block.unlink()
+        logger.info("Built %s search shards over %s documents and %s terms",
+                    self.shards, len(documents), len(vocabulary))
+
+    def search(self, queries, limit, generation):
+        """
+        Rank documents for several queries on all shards at once.
+
+        Args:
+            queries (list): (terms, categories) per query; terms are
+                corrected index terms, categories a list of names or None
+            limit (int): Candidates per query, or None for every match
+            generation (int): The knowledge base's current change counter
+
+        Returns:
+            list: Per query, (document index, score) pairs best first; None
+            when the shards are out of date
+        """
+        with self._lock:
+            if generation != self.generation or self._executor is None:
+                return None
+            vocabulary, categories = self._vocabulary, self._categories
+            build_id, blocks, layouts = self._build_id, self._blocks, self._layouts
+            executor = self._executor
+
+        encoded = []
+        for terms, selected in queries:
+            term_ids = [vocabulary[term] for term in terms if term in vocabulary]
+            if selected is not None:
+                if isinstance(selected, str):
+                    selected = [selected]
+                selected = [categories[name.lower()] for name in selected if name and name.lower() in categories]
+            encoded.append((term_ids, selected))
+
+        try:
+            futures = [executor.submit(_search_shard, build_id, block.name, layout, encoded, limit)
+                       for block, layout in zip(blocks, layouts)]
+            per_shard = [future.result() for future in futures]
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+        results = []
+        for position in range(len(queries)):
+            merged = heapq.merge(*(ranked[position] for ranked in per_shard), key=lambda item: (-item[1], item[0]))
+            results.append(list(merged) if limit is None else [item for _, item in zip(range(limit), merged)])
+        return results
+
+    def schedule_rebuild(self, rebuild, delay=SHARD_REBUILD_DELAY):
+        """Run rebuild once no change has been scheduled for delay seconds."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, rebuild)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _discard(self, executor):
+        # Stop using a broken pool; the blocks stay until build() replaces them
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.generation = None
+        logger.error("A search shard worker died; the shards are disabled until they are rebuilt")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            if self._timer is not None:
+                self._timer.cancel()
+            executor, self._executor = self._executor, None
+            blocks, self._blocks = self._blocks, []
+            self.generation = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    @staticmethod
+    def _copy_to_shared_memory(arrays):
+        layout = []
+        offset = 0
+        for array in arrays:
+            # Keep every array aligned to its item size
+            offset = -(-offset // array.itemsize) * array.itemsize
+            layout.append((offset, array.dtype.str, len(array)))
+            offset += array.nbytes
+        block = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for array, (start, dtype, count) in zip(arrays, layout):
+            np.ndarray((count,), dtype=dtype, buffer=block.buf, offset=start)[:] = array
+        return block, layout
+
+
+def _context():
+    # fork starts workers without re-importing the app, which would load the
+    # knowledge base again in every worker; spawn and forkserver both import
+    # the main module in each worker. The parent has other threads by the time
+    # workers start (log listener, preview pool, rebuild timers), and a fork
+    # copies any lock they hold as held. A worker only runs the executor's
+    # loop and _search_shard: it reads its call queue, attaches shared memory
+    # and scores with numpy, and never logs or touches those threads' locks;
+    # the interpreter resets the GIL, import lock and logging locks on fork.
+    # Other platforms need spawn.
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context("spawn")
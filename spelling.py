@@ -0,0 +1,128 @@
+def trigrams(term):
+    """Return the set of character trigrams of a term padded with '$'."""
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_edits(term):
+    """Edit distance tolerated when correcting a term of this length."""
+    if len(term) <= 4:
+        return 0
+    if len(term) <= 7:
+        return 1
+    return 2
+
+
+def bounded_levenshtein(a, b, limit):
+    """
+    Compute the Levenshtein distance between a and b, giving up past limit.
+
+    Only the diagonal band of width 2 * limit + 1 is evaluated, and the
+    computation stops as soon as every cell in a row exceeds the limit.
+
+    Args:
+        a (str): First string
+        b (str): Second string
+        limit (int): Largest distance of interest
+
+    Returns:
+        int: The distance, or None if it is greater than limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return None
+    if a == b:
+        return 0
+
+    too_far = limit + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        low = max(1, i - limit)
+        high = min(len(b), i + limit)
+        current = [too_far] * (len(b) + 1)
+        if low == 1:
+            current[0] = i
+        row_min = current[0] if low == 1 else too_far
+        for j in range(low, high + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return None
+        previous = current
+
+    distance = previous[len(b)]
+    return distance if distance <= limit else None
+
+
+class TrigramIndex:
+    def __init__(self):
+        """
+        Character trigram index over a vocabulary of index terms.
+
+        Used to turn misspelled query terms into candidate corrections: the
+        trigram overlap cheaply filters the vocabulary, and a bounded edit
+        distance check confirms each candidate.
+        """
+        self._grams = {}
+        self._terms = set()
+
+    def __contains__(self, term):
+        return term in self._terms
+
+    def __len__(self):
+        return len(self._terms)
+
+    def add(self, term):
+        if term in self._terms:
+            return
+        self._terms.add(term)
+        for gram in trigrams(term):
+            self._grams.setdefault(gram, set()).add(term)
+
+    def remove(self, term):
+        if term not in self._terms:
+            return
+        self._terms.discard(term)
+        for gram in trigrams(term):
+            terms = self._grams.get(gram)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self._grams[gram]
+
+    def corrections(self, term, limit=None):
+        """
+        Find vocabulary terms within the tolerated edit distance of term.
+
+        Args:
+            term (str): A normalized term that is not in the vocabulary
+            limit (int, optional): Maximum edit distance; defaults to max_edits(term)
+
+        Returns:
+            list: (candidate, distance) tuples, closest first
+        """
+        limit = max_edits(term) if limit is None else limit
+        if limit <= 0:
+            return []
+
+        grams = trigrams(term)
+        # A single edit destroys at most three padded trigrams
+        required = max(len(grams) - 3 * limit, 1)
+
+        overlap = {}
+        for gram in grams:
+            for candidate in self._grams.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+
+        matches = []
+        for candidate, shared in overlap.items():
+            if shared < required:
+                continue
+            distance = bounded_levenshtein(term, candidate, limit)
+            if distance is not None:
+                matches.append((candidate, distance))
+
+        matches.sort(key=lambda match: match[1])
+        return matches
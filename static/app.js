@@ -4,6 +4,11 @@ const state = {
     conversation: []
 };
 
+const SUGGEST_DEBOUNCE_MS = 150;
+const SUGGEST_MIN_CHARS = 2;
+const SUGGEST_CACHE_SIZE = 200;
+const suggestionCache = new Map();
+
 document.addEventListener('DOMContentLoaded', function() {
     const chatForm = document.querySelector('.chat-form');
     const chatInput = document.querySelector('.chat-input');
@@ -23,6 +28,7 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     setupImageUpload();
+    setupSuggestions();
 
     chatInput.addEventListener('input', function() {
         sendButton.disabled = chatInput.value.trim() === '';
@@ -44,6 +50,7 @@ function setupImageUpload() {
     const fileInput = document.createElement('input');
     fileInput.type = 'file';
     fileInput.accept = 'image/png, image/jpeg, image/jpg';
+    fileInput.multiple = true;
     fileInput.style.display = 'none';
     fileInput.id = 'image-upload';
 
@@ -57,10 +64,78 @@ function setupImageUpload() {
     });
 
     fileInput.addEventListener('change', function(e) {
-        if (e.target.files.length > 0) {
-            const file = e.target.files[0];
-            uploadImage(file);
+        const files = Array.from(e.target.files);
+        if (files.length === 1) {
+            uploadImage(files[0]);
+        } else if (files.length > 1) {
+            uploadImages(files);
+        }
+        fileInput.value = '';
+    });
+}
+
+function setupSuggestions() {
+    const chatInput = document.querySelector('.chat-input');
+    const datalist = document.getElementById('condition-suggestions');
+    if (!datalist) return;
+
+    let debounceTimer = null;
+    let latestPrefix = '';
+
+    chatInput.addEventListener('input', function() {
+        clearTimeout(debounceTimer);
+
+        // Only the last word is completed, so suggestions follow the user mid-sentence
+        const text = chatInput.value;
+        const lastWordStart = text.lastIndexOf(' ') + 1;
+        const prefix = text.slice(lastWordStart).trim().toLowerCase();
+        const head = text.slice(0, lastWordStart);
+
+        if (prefix.length < SUGGEST_MIN_CHARS) {
+            datalist.innerHTML = '';
+            return;
         }
+
+        latestPrefix = prefix;
+        debounceTimer = setTimeout(() => {
+            fetchSuggestions(prefix).then(suggestions => {
+                if (prefix !== latestPrefix) return;
+                renderSuggestions(datalist, head, suggestions);
+            });
+        }, SUGGEST_DEBOUNCE_MS);
+    });
+}
+
+function fetchSuggestions(prefix) {
+    if (suggestionCache.has(prefix)) {
+        return Promise.resolve(suggestionCache.get(prefix));
+    }
+
+    return fetch(`/suggest?q=${encodeURIComponent(prefix)}`)
+        .then(handleResponse)
+        .then(data => {
+            const suggestions = data.suggestions || [];
+            if (suggestionCache.size >= SUGGEST_CACHE_SIZE) {
+                suggestionCache.delete(suggestionCache.keys().next().value);
+            }
+            suggestionCache.set(prefix, suggestions);
+            return suggestions;
+        })
+        .catch(error => {
+            console.error('Suggestion error:', error);
+            return [];
+        });
+}
+
+function renderSuggestions(datalist, head, suggestions) {
+    datalist.innerHTML = '';
+    suggestions.forEach(suggestion => {
+        const option = document.createElement('option');
+        option.value = head + suggestion.text;
+        if (suggestion.kind === 'title') {
+            option.label = 'Guideline';
+        }
+        datalist.appendChild(option);
     });
 }
 
@@ -195,7 +270,7 @@ function uploadImage(file) {
 
             sendImageAnalysisRequest("Please analyze this medical image.");
 
-            showImagePreview(URL.createObjectURL(file));
+            showImagePreview(URL.createObjectURL(file), data.previews);
         } else {
             loadingElement.remove();
             showMessage(`Upload failed: ${data.error}`, 'assistant');
@@ -211,6 +286,76 @@ function uploadImage(file) {
     });
 }
 
+function uploadImages(files) {
+    state.isProcessing = true;
+
+    const loadingElement = showMessage('', 'assistant', true);
+    loadingElement.innerHTML = `<div class="typing-indicator"><span></span><span></span><span></span></div> Uploading ${files.length} images...`;
+
+    const uploads = files.map(file => {
+        const formData = new FormData();
+        formData.append('image', file);
+        return fetch('/upload-image', { method: 'POST', body: formData })
+            .then(handleResponse)
+            .then(data => {
+                if (!data.success) {
+                    throw new Error(data.error);
+                }
+                return data;
+            });
+    });
+
+    Promise.all(uploads)
+    .then(results => {
+        loadingElement.remove();
+        results.forEach((data, i) => showImagePreview(URL.createObjectURL(files[i]), data.previews));
+        sendMultiImageAnalysisRequest("Please analyze these medical images together.",
+                                      results.map(data => data.filename));
+    })
+    .catch(error => {
+        loadingElement.remove();
+        showMessage(`Error uploading images. Please try again.`, 'assistant');
+        console.error('Error:', error);
+        state.isProcessing = false;
+    });
+}
+
+function sendMultiImageAnalysisRequest(message, filenames) {
+    showMessage(message, 'user');
+
+    const loadingElement = showMessage('', 'assistant', true);
+    loadingElement.innerHTML = `<div class="typing-indicator"><span></span><span></span><span></span></div> Analyzing ${filenames.length} images...`;
+
+    fetch('/analyze-images', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({
+            filenames: filenames,
+            question: message,
+            conversation: getConversationHistory()
+        })
+    })
+    .then(handleResponse)
+    .then(data => {
+        loadingElement.remove();
+
+        if (data.error) {
+            showMessage(`Analysis failed: ${data.error}`, 'assistant');
+        } else {
+            showMessageWithTyping(data.response, 'assistant');
+        }
+        state.isProcessing = false;
+    })
+    .catch(error => {
+        loadingElement.remove();
+        showMessage(`Error analyzing images. Please try again.`, 'assistant');
+        console.error('Error:', error);
+        state.isProcessing = false;
+    });
+}
+
 function sendImageAnalysisRequest(message) {
     showMessage(message, 'user');
 
@@ -262,12 +407,20 @@ function handleResponse(response) {
     return response.json();
 }
 
-function showImagePreview(imageUrl) {
+function showImagePreview(imageUrl, previews) {
     const messageContainer = document.createElement('div');
     messageContainer.className = 'message user';
 
+    // Server-side previews are a fraction of the upload's size; fall back to the local file
+    const thumbUrl = previews && previews.thumb ? previews.thumb : imageUrl;
+    const largeUrl = previews && previews.medium ? previews.medium : imageUrl;
+
     const imgElement = document.createElement('img');
-    imgElement.src = imageUrl;
+    imgElement.src = thumbUrl;
+    imgElement.onerror = () => {
+        imgElement.onerror = null;
+        imgElement.src = imageUrl;
+    };
     imgElement.className = 'chat-image-preview';
     imgElement.alt = 'Uploaded medical image';
     imgElement.loading = 'lazy';
@@ -278,7 +431,11 @@ function showImagePreview(imageUrl) {
         lightbox.onclick = () => document.body.removeChild(lightbox);
 
         const lightboxImg = document.createElement('img');
-        lightboxImg.src = imageUrl;
+        lightboxImg.src = largeUrl;
+        lightboxImg.onerror = () => {
+            lightboxImg.onerror = null;
+            lightboxImg.src = imageUrl;
+        };
         lightboxImg.style.maxHeight = '90vh';
         lightboxImg.style.maxWidth = '90vw';
         lightboxImg.style.borderRadius = '8px';
@@ -0,0 +1,140 @@
+import re
+import threading
+from bisect import bisect_left
+
+from text_processing import STOPWORDS
+
+WORD_PATTERN = re.compile(r"[a-z]+(?:['\-][a-z]+)*")
+WORD_START_PATTERN = re.compile(r"(?:^|(?<=\s))\S")
+
+TITLE_WEIGHT = 10
+MIN_TERM_LENGTH = 4
+MAX_SCAN = 2000
+
+
+class SuggestionIndex:
+    def __init__(self):
+        """
+        Prefix index over document titles and frequent content words.
+
+        Keys are kept in a sorted list so a prefix lookup is a binary search
+        followed by a short scan. Titles are indexed from the start of each
+        of their words, so "frac" also finds "Vertebral Compression Fracture".
+        Entries are ranked by popularity: how many documents contributed them,
+        with titles weighted above content words.
+
+        New keys are buffered and merged into the sorted list on the next
+        lookup (one linear Timsort merge per batch instead of an insertion per
+        key); keys whose count drops to zero are skipped and compacted away.
+
+        Adding and removing documents must be serialized by the caller, but
+        lookups may run concurrently with each other: the merge takes a
+        small lock of its own and swaps in a new sorted list, so a lookup
+        never sees one half sorted.
+        """
+        self._keys = []
+        self._entries = {}
+        self._pending = []
+        self._stale = 0
+        self._merge_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add_document(self, title, content):
+        """Register a document's title and content words."""
+        self._add_title(title, 1)
+
+        # Content words are the bulk of the keys, so _add is inlined here
+        entries = self._entries
+        for word in self._content_words(content):
+            entry = entries.get(word)
+            if entry is None:
+                entries[word] = (word, "term", 1)
+                self._pending.append(word)
+            else:
+                entries[word] = (word, "term", entry[2] + 1)
+
+    def remove_document(self, title, content):
+        """Undo add_document for a document that is being removed or replaced."""
+        self._add_title(title, -1)
+        for word in self._content_words(content):
+            self._add(word, word, "term", -1)
+
+    def suggest(self, prefix, limit=8):
+        """
+        Return the most popular completions of prefix.
+
+        Args:
+            prefix (str): What the user has typed so far
+            limit (int): Maximum number of suggestions
+
+        Returns:
+            list: dicts with "text" and "kind" ("title" or "term")
+        """
+        prefix = " ".join(prefix.lower().split())
+        if not prefix:
+            return []
+
+        keys = self._merge_pending()
+
+        matches = {}
+        start = bisect_left(keys, prefix)
+        for key in keys[start:start + MAX_SCAN]:
+            if not key.startswith(prefix):
+                break
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            label, kind, count = entry
+            weight = count * TITLE_WEIGHT if kind == "title" else count
+            if weight > matches.get((label, kind), 0):
+                matches[(label, kind)] = weight
+
+        ranked = sorted(matches.items(), key=lambda item: (-item[1], len(item[0][0]), item[0][0]))
+        return [{"text": label, "kind": kind} for (label, kind), _ in ranked[:limit]]
+
+    def _add_title(self, title, delta):
+        lowered = " ".join(title.lower().split())
+        for match in WORD_START_PATTERN.finditer(lowered):
+            self._add(lowered[match.start():], title, "title", delta)
+
+    def _add(self, key, label, kind, delta):
+        # Different titles can share a suffix; the label keeps sorted keys unique
+        full_key = f"{key}\x00{label}" if kind == "title" else key
+        entry = self._entries.get(full_key)
+        if entry is None:
+            if delta <= 0:
+                return
+            self._entries[full_key] = (label, kind, delta)
+            self._pending.append(full_key)
+            return
+
+        count = entry[2] + delta
+        if count > 0:
+            self._entries[full_key] = (label, kind, count)
+        else:
+            del self._entries[full_key]
+            self._stale += 1
+
+    def _merge_pending(self):
+        # Returns the sorted keys to search
+        if not self._pending and self._stale <= len(self._entries):
+            return self._keys
+        with self._merge_lock:
+            if self._stale > len(self._entries):
+                self._keys = sorted(self._entries)
+                self._pending = []
+                self._stale = 0
+            elif self._pending:
+                # Keys removed and re-added may appear twice; lookups dedupe by label
+                keys = self._keys + [key for key in self._pending if key in self._entries]
+                keys.sort()
+                self._keys = keys
+                self._pending = []
+            return self._keys
+
+    @staticmethod
+    def _content_words(content):
+        words = set(WORD_PATTERN.findall(content.lower())).difference(STOPWORDS)
+        return [word for word in words if len(word) >= MIN_TERM_LENGTH]
@@ -0,0 +1,37 @@
+import os
+import sys
+import json
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+SEED_DOCUMENTS = {
+    "gout": {
+        "title": "Gout Management Guidelines",
+        "content": "Acute gout flares are treated with colchicine or NSAIDs. Long term urate lowering uses allopurinol.",
+        "category": "Rheumatology",
+    },
+    "asthma": {
+        "title": "Asthma Inhaler Technique",
+        "content": "Patients should exhale fully, seal the lips around the mouthpiece and inhale slowly while pressing.",
+        "category": "Pulmonology",
+    },
+    "migraine": {
+        "title": "Migraine Prevention",
+        "content": "Propranolol, topiramate and amitriptyline reduce migraine frequency. Keep a headache diary.",
+        "category": "Neurology",
+    },
+}
+
+
+@pytest.fixture
+def knowledge_dir(tmp_path):
+    """A knowledge directory holding a few seed documents."""
+    directory = tmp_path / "knowledge"
+    directory.mkdir()
+    for doc_id, document in SEED_DOCUMENTS.items():
+        (directory / f"{doc_id}.json").write_text(json.dumps(document))
+    return str(directory)
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+from admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.001)
+
+
+def test_token_bucket_refills_at_its_rate():
+    bucket = TokenBucket(rate=2, burst=4)
+    start = bucket.updated
+    for _ in range(4):
+        assert bucket.take(now=start) == 0
+    assert bucket.take(now=start) == pytest.approx(0.5)
+    assert bucket.take(now=start + 0.5) == 0
+    assert bucket.take(cost=5, now=start + 10) == float("inf")
+
+
+def test_rate_limit_rejects_with_429_and_refunds_the_other_bucket():
+    controller = AdmissionController(global_rate=100, global_burst=100, client_rate=1, client_burst=2)
+    controller.charge("alice")
+    controller.charge("alice")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.charge("alice")
+    assert rejected.value.status == 429
+    assert 0 < rejected.value.retry_after <= 1
+    assert rejected.value.retry_after_header() == "1"
+    # The global bucket had room; the rejected request must not have used it up
+    assert controller._global_bucket.tokens == pytest.approx(98, abs=0.1)
+    # Other clients have their own bucket
+    controller.charge("bob")
+
+
+def test_rejected_batch_refunds_its_admission_token():
+    controller = AdmissionController(client_rate=0.001, client_burst=5)
+    controller.charge("alice")
+    with pytest.raises(ValueError):
+        controller.charge_batch("alice", 6)
+    assert controller._client_buckets["alice"].tokens == pytest.approx(5)
+
+    controller.charge("alice")
+    controller.charge_batch("alice", 3)
+    assert controller._client_buckets["alice"].tokens == pytest.approx(2)
+
+    controller.charge("alice")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.charge_batch("alice", 3)
+    assert rejected.value.status == 429
+    assert controller._client_buckets["alice"].tokens == pytest.approx(2)
+
+
+def test_waiters_are_served_by_lane_then_arrival():
+    controller = AdmissionController(max_concurrency=1, queue_size=10)
+    held = controller.acquire("chat")
+    order = []
+
+    def wait(lane, name):
+        acquired_at = controller.acquire(lane, timeout=10)
+        order.append(name)
+        controller.release(acquired_at)
+
+    threads = []
+    for lane, name in (("batch", "batch"), ("image", "image 1"), ("chat", "chat"), ("image", "image 2")):
+        thread = threading.Thread(target=wait, args=(lane, name))
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: controller._waiting == len(threads))
+
+    controller.release(held)
+    for thread in threads:
+        thread.join(5)
+    assert order == ["chat", "image 1", "image 2", "batch"]
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_full_queue_and_queue_timeout_reject_with_503():
+    controller = AdmissionController(max_concurrency=1, queue_size=1)
+    held = controller.acquire("chat")
+
+    with pytest.raises(AdmissionRejected) as timed_out:
+        controller.acquire("chat", timeout=0.01)
+    assert timed_out.value.status == 503
+
+    waiter = threading.Thread(target=lambda: pytest.raises(AdmissionRejected, controller.acquire, "batch", 0.5))
+    waiter.start()
+    _wait_for(lambda: controller._waiting == 1)
+    with pytest.raises(AdmissionRejected) as full:
+        controller.acquire("chat")
+    assert full.value.status == 503
+    assert full.value.retry_after > 0
+    waiter.join()
+
+    controller.release(held)
+    stats = controller.stats()
+    assert (stats["queue_full"], stats["queue_timeout"], stats["in_flight"]) == (1, 2, 0)
+
+
+def test_app_rejections_carry_retry_after():
+    app = Flask(__name__)
+    controller = AdmissionController(max_concurrency=1, queue_size=0, client_rate=0.001, client_burst=2,
+                                     lane_timeouts={"chat": 0.01})
+    controller.init_app(app, lanes={"chat": "chat"})
+
+    @app.route("/chat")
+    def chat():
+        return jsonify({"response": "ok"})
+
+    client = app.test_client()
+    assert client.get("/chat").status_code == 200
+
+    held = controller.acquire("chat")
+    saturated = client.get("/chat")
+    controller.release(held)
+    assert saturated.status_code == 503
+    assert int(saturated.headers["Retry-After"]) >= 1
+
+    limited = client.get("/chat")
+    assert limited.status_code == 429
+    assert int(limited.headers["Retry-After"]) >= 1
+    assert limited.get_json() == {"error": "Too many requests"}
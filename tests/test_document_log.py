@@ -0,0 +1,212 @@
+import os
+import threading
+
+from document_log import LOG_FILENAME, SNAPSHOT_FILENAME, DocumentLog, encode_record
+
+
+def _replay(directory, seed_ids=(), **kwargs):
+    log = DocumentLog(directory, **kwargs)
+    records = list(log.replay(seed_ids))
+    return log, records
+
+
+def _document(title):
+    return {"title": title, "content": f"{title} content", "category": None}
+
+
+def test_replay_returns_latest_record_per_document(tmp_path):
+    log, records = _replay(str(tmp_path))
+    assert records == []
+    log.put("a", _document("first"))
+    log.put("b", _document("second"))
+    log.put("a", _document("first, edited"))
+    log.delete("b")
+    log.close()
+
+    log, records = _replay(str(tmp_path))
+    log.close()
+    by_id = {record["id"]: record for record in records}
+    assert by_id["a"]["op"] == "put"
+    assert by_id["a"]["title"] == "first, edited"
+    assert by_id["b"] == {"op": "delete", "id": "b"}
+
+
+def test_torn_tail_is_dropped_and_truncated(tmp_path):
+    log, _ = _replay(str(tmp_path))
+    log.put("a", _document("kept"))
+    log.close()
+    path = os.path.join(str(tmp_path), LOG_FILENAME)
+    intact = os.path.getsize(path)
+    with open(path, "ab") as f:
+        f.write(encode_record(dict(_document("torn"), op="put", id="b"))[:-7])
+
+    log, records = _replay(str(tmp_path))
+    assert [record["id"] for record in records] == ["a"]
+    assert os.path.getsize(path) == intact
+
+    # New records start on a clean line after the truncation
+    log.put("c", _document("after"))
+    log.close()
+    log, records = _replay(str(tmp_path))
+    log.close()
+    assert sorted(record["id"] for record in records) == ["a", "c"]
+
+
+def test_damaged_record_is_skipped(tmp_path):
+    log, _ = _replay(str(tmp_path))
+    log.put("a", _document("first"))
+    log.put("b", _document("second"))
+    log.close()
+    path = os.path.join(str(tmp_path), LOG_FILENAME)
+    with open(path, "r+b") as f:
+        # Flip a byte inside the first record's payload
+        f.seek(20)
+        byte = f.read(1)
+        f.seek(20)
+        f.write(bytes([byte[0] ^ 0x01]))
+
+    log, records = _replay(str(tmp_path))
+    log.close()
+    assert [record["id"] for record in records] == ["b"]
+
+
+def test_compaction_folds_log_into_snapshot(tmp_path):
+    directory = str(tmp_path)
+    log, _ = _replay(directory, seed_ids={"seed"}, compact_bytes=10 ** 9)
+    log.put("a", _document("first"))
+    log.put("a", _document("first, edited"))
+    log.put("b", _document("removed"))
+    log.delete("b")
+    log.delete("seed")
+    log.compact()
+
+    assert os.path.exists(os.path.join(directory, SNAPSHOT_FILENAME))
+    assert os.path.getsize(os.path.join(directory, LOG_FILENAME)) == 0
+    assert not os.path.exists(os.path.join(directory, LOG_FILENAME + ".old"))
+
+    log.put("c", _document("after compaction"))
+    log.close()
+
+    log, records = _replay(directory, seed_ids={"seed"})
+    log.close()
+    by_id = {record["id"]: record for record in records}
+    assert by_id["a"]["title"] == "first, edited"
+    assert by_id["c"]["title"] == "after compaction"
+    # Deletes are only kept for seed documents, which the log must keep hiding
+    assert by_id["seed"]["op"] == "delete"
+    assert "b" not in by_id
+
+
+def test_compaction_resumes_after_crash_between_rotate_and_snapshot(tmp_path):
+    directory = str(tmp_path)
+    log, _ = _replay(directory)
+    log.put("a", _document("first"))
+    log.put("b", _document("second"))
+    log.close()
+    # A compaction that died after renaming the log aside
+    os.replace(os.path.join(directory, LOG_FILENAME), os.path.join(directory, LOG_FILENAME + ".old"))
+
+    log, records = _replay(directory)
+    log.close()
+    assert sorted(record["id"] for record in records) == ["a", "b"]
+    assert not os.path.exists(os.path.join(directory, LOG_FILENAME + ".old"))
+
+    log, records = _replay(directory)
+    log.close()
+    assert sorted(record["id"] for record in records) == ["a", "b"]
+
+
+def test_log_is_compacted_once_it_passes_the_threshold(tmp_path):
+    directory = str(tmp_path)
+    log, _ = _replay(directory, compact_bytes=2000)
+    for number in range(40):
+        log.put(f"doc{number % 5}", _document(f"version {number}"))
+    for thread in threading.enumerate():
+        if thread.name == "document-log-compact":
+            thread.join()
+    log.close()
+
+    log, records = _replay(directory)
+    log.close()
+    assert os.path.exists(os.path.join(directory, SNAPSHOT_FILENAME))
+    assert {record["id"]: record["title"] for record in records} == {
+        f"doc{number}": f"version {35 + number}" for number in range(5)
+    }
+
+
+def test_entries_stay_readable_across_compaction(tmp_path):
+    log, _ = _replay(str(tmp_path))
+    first = log.put("a", _document("first"))
+    second = log.put("a", _document("second"))
+    kept = log.put("b", _document("kept"))
+    log.compact()
+    log.compact()
+
+    # The replaced record is gone from the files but its entry still reads it
+    assert first.read()["title"] == "first"
+    assert second.read()["title"] == "second"
+    assert kept.read()["title"] == "kept"
+    assert kept.location[0].path == os.path.join(str(tmp_path), SNAPSHOT_FILENAME)
+    assert log.entry("a") is second
+    log.close()
+
+
+def test_processes_sharing_the_log_point_at_their_own_records(tmp_path):
+    # Two logs on one directory stand in for two worker processes
+    first, _ = _replay(str(tmp_path))
+    second, _ = _replay(str(tmp_path))
+    x = first.put("x", _document("A"))
+    y = second.put("y", _document("B"))
+    z = first.put("z", _document("C"))
+
+    assert x.read()["title"] == "A"
+    assert y.read()["title"] == "B"
+    assert z.read()["title"] == "C"
+    first.close()
+    second.close()
+
+    log, records = _replay(str(tmp_path))
+    log.close()
+    assert sorted(record["id"] for record in records) == ["x", "y", "z"]
+
+
+def test_entry_of_another_document_reads_as_damaged(tmp_path):
+    log, _ = _replay(str(tmp_path))
+    entry = log.put("x", _document("A"))
+    entry.id = "y"
+    assert entry.read() is None
+    log.close()
+
+
+def test_compaction_keeps_other_processes_records(tmp_path):
+    first, _ = _replay(str(tmp_path))
+    second, _ = _replay(str(tmp_path))
+    first.put("x", _document("A"))
+    y = second.put("y", _document("B"))
+    first.compact()
+
+    # The second log still had the rotated file open; it moves to the new log
+    z = second.put("z", _document("C"))
+    assert y.read()["title"] == "B"
+    assert z.read()["title"] == "C"
+    assert not os.path.exists(os.path.join(str(tmp_path), LOG_FILENAME + ".old"))
+    first.close()
+    second.close()
+
+    log, records = _replay(str(tmp_path))
+    log.close()
+    assert sorted(record["id"] for record in records) == ["x", "y", "z"]
+
+
+def test_only_one_process_compacts_at_a_time(tmp_path):
+    first, _ = _replay(str(tmp_path))
+    second, _ = _replay(str(tmp_path))
+    first.put("x", _document("A"))
+    with second._locked(second._compact_lock):
+        # Another process is compacting: this one leaves the files alone
+        first.compact()
+        assert os.path.getsize(os.path.join(str(tmp_path), LOG_FILENAME)) > 0
+    first.compact()
+    assert os.path.getsize(os.path.join(str(tmp_path), LOG_FILENAME)) == 0
+    first.close()
+    second.close()
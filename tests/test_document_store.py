@@ -0,0 +1,58 @@
+import os
+import json
+
+from document_store import DocumentStore, build_store, seed_version
+from knowledge_base import AzureKnowledgeBase
+
+
+def _data_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".dat"))
+
+
+def test_workers_share_one_data_file(knowledge_dir):
+    first = DocumentStore(knowledge_dir)
+    second = DocumentStore(knowledge_dir)
+    assert first.path == second.path
+    assert _data_files(knowledge_dir) == [os.path.basename(first.path)]
+
+    documents = {doc_id: (title, first.read(offset, length))
+                 for doc_id, title, _, offset, length in first.documents()}
+    assert documents["gout"][0] == "Gout Management Guidelines"
+    assert documents["gout"][1].startswith("Acute gout flares")
+    first.close()
+    second.close()
+
+
+def test_changed_seed_files_get_a_new_version(knowledge_dir):
+    old = build_store(knowledge_dir)
+    version = seed_version(knowledge_dir)
+    with open(os.path.join(knowledge_dir, "gout.json"), "w") as f:
+        json.dump({"title": "Gout", "content": "Rewritten guidance.", "category": "Rheumatology"}, f)
+    os.utime(os.path.join(knowledge_dir, "gout.json"), ns=(1, 1))
+
+    assert seed_version(knowledge_dir) != version
+    store = DocumentStore(knowledge_dir)
+    assert store.path != old
+    assert _data_files(knowledge_dir) == [os.path.basename(store.path)]
+    assert {doc_id: title for doc_id, title, *_ in store.documents()}["gout"] == "Gout"
+    store.close()
+
+
+def test_edits_go_to_the_log_not_the_data_file(knowledge_dir):
+    kb = AzureKnowledgeBase(data_path=knowledge_dir, storage="disk", shards=0)
+    data_file = kb._store.path
+    size = os.path.getsize(data_file)
+    assert kb.add_document("Psoriasis Topical Therapy", "Topical corticosteroids.", "Dermatology")
+    kb.update_document("gout", content="Febuxostat lowers urate.")
+    kb._log.compact()
+
+    assert os.path.getsize(data_file) == size
+    assert _data_files(knowledge_dir) == [os.path.basename(data_file)]
+    assert kb.get_document("gout").content == "Febuxostat lowers urate."
+    assert [result.content for result in kb.search("psoriasis corticosteroids", 1)] == ["Topical corticosteroids."]
+    kb.close()
+
+    kb = AzureKnowledgeBase(data_path=knowledge_dir, storage="disk", shards=0)
+    assert kb._store.path == data_file
+    assert kb.get_document("gout").content == "Febuxostat lowers urate."
+    kb.close()
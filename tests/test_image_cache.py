@@ -0,0 +1,65 @@
+import shutil
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+from PIL import ImageDraw, ImageFilter
+
+from image_cache import ImageAnalysisCache
+
+
+@pytest.fixture
+def images(tmp_path):
+    """A synthetic scan, a byte copy, resized and recompressed copies and one with a small marking."""
+    scan = Image.new("L", (300, 200))
+    draw = ImageDraw.Draw(scan)
+    for x in range(0, 300, 20):
+        draw.rectangle((x, 0, x + 9, 199), fill=40 + x // 3)
+    draw.ellipse((120, 60, 200, 140), fill=180)
+    # Scans have soft edges; hard ones would alias differently at every size
+    scan = scan.filter(ImageFilter.GaussianBlur(4))
+    paths = {name: str(tmp_path / name) for name in ("scan.png", "copy.png", "small.png", "scan.jpg", "marked.png")}
+    scan.save(paths["scan.png"])
+    shutil.copy(paths["scan.png"], paths["copy.png"])
+    scan.resize((240, 160), Image.LANCZOS).save(paths["small.png"])
+    scan.save(paths["scan.jpg"], quality=70)
+    marked = scan.copy()
+    ImageDraw.Draw(marked).ellipse((60, 96, 68, 104), fill=255)
+    marked.save(paths["marked.png"])
+    return paths
+
+
+def _lookup(cache, path, question="What is this?", client="alice"):
+    return cache.get([cache.fingerprint(path)], question, client)
+
+
+def test_exact_matches_only_identical_files(images):
+    cache = ImageAnalysisCache(match="exact")
+    cache.put([cache.fingerprint(images["scan.png"])], "What is this", "answer", "alice")
+    assert _lookup(cache, images["copy.png"]) == "answer"
+    for name in ("small.png", "scan.jpg", "marked.png"):
+        assert _lookup(cache, images[name]) is None
+
+
+def test_similar_confirms_pixels(images):
+    cache = ImageAnalysisCache(match="similar")
+    cache.put([cache.fingerprint(images["scan.png"])], "What is this", "answer", "alice")
+    assert _lookup(cache, images["small.png"]) == "answer"
+    assert _lookup(cache, images["scan.jpg"]) == "answer"
+    assert _lookup(cache, images["marked.png"]) is None
+
+
+def test_answers_are_not_shared_across_clients(images):
+    cache = ImageAnalysisCache(match="exact")
+    cache.put([cache.fingerprint(images["scan.png"])], "What is this", "answer", "alice")
+    assert _lookup(cache, images["scan.png"], client="bob") is None
+    assert _lookup(cache, images["scan.png"], question="Is it broken?") is None
+    assert cache.stats()["hits"] == 0
+
+
+def test_capacity_evicts_least_recently_used(images):
+    cache = ImageAnalysisCache(match="exact", capacity=1)
+    cache.put([cache.fingerprint(images["scan.png"])], "first", "one", "alice")
+    cache.put([cache.fingerprint(images["scan.png"])], "second", "two", "alice")
+    assert _lookup(cache, images["scan.png"], question="first") is None
+    assert _lookup(cache, images["scan.png"], question="second") == "two"
@@ -0,0 +1,301 @@
+import os
+import random
+import string
+import sys
+import threading
+import time
+
+import pytest
+
+from knowledge_base import AzureKnowledgeBase
+from text_processing import normalize
+
+
+@pytest.fixture(params=["memory", "disk"])
+def storage(request):
+    return request.param
+
+
+def _open(knowledge_dir, storage="memory"):
+    return AzureKnowledgeBase(data_path=knowledge_dir, storage=storage, shards=0)
+
+
+def _titles(results):
+    return [result.title for result in results]
+
+
+def test_added_documents_survive_a_restart(knowledge_dir, storage):
+    kb = _open(knowledge_dir, storage)
+    assert kb.add_document("Psoriasis Topical Therapy", "Topical corticosteroids and vitamin D analogues.",
+                           "Dermatology")
+    counts = kb.add_documents([
+        {"title": "Shingles Antivirals", "content": "Valacyclovir within 72 hours of rash onset."},
+        {"title": "", "content": "rejected"},
+    ])
+    assert counts == {"added": 1, "merged": 0, "rejected": 1}
+    kb.close()
+
+    kb = _open(knowledge_dir, storage)
+    assert len(kb.documents) == 5
+    assert _titles(kb.search("psoriasis corticosteroids", 1)) == ["Psoriasis Topical Therapy"]
+    assert _titles(kb.search("valacyclovir", 1)) == ["Shingles Antivirals"]
+    kb.close()
+
+
+def test_failed_log_write_leaves_document_out(knowledge_dir, monkeypatch):
+    kb = _open(knowledge_dir)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(kb._log, "put", fail)
+    assert kb.add_document("Psoriasis Topical Therapy", "Topical corticosteroids and vitamin D analogues.") is False
+    counts = kb.add_documents([{"title": "Shingles Antivirals", "content": "Valacyclovir within 72 hours."}])
+    assert counts == {"added": 0, "merged": 0, "rejected": 1}
+
+    assert len(kb.documents) == 3
+    assert "Psoriasis Topical Therapy" not in _titles(kb.search("psoriasis corticosteroids", 3))
+    assert "Shingles Antivirals" not in _titles(kb.search("valacyclovir", 3))
+    kb.close()
+
+
+def test_failed_sync_rolls_the_document_back(knowledge_dir, monkeypatch):
+    kb = _open(knowledge_dir)
+
+    def fail():
+        raise OSError("fsync failed")
+
+    monkeypatch.setattr(kb._log, "sync", fail)
+    assert kb.add_document("Psoriasis Topical Therapy", "Topical corticosteroids and vitamin D analogues.") is False
+    counts = kb.add_documents([{"title": "Shingles Antivirals", "content": "Valacyclovir within 72 hours."}])
+    assert counts == {"added": 0, "merged": 0, "rejected": 1}
+    assert sorted(kb._ids) == ["asthma", "gout", "migraine"]
+    assert "Psoriasis Topical Therapy" not in _titles(kb.search("psoriasis corticosteroids", 3))
+    monkeypatch.undo()
+    kb.close()
+
+    # The rollback recorded deletes, so the records do not come back either
+    kb = _open(knowledge_dir)
+    assert sorted(kb._ids) == ["asthma", "gout", "migraine"]
+    kb.close()
+
+
+def _index_state(kb):
+    partitions = {
+        category: {field: {term: list(entries) for term, entries in partition[field].items()}
+                   if field != "docs" else list(partition["docs"])
+                   for field in ("docs", "title", "content")}
+        for category, partition in kb._partitions.items()
+    }
+    clusters = {frozenset([kept, *copies]) for kept, copies in kb._dedup.clusters().items()}
+    return {
+        "partitions": partitions,
+        "spelling": set(kb._spelling._terms),
+        "suggestions": dict(kb.suggestions._entries),
+        "clusters": clusters,
+        "ids": dict(kb._ids),
+    }
+
+
+def test_update_replaces_title_content_and_category(knowledge_dir, storage):
+    kb = _open(knowledge_dir, storage)
+    doc = kb.update_document("gout", content="Febuxostat lowers urate when allopurinol is not tolerated.",
+                             category="Endocrinology")
+    assert doc.title == "Gout Management Guidelines"
+    assert _titles(kb.search("febuxostat", 1)) == ["Gout Management Guidelines"]
+    assert "Gout Management Guidelines" not in _titles(kb.search("colchicine", 3, ["Rheumatology"]))
+    assert kb.categories() == {"Endocrinology": 1, "Pulmonology": 1, "Neurology": 1}
+    assert kb.update_document("missing", title="Nothing") is None
+    kb.close()
+
+    kb = _open(knowledge_dir, storage)
+    assert kb.get_document("gout").category == "Endocrinology"
+    assert _titles(kb.search("febuxostat", 1)) == ["Gout Management Guidelines"]
+    kb.close()
+
+
+@pytest.mark.parametrize("doc_id", ["gout", "migraine"])
+def test_delete_renumbers_the_last_document(knowledge_dir, storage, doc_id):
+    kb = _open(knowledge_dir, storage)
+    title = kb.get_document(doc_id).title
+    assert kb.delete_document(doc_id)
+    assert not kb.delete_document(doc_id)
+    assert len(kb.documents) == 2
+    assert title not in _titles(kb.search(title, 3))
+    # Whichever document filled the freed slot is still found under its new index
+    for remaining in ("gout", "asthma", "migraine"):
+        if remaining != doc_id:
+            remaining_title = kb.get_document(remaining).title
+            assert _titles(kb.search(remaining_title, 1)) == [remaining_title]
+    kb.close()
+
+    kb = _open(knowledge_dir, storage)
+    assert kb.get_document(doc_id) is None
+    assert len(kb.documents) == 2
+    kb.close()
+
+
+def test_edits_leave_the_index_as_a_rebuild_would(knowledge_dir):
+    rng = random.Random(7)
+    words = ["fever", "rash", "cough", "insulin", "statin", "biopsy", "stent", "asthma", "migraine", "urate"]
+    categories = ["Cardiology", "Dermatology", None]
+    kb = _open(knowledge_dir)
+
+    def text():
+        return " ".join(rng.choice(words) for _ in range(6))
+
+    for step in range(300):
+        ids = list(kb._ids)
+        action = rng.random()
+        if action < 0.4 or len(ids) < 3:
+            content = kb.get_document(rng.choice(ids)).content if ids and rng.random() < 0.2 else text()
+            kb.add_document(f"Note {step} {text()}", content, rng.choice(categories))
+        elif action < 0.7:
+            kb.update_document(rng.choice(ids), title=f"Note {step} {text()}",
+                               content=text() if rng.random() < 0.7 else None,
+                               category=rng.choice(categories + [""]))
+        else:
+            kb.delete_document(rng.choice(ids))
+
+        if step % 50 == 49:
+            edited = _index_state(kb)
+            kb.build_index()
+            assert edited == _index_state(kb)
+            assert all(kb._ids[doc.id] == position for position, doc in enumerate(kb.documents))
+    kb.close()
+
+
+@pytest.fixture
+def frequent_thread_switches():
+    """Switch threads often, so a search lands in the middle of an edit."""
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-5)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_searches_during_deletes_return_the_right_documents(knowledge_dir, caplog, frequent_thread_switches):
+    rng = random.Random(3)
+    kb = _open(knowledge_dir)
+    tokens = {}
+    for position in range(300):
+        token = "".join(rng.choice(string.ascii_lowercase) for _ in range(12))
+        kb.add_document(f"Entry {position}", f"{token} filler text", "Cardiology")
+        tokens[token] = f"Entry {position}"
+
+    stop = threading.Event()
+    failures = []
+
+    def search():
+        while not stop.is_set():
+            token = rng.choice(list(tokens))
+            for result in kb.search(token, 1, ["Cardiology"]):
+                if result.score and result.title != tokens[token]:
+                    failures.append((token, result.title))
+            kb.infer_categories(token)
+
+    searchers = [threading.Thread(target=search) for _ in range(4)]
+    for thread in searchers:
+        thread.start()
+    try:
+        for doc_id in rng.sample([doc_id for doc_id in kb._ids if len(doc_id) == 32], 250):
+            kb.delete_document(doc_id)
+    finally:
+        stop.set()
+        for thread in searchers:
+            thread.join()
+    kb.close()
+
+    assert failures == []
+    assert "Error performing keyword search" not in caplog.text
+
+
+def test_suggestions_do_not_wait_for_searches(knowledge_dir, frequent_thread_switches):
+    kb = _open(knowledge_dir)
+    kb.add_document("Psoriasis Topical Therapy", "Topical corticosteroids.", "Dermatology")
+    searching = threading.Event()
+    done = threading.Event()
+
+    def search():
+        # Holds the read side like a search in progress
+        with kb._lock.reading():
+            searching.set()
+            done.wait(30)
+
+    thread = threading.Thread(target=search)
+    thread.start()
+    searching.wait(5)
+    results = []
+    lookups = [threading.Thread(target=lambda: results.append(kb.suggest("pso"))) for _ in range(8)]
+    for lookup in lookups:
+        lookup.start()
+    deadline = time.monotonic() + 2
+    for lookup in lookups:
+        lookup.join(max(deadline - time.monotonic(), 0))
+    finished = len(results)
+    done.set()
+    thread.join()
+    kb.close()
+
+    assert finished == 8
+    assert all(result[0]["text"] == "Psoriasis Topical Therapy" for result in results)
+
+
+def test_sharded_search_ranks_like_in_process_search(knowledge_dir, caplog):
+    pytest.importorskip("numpy")
+    rng = random.Random(5)
+    words = ["".join(rng.choice(string.ascii_lowercase) for _ in range(7)) for _ in range(40)]
+    categories = ["Cardiology", "Dermatology", "Neurology", None]
+    documents = [{"title": f"{rng.choice(words)} {rng.choice(words)} {position}",
+                  "content": " ".join(rng.choices(words, k=12)),
+                  "category": rng.choice(categories)} for position in range(400)]
+
+    results = {}
+    for shards in (0, 3):
+        kb = AzureKnowledgeBase(data_path=knowledge_dir, shards=shards)
+        kb.add_documents(documents)
+        if shards:
+            kb._build_shards()
+            assert kb._sharded.generation == kb._generation
+        results[shards] = [
+            _titles(kb.search(f"{words[position]} {words[position + 1]}", 5, selected))
+            for position in range(0, 30, 3)
+            for selected in (None, ["Dermatology"], ["cardiology", "Neurology"], ["Unknown"])
+        ]
+        kb.close()
+    assert results[3] == results[0]
+    assert "searching in-process" not in caplog.text
+
+
+def test_sharded_search_falls_back_when_a_worker_dies(knowledge_dir):
+    pytest.importorskip("numpy")
+    import signal
+    from types import SimpleNamespace
+
+    kb = AzureKnowledgeBase(data_path=knowledge_dir, shards=2)
+    sharded = kb._sharded
+    assert _titles(kb.search("colchicine", 1)) == ["Gout Management Guidelines"]
+
+    # A rebuild removed the blocks before the workers attached them
+    blocks = sharded._blocks
+    sharded._blocks = [SimpleNamespace(name=f"missing-{block.name}") for block in blocks]
+    assert _titles(kb.search("topiramate", 1)) == ["Migraine Prevention"]
+    sharded._blocks = blocks
+
+    executor = sharded._executor
+    worker = next(iter(executor._processes.values()))
+    os.kill(worker.pid, signal.SIGKILL)
+    worker.join()
+    # Until the pool notices, the other worker may still serve every shard
+    deadline = time.monotonic() + 5
+    while not executor._broken and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert _titles(kb.search("colchicine", 1)) == ["Gout Management Guidelines"]
+    assert sharded._executor is None and sharded._timer is not None
+    assert _titles(kb.search_batch(["inhale", "propranolol"], 1)[1]) == ["Migraine Prevention"]
+
+    sharded._timer.cancel()
+    kb._build_shards()
+    assert sharded.generation == kb._generation
+    assert sharded.search([(normalize("colchicine"), None)], 1, kb._generation) == [[(kb._ids["gout"], 1)]]
+    kb.close()
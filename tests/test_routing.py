@@ -0,0 +1,60 @@
+import pytest
+
+import routing
+from documents import Document, SearchResult
+from routing import ModelRouter
+
+# Two query terms, so a perfect match scores 8
+QUESTION = "gout flare"
+
+
+def _results(*scores):
+    return [SearchResult(Document(f"Document {i}", "content"), score) for i, score in enumerate(scores)]
+
+
+@pytest.fixture
+def router(monkeypatch):
+    monkeypatch.setattr(routing, "get_settings", lambda: {"chat_model_name": "full-model"})
+    return ModelRouter(fast_model="fast-model", min_confidence=0.5, min_margin=0.25,
+                       max_context_chars=100, max_question_chars=50)
+
+
+def test_confident_question_takes_the_fast_route(router):
+    route = router.choose(QUESTION, _results(6, 2))
+    assert (route.name, route.model, route.reason) == ("fast", "fast-model", "confident")
+    assert route.confidence == pytest.approx(0.75)
+    assert route.upstream_kind("chat") == "chat_fast"
+
+
+def test_confidence_threshold(router):
+    assert router.choose(QUESTION, _results(4)).reason == "confident"
+    low = router.choose(QUESTION, _results(3.9))
+    assert (low.name, low.model, low.reason) == ("full", "full-model", "low_confidence")
+    assert low.upstream_kind("chat") == "chat"
+    assert router.choose("the", _results(8)).reason == "low_confidence"
+    assert router.choose(QUESTION, []).reason == "low_confidence"
+    # Scores above a perfect match do not push confidence past 1
+    assert router.choose(QUESTION, _results(20)).confidence == 1.0
+
+
+def test_margin_threshold(router):
+    assert router.choose(QUESTION, _results(8, 6)).reason == "confident"
+    assert router.choose(QUESTION, _results(8, 6.1)).reason == "ambiguous"
+    # A second copy of the top document does not count as a runner-up
+    top = _results(8)[0]
+    assert router.choose(QUESTION, [top, SearchResult(top.document, 8)]).reason == "confident"
+
+
+def test_length_limits(router):
+    assert router.choose(QUESTION, _results(8), context="x" * 100).reason == "confident"
+    assert router.choose(QUESTION, _results(8), context="x" * 101).reason == "long_context"
+    assert router.choose(QUESTION.ljust(50), _results(8)).reason == "confident"
+    assert router.choose(QUESTION.ljust(51), _results(8)).reason == "long_question"
+
+
+def test_images_unretrieved_questions_and_disabled_routing_use_the_full_model(router):
+    assert router.choose(QUESTION, _results(8), image=True).reason == "image"
+    assert router.choose(QUESTION, None).reason == "no_retrieval"
+    router.fast_model = ""
+    disabled = router.choose(QUESTION, _results(8))
+    assert (disabled.name, disabled.reason, disabled.confidence) == ("full", "routing_disabled", 1.0)
@@ -0,0 +1,39 @@
+from text_processing import normalize, stem, unique_terms
+
+
+def test_normalize_lowercases_drops_possessives_and_stopwords():
+    assert normalize("The patient's GOUT") == ["patient", "gout"]
+    assert normalize("Golfer’s elbow") == normalize("golfers elbow")
+    assert normalize("It is what it is") == []
+    assert normalize("acute-on-chronic, 2nd") == ["acut", "chron", "2nd"]
+
+
+def test_stem_maps_inflections_to_one_term():
+    assert len({stem(word) for word in ("fracture", "fractured", "fractures")}) == 1
+    assert stem("colchicine") == "colchicin"
+    assert stem("running") == "run"
+    assert stem("glasses") == "glass"
+    # Words too short to stem, with a protected ending, or not purely alphabetic are kept as they are
+    assert stem("gout") == "gout"
+    assert stem("arthritis") == "arthritis"
+    assert stem("t2dm") == "t2dm"
+
+
+def test_phrase_synonyms_prefer_the_longest_phrase():
+    assert normalize("heart attack") == ["myocardial", "infarction"]
+    assert normalize("high blood pressure") == ["hypertension"]
+    assert normalize("blood sugar") == ["glucos"]
+    assert normalize("slipped disk") == normalize("slipped disc") == ["disc", "herni"]
+    # A phrase start that is not followed by the rest of the phrase is left alone
+    assert normalize("heart failure") == ["heart", "failur"]
+
+
+def test_abbreviations_expand_to_the_same_terms_as_their_full_form():
+    assert normalize("mi") == normalize("myocardial infarction")
+    assert normalize("HTN") == normalize("hypertension")
+    assert normalize("copd flare") == normalize("chronic obstructive pulmonary disease flare")
+    assert normalize("type 2 dm") == ["type", "2", "diabet", "mellitus"]
+
+
+def test_unique_terms_keeps_first_occurrence_order():
+    assert unique_terms("gout flare gout flares") == ("gout", "flar")
@@ -0,0 +1,86 @@
+import pytest
+
+import upstream
+from upstream import MIN_SAMPLES, UpstreamCaller
+
+
+class ServiceResponseTimeoutError(Exception):
+    """Named like the Azure SDK's read timeout, which UpstreamCaller recognizes by name."""
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeClient:
+    def __init__(self, clock, latency):
+        """Chat client whose calls take latency seconds of the fake clock, or time out at their deadline."""
+        self.clock = clock
+        self.latency = latency
+        self.deadlines = []
+
+    def complete(self, timeout, read_timeout, retry_read, **kwargs):
+        self.deadlines.append(timeout)
+        if self.latency > timeout:
+            self.clock.now += timeout
+            raise ServiceResponseTimeoutError(f"No response within {timeout} s")
+        self.clock.now += self.latency
+        return "response"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    clock = FakeClock()
+    fake = FakeClient(clock, latency=0.5)
+    monkeypatch.setattr(upstream, "time", clock)
+    monkeypatch.setattr(upstream, "get_chat_client", lambda: fake)
+    return fake
+
+
+def test_deadline_adapts_to_observed_latency(client):
+    caller = UpstreamCaller(timeout=30, min_timeout=5, max_timeout=60, timeout_multiplier=3)
+    assert caller.deadline("chat") == 30
+
+    for _ in range(MIN_SAMPLES):
+        caller.complete("chat", messages=[])
+    assert caller.deadline("chat") == 5
+
+    client.latency = 4
+    for _ in range(MIN_SAMPLES):
+        caller.complete("chat", messages=[])
+    assert caller.deadline("chat") == pytest.approx(12)
+
+
+def test_deadline_recovers_when_the_upstream_slows_down(client):
+    caller = UpstreamCaller(timeout=30, min_timeout=5, max_timeout=60, timeout_multiplier=3)
+    for _ in range(100):
+        caller.complete("chat", messages=[])
+    assert caller.deadline("chat") == 5
+
+    # Slower than the adaptive deadline but well within the fixed one
+    client.latency = 7
+    failures = 0
+    while True:
+        try:
+            caller.complete("chat", messages=[])
+            break
+        except ServiceResponseTimeoutError:
+            failures += 1
+            assert failures < 10, "the deadline never adapted to the slower upstream"
+
+    assert caller.deadline("chat") > 7
+    assert caller.stats()["timeouts"] == failures
+
+
+def test_deadline_never_exceeds_its_bounds(client):
+    caller = UpstreamCaller(timeout=30, min_timeout=5, max_timeout=60, timeout_multiplier=3)
+    client.latency = 100
+    for _ in range(MIN_SAMPLES):
+        with pytest.raises(ServiceResponseTimeoutError):
+            caller.complete("chat", messages=[])
+    assert client.deadlines[:MIN_SAMPLES] == [30] * MIN_SAMPLES
+    assert caller.deadline("chat") == 60
@@ -0,0 +1,181 @@
+import re
+import sys
+from functools import lru_cache
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+APOSTROPHE_PATTERN = re.compile(r"['\u2019]s\b|['\u2019]")
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are aren as at be because been before
+being below between both but by can cannot cant could did do does doing don dont down during each few for
+from further get gets getting had has have having he her here hers herself him himself his how
+i if in into is isn isnt it its itself just let me more most much my myself no nor not now of off on
+once only or other ought our ours ourselves out over own please same she should so some such
+tell than that the their theirs them themselves then there these they this those through to too
+under until up us very was we were what when where which while who whom why will with would you
+your yours yourself yourselves
+""".split())
+
+# Lay phrases rewritten to the clinical term used in the guidelines
+PHRASE_SYNONYMS = {
+    ("heart", "attack"): ("myocardial", "infarction"),
+    ("high", "blood", "pressure"): ("hypertension",),
+    ("blood", "sugar"): ("glucose",),
+    ("slipped", "disc"): ("disc", "herniation"),
+    ("slipped", "disk"): ("disc", "herniation"),
+    ("frozen", "shoulder"): ("adhesive", "capsulitis"),
+    ("tennis", "elbow"): ("lateral", "epicondylitis"),
+    ("golfer", "elbow"): ("medial", "epicondylitis"),
+    ("golfers", "elbow"): ("medial", "epicondylitis"),
+    ("runner", "knee"): ("patellofemoral", "pain"),
+    ("runners", "knee"): ("patellofemoral", "pain"),
+    ("jumper", "knee"): ("patellar", "tendinopathy"),
+    ("jumpers", "knee"): ("patellar", "tendinopathy"),
+    ("shin", "splints"): ("medial", "tibial", "stress", "syndrome"),
+    ("mini", "stroke"): ("transient", "ischemic", "attack"),
+    ("underactive", "thyroid"): ("hypothyroidism",),
+    ("overactive", "thyroid"): ("hyperthyroidism",),
+}
+
+# Abbreviations expanded to their full form
+ABBREVIATIONS = {
+    "mi": ("myocardial", "infarction"),
+    "ami": ("acute", "myocardial", "infarction"),
+    "htn": ("hypertension",),
+    "bp": ("blood", "pressure"),
+    "dm": ("diabetes", "mellitus"),
+    "t1dm": ("type", "1", "diabetes"),
+    "t2dm": ("type", "2", "diabetes"),
+    "copd": ("chronic", "obstructive", "pulmonary", "disease"),
+    "afib": ("atrial", "fibrillation"),
+    "cad": ("coronary", "artery", "disease"),
+    "chf": ("heart", "failure"),
+    "ckd": ("chronic", "kidney", "disease"),
+    "aki": ("acute", "kidney", "injury"),
+    "ra": ("rheumatoid", "arthritis"),
+    "oa": ("osteoarthritis",),
+    "gerd": ("gastroesophageal", "reflux", "disease"),
+    "ibs": ("irritable", "bowel", "syndrome"),
+    "ibd": ("inflammatory", "bowel", "disease"),
+    "uti": ("urinary", "tract", "infection"),
+    "tia": ("transient", "ischemic", "attack"),
+    "cva": ("stroke",),
+    "dvt": ("deep", "vein", "thrombosis"),
+    "acl": ("anterior", "cruciate", "ligament"),
+    "mcl": ("medial", "collateral", "ligament"),
+    "tmj": ("temporomandibular", "joint"),
+    "tmd": ("temporomandibular", "joint", "disorder"),
+    "cts": ("carpal", "tunnel", "syndrome"),
+    "lbp": ("lower", "back", "pain"),
+    "pfps": ("patellofemoral", "pain", "syndrome"),
+    "hcv": ("hepatitis", "c"),
+    "hbv": ("hepatitis", "b"),
+    "ms": ("multiple", "sclerosis"),
+    "pd": ("parkinson", "disease"),
+    "nsaid": ("nonsteroidal", "anti", "inflammatory"),
+    "nsaids": ("nonsteroidal", "anti", "inflammatory"),
+    "mri": ("magnetic", "resonance", "imaging"),
+    "ct": ("computed", "tomography"),
+}
+
+_SUFFIXES = (
+    ("ational", "ate"), ("ations", ""), ("ation", ""), ("ments", ""), ("ment", ""),
+    ("ness", ""), ("ings", ""), ("ing", ""), ("ical", ""), ("edly", ""), ("ed", ""),
+    ("ies", "y"), ("ally", ""), ("ly", ""), ("ic", ""), ("xes", "x"), ("s", ""),
+)
+_KEEP_ENDINGS = ("ss", "is", "us", "ous")
+_VOWELS = set("aeiouy")
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """
+    Reduce a word to a stem with a small set of English suffix rules.
+
+    This is deliberately lighter than a full Porter stemmer: it only needs
+    to map inflections of the same clinical word ("fracture", "fractured",
+    "fractures") to one index term, and it is applied identically to
+    documents and queries.
+
+    Args:
+        word (str): A lowercased token
+
+    Returns:
+        str: The stem
+    """
+    if len(word) <= 3 or not word.isalpha():
+        return word
+
+    if not word.endswith(_KEEP_ENDINGS):
+        for suffix, replacement in _SUFFIXES:
+            if word.endswith(suffix):
+                candidate = word[:len(word) - len(suffix)] + replacement
+                if len(candidate) >= 3 and _VOWELS.intersection(candidate):
+                    word = candidate
+                break
+
+    if len(word) > 4 and word.endswith("e"):
+        word = word[:-1]
+    if len(word) >= 4 and word[-1] == word[-2] and word[-1] not in "lsz" and word[-1] not in _VOWELS:
+        word = word[:-1]
+    return word
+
+
+@lru_cache(maxsize=65536)
+def _term(token):
+    return sys.intern(stem(token))
+
+
+def _apply_synonyms(tokens):
+    if _SYNONYM_STARTS.isdisjoint(tokens):
+        return tokens
+
+    expanded = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in _SYNONYM_STARTS:
+            replacement = PHRASE_SYNONYMS.get(tuple(tokens[i:i + 3]))
+            length = 3
+            if replacement is None:
+                replacement = PHRASE_SYNONYMS.get(tuple(tokens[i:i + 2]))
+                length = 2
+            if replacement is not None:
+                expanded.extend(replacement)
+                i += length
+                continue
+            if token in ABBREVIATIONS:
+                expanded.extend(ABBREVIATIONS[token])
+                i += 1
+                continue
+        expanded.append(token)
+        i += 1
+    return expanded
+
+
+_SYNONYM_STARTS = frozenset(phrase[0] for phrase in PHRASE_SYNONYMS) | frozenset(ABBREVIATIONS)
+
+
+def normalize(text):
+    """
+    Turn text into index terms.
+
+    The same pipeline runs over document titles and contents at index time
+    and over queries at search time: lowercase, drop apostrophes and
+    possessives, split on non-alphanumerics, rewrite lay phrases and expand
+    abbreviations, drop stopwords, stem.
+
+    Args:
+        text (str): Raw text
+
+    Returns:
+        list: Interned terms in text order, duplicates included
+    """
+    text = APOSTROPHE_PATTERN.sub("", text.lower())
+    tokens = _apply_synonyms(TOKEN_PATTERN.findall(text))
+    return [_term(token) for token in tokens if token not in STOPWORDS]
+
+
+def unique_terms(text):
+    """Return the distinct terms of text in order of first occurrence."""
+    return tuple(dict.fromkeys(normalize(text)))
@@ -0,0 +1,269 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from azure_clients import get_chat_client
+from profiler import current_record
+
+logger = logging.getLogger(__name__)
+
+# Deadline used until a call kind has enough latency samples, and its bounds
+UPSTREAM_TIMEOUT = float(os.environ.get("UPSTREAM_TIMEOUT", "30"))
+UPSTREAM_MIN_TIMEOUT = float(os.environ.get("UPSTREAM_MIN_TIMEOUT", "5"))
+UPSTREAM_MAX_TIMEOUT = float(os.environ.get("UPSTREAM_MAX_TIMEOUT", "60"))
+# Adaptive deadline = multiplier x observed p99
+UPSTREAM_TIMEOUT_MULTIPLIER = float(os.environ.get("UPSTREAM_TIMEOUT_MULTIPLIER", "3"))
+UPSTREAM_HEDGING = os.environ.get("UPSTREAM_HEDGING", "0").lower() in ("1", "true", "yes")
+UPSTREAM_HEDGE_PERCENTILE = float(os.environ.get("UPSTREAM_HEDGE_PERCENTILE", "95"))
+# Hedges may add at most this fraction of extra calls
+UPSTREAM_HEDGE_BUDGET = float(os.environ.get("UPSTREAM_HEDGE_BUDGET", "0.05"))
+UPSTREAM_MAX_WORKERS = int(os.environ.get("UPSTREAM_MAX_WORKERS", "32"))
+
+LATENCY_WINDOW = 500
+MIN_SAMPLES = 20
+HEDGE_BURST = 10
+
+
+class UpstreamTimeout(TimeoutError):
+    """Raised when an upstream call (and any hedge) misses its deadline."""
+
+
+class LatencyTracker:
+    def __init__(self, window=LATENCY_WINDOW):
+        """Sliding window of recent call latencies in seconds; a timed-out call counts as its deadline."""
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._samples)
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if not ordered:
+            return None
+        rank = (len(ordered) - 1) * pct / 100
+        low = int(rank)
+        high = min(low + 1, len(ordered) - 1)
+        return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+class HedgeBudget:
+    def __init__(self, ratio=UPSTREAM_HEDGE_BUDGET, burst=HEDGE_BURST):
+        """
+        Allowance of hedged calls: every call earns ratio of a hedge, up to burst.
+
+        With a ratio of 0.05 hedging can add at most 5% to upstream traffic
+        (plus the initial burst), however slow the upstream gets.
+        """
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class UpstreamCaller:
+    def __init__(self, timeout=UPSTREAM_TIMEOUT, min_timeout=UPSTREAM_MIN_TIMEOUT, max_timeout=UPSTREAM_MAX_TIMEOUT,
+                 timeout_multiplier=UPSTREAM_TIMEOUT_MULTIPLIER, hedging=UPSTREAM_HEDGING,
+                 hedge_percentile=UPSTREAM_HEDGE_PERCENTILE, hedge_budget=UPSTREAM_HEDGE_BUDGET,
+                 max_workers=UPSTREAM_MAX_WORKERS):
+        """
+        Chat completions with adaptive deadlines and optional hedging.
+
+        Latencies are tracked separately per call kind ("chat", "knowledge",
+        "image"), since their prompt and output sizes differ. Once a kind has
+        MIN_SAMPLES calls its deadline is timeout_multiplier times the
+        observed p99, clamped to [min_timeout, max_timeout]; before that the
+        fixed timeout applies. The deadline bounds the whole SDK call,
+        including its own retries. A call that times out is recorded at the
+        deadline it hit, a lower bound of its real latency: if the upstream
+        slows down past the deadline, the timeouts raise the p99 and with it
+        the deadline, instead of every call failing under a deadline only
+        fast samples ever set.
+
+        With hedging on, a call still running after the kind's
+        hedge_percentile latency gets a duplicate request, if the hedge
+        budget allows, and whichever succeeds first is returned.
+
+        Args:
+            timeout (float): Deadline in seconds before enough samples exist
+            min_timeout (float): Lower bound of the adaptive deadline
+            max_timeout (float): Upper bound of the adaptive deadline
+            timeout_multiplier (float): Deadline as a multiple of p99
+            hedging (bool): Whether to send hedged requests
+            hedge_percentile (float): Latency percentile after which to hedge
+            hedge_budget (float): Hedges allowed per call on average
+            max_workers (int): Threads available for hedged calls
+        """
+        self.timeout = timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.timeout_multiplier = timeout_multiplier
+        self.hedging = hedging
+        self.hedge_percentile = hedge_percentile
+        self.budget = HedgeBudget(hedge_budget)
+        self.max_workers = max_workers
+
+        self._trackers = {}
+        self._executor = None
+        self._lock = threading.Lock()
+        self._counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "timeouts": 0}
+
+    def deadline(self, kind):
+        """Return the deadline in seconds for the next call of this kind."""
+        tracker = self._tracker(kind)
+        if len(tracker) < MIN_SAMPLES:
+            return self.timeout
+        adaptive = tracker.percentile(99) * self.timeout_multiplier
+        return min(max(adaptive, self.min_timeout), self.max_timeout)
+
+    def hedge_delay(self, kind):
+        """Return how long to wait before hedging, or None when hedging is off or unsupported yet."""
+        if not self.hedging:
+            return None
+        tracker = self._tracker(kind)
+        if len(tracker) < MIN_SAMPLES:
+            return None
+        return tracker.percentile(self.hedge_percentile)
+
+    def complete(self, kind, **kwargs):
+        """
+        Call ChatCompletionsClient.complete under the kind's deadline.
+
+        Args:
+            kind (str): Latency class of the call, e.g. "chat" or "image"
+            **kwargs: Arguments for ChatCompletionsClient.complete
+
+        Returns:
+            ChatCompletions: The first successful response
+
+        Raises:
+            UpstreamTimeout: If no response arrived before the deadline
+        """
+        deadline = self.deadline(kind)
+        delay = self.hedge_delay(kind)
+        self._count("calls")
+        self.budget.earn()
+
+        start = time.monotonic()
+        try:
+            if delay is None or delay >= deadline:
+                return self._call(kind, deadline, kwargs)
+            return self._hedged_call(kind, deadline, delay, kwargs)
+        except Exception as e:
+            if isinstance(e, UpstreamTimeout) or type(e).__name__ == "ServiceResponseTimeoutError":
+                self._count("timeouts")
+                self._tracker(kind).record(deadline)
+                logger.warning("Upstream %s call timed out after %.1f s", kind, deadline)
+            raise
+        finally:
+            # Each call of a request, failed ones included, as request captures replay them
+            record = current_record()
+            if record is not None:
+                record.append("upstream_ms", round((time.monotonic() - start) * 1000, 1))
+
+    def stats(self):
+        kinds = {}
+        for kind, tracker in list(self._trackers.items()):
+            kinds[kind] = {
+                "samples": len(tracker),
+                "p50_ms": _ms(tracker.percentile(50)),
+                "p95_ms": _ms(tracker.percentile(95)),
+                "p99_ms": _ms(tracker.percentile(99)),
+                "deadline_ms": _ms(self.deadline(kind)),
+                "hedge_delay_ms": _ms(self.hedge_delay(kind)),
+            }
+        with self._lock:
+            counters = dict(self._counters)
+        return dict(counters, hedging=self.hedging, hedge_tokens=round(self.budget.tokens, 2), kinds=kinds)
+
+    def _hedged_call(self, kind, deadline, delay, kwargs):
+        start = time.monotonic()
+        executor = self._get_executor()
+        primary = executor.submit(self._call, kind, deadline, kwargs)
+
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        pending = {primary}
+        hedge = None
+        if self.budget.spend():
+            self._count("hedged")
+            logger.info("Hedging %s call after %.0f ms", kind, delay * 1000)
+            hedge = executor.submit(self._call, kind, deadline - delay, kwargs)
+            pending.add(hedge)
+
+        error = None
+        while pending:
+            remaining = deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count("hedge_wins")
+                    return future.result()
+                error = future.exception()
+
+        if error is not None and not pending:
+            raise error
+        raise UpstreamTimeout(f"Upstream {kind} call exceeded its {deadline:.1f} s timeout")
+
+    def _call(self, kind, deadline, kwargs):
+        start = time.monotonic()
+        # timeout caps the SDK's retry loop and read_timeout the wait for one
+        # response; a read timeout is not retried since the deadline is spent
+        response = get_chat_client().complete(timeout=deadline, read_timeout=deadline, retry_read=0, **kwargs)
+        self._tracker(kind).record(time.monotonic() - start)
+        return response
+
+    def _tracker(self, kind):
+        tracker = self._trackers.get(kind)
+        if tracker is None:
+            with self._lock:
+                tracker = self._trackers.setdefault(kind, LatencyTracker())
+        return tracker
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                        thread_name_prefix="upstream")
+        return self._executor
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+upstream = UpstreamCaller()
+
+
+def complete(kind, **kwargs):
+    """Send a chat completion through the shared UpstreamCaller."""
+    return upstream.complete(kind, **kwargs)